@@ -1,6 +1,6 @@
 import json
 from common.middleware import Middleware
-from common.packet import DataPacket, is_final_packet
+from common.packet import DataPacket, PacketEnvelope, is_final_packet
 from datetime import datetime
 import os
 import signal
@@ -21,6 +21,8 @@ class AggregatorNode:
         self.average_negative_by_client_id: dict[int, tuple[float, int]] = {} #(0, 0)
         self.invested_per_country_by_client_id: dict[int, dict[str, int]] = {}
         self.count_by_actors_by_client_id: dict[int, dict[str, int]] = {}
+        self.average_by_id_by_client_id: dict[int, dict[int, tuple[float, int, str]]] = {} # (total, count, title)
+        self.average_error_by_client_id: dict[int, dict] = {}
 
     def callback(self, ch, method, properties, body):
         try:
@@ -28,10 +30,9 @@ class AggregatorNode:
                 self.input_rabbitmq.close_graceful(method)
                 return
             # Recibir paquete y manejar el cierre en caso de ser un final packet
-            packet_json = body.decode()
-            packet = json.loads(packet_json)
-            header = packet.get("header")
-            client_id = packet.get("client_id")
+            envelope = PacketEnvelope(body)
+            header = envelope.header
+            client_id = envelope.client_id
             if header and is_final_packet(header):
                     if self.operation == "total_invested":
                         # Mando un paquete por país y después el final packet
@@ -44,7 +45,7 @@ class AggregatorNode:
                                     "total": value
                                 }
                             )
-                            self.output_rabbitmq.publish(packet.to_json())
+                            self.output_rabbitmq.publish(packet.encode())
                
                         if client_id in self.invested_per_country_by_client_id:
                             del self.invested_per_country_by_client_id[client_id]
@@ -64,7 +65,7 @@ class AggregatorNode:
                                     "count": self.average_positive_by_client_id[client_id][1]
                                 }
                             )
-                            self.output_rabbitmq.publish(packet_pos.to_json())
+                            self.output_rabbitmq.publish(packet_pos.encode())
 
                         if self.average_negative_by_client_id[client_id][1] > 0:
                             packet_neg = DataPacket(
@@ -76,7 +77,7 @@ class AggregatorNode:
                                     "count": self.average_negative_by_client_id[client_id][1]
                                 }
                             )
-                            self.output_rabbitmq.publish(packet_neg.to_json())
+                            self.output_rabbitmq.publish(packet_neg.encode())
            
                         if client_id in self.average_positive_by_client_id:
                                 del self.average_positive_by_client_id[client_id]
@@ -97,17 +98,45 @@ class AggregatorNode:
                                     "count": count
                                 }
                             )
-                            self.output_rabbitmq.publish(packet.to_json())
+                            self.output_rabbitmq.publish(packet.encode())
          
                         if client_id in self.count_by_actors_by_client_id:
                                 del self.count_by_actors_by_client_id[client_id]
                
                         self.output_rabbitmq.send_final(client_id=client_id)
+
+                    elif self.operation == "average_by":
+                        # Un paquete por id con el promedio de todos los parciales
+                        averages = self.average_by_id_by_client_id.pop(client_id, {})
+                        for movie_id, (total, count, title) in sorted(averages.items()):
+                            packet = DataPacket(
+                                client_id=client_id,
+                                timestamp=datetime.utcnow().isoformat(),
+                                data={
+                                    "id": movie_id,
+                                    "title": title,
+                                    "average": round(total / count, 2),
+                                    "count": count
+                                }
+                            )
+                            self.output_rabbitmq.publish(packet.encode())
+
+                        # Si ningun calculator tuvo datos, reenvio su error como antes
+                        error = self.average_error_by_client_id.pop(client_id, None)
+                        if not averages and error is not None:
+                            packet = DataPacket(
+                                client_id=client_id,
+                                timestamp=datetime.utcnow().isoformat(),
+                                data=error
+                            )
+                            self.output_rabbitmq.publish(packet.encode())
+
+                        self.output_rabbitmq.send_final(client_id=client_id)
                         
                     ch.basic_ack(delivery_tag=method.delivery_tag)
                     return
             
-            packet = DataPacket.from_json(packet_json)
+            packet = envelope.to_packet()
 
             # Procesar paquete segun la operación en cuestion
             if self.operation == "total_invested":
@@ -150,6 +179,20 @@ class AggregatorNode:
 
                 count_movies = self.count_by_actors_by_client_id[client_id].get(actor, 0)
                 self.count_by_actors_by_client_id[client_id][actor] = count_movies + new_count_movies
+            elif self.operation == "average_by":
+                # Parciales de un mismo id (los ids calientes se reparten entre varios calculators)
+                if "error" in packet.data:
+                    self.average_error_by_client_id.setdefault(client_id, packet.data)
+                else:
+                    if client_id not in self.average_by_id_by_client_id:
+                        self.average_by_id_by_client_id[client_id] = {}
+                    movie_id = int(packet.data["id"])
+                    total, count, _ = self.average_by_id_by_client_id[client_id].get(movie_id, (0.0, 0, ""))
+                    self.average_by_id_by_client_id[client_id][movie_id] = (
+                        total + float(packet.data["total"]),
+                        count + int(packet.data["count"]),
+                        packet.data["title"]
+                    )
               
 
             ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -159,7 +202,7 @@ class AggregatorNode:
             print(f" [!] Error decoding JSON: {e}")
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
         except Exception as e:
-            print(f" [!] operation is {self.operation}    Error processing message: {e}, raw packet is {packet_json}")
+            print(f" [!] operation is {self.operation}    Error processing message: {e}, raw packet is {body}")
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
 
     def start_node(self):
@@ -1,5 +1,5 @@
-import ast
 import json
+from common.literal_scanner import parse_literal
 from typing import Dict, Tuple, List, Set
 
 COUNT = "COUNT_BY"
@@ -48,7 +48,7 @@ class Calculation:
         if not value:
             return value
         try:
-            parsed = ast.literal_eval(value)
+            parsed = parse_literal(value, keys=('name',))
             #print(f"Parsed result: {parsed!r}")
             return parsed
         except (ValueError, SyntaxError) as e:
@@ -253,6 +253,7 @@ class Calculation:
                     "id": int(float(key)),
                     "value_field": self.value_field,
                     "average": round(total / count, 2),
+                    "total": total,
                     "count": count,
                     "title": title
                 }
@@ -2,7 +2,7 @@ import json
 import threading
 from common.leader_queue import LeaderQueue
 from common.middleware import Middleware
-from common.packet import DataPacket, is_final_packet
+from common.packet import DataPacket, PacketEnvelope, is_final_packet
 from datetime import datetime
 import os
 import signal
@@ -58,11 +58,11 @@ class CalculatorNode:
                 self.input_rabbitmq.close_graceful(method)
                 return
             # Recibo el paquete y en caso de ser el ultimo, mando los datos y el final packet
-            packet_json = body.decode()
-            packet = json.loads(packet_json)
-            header = packet.get("header")
+            envelope = PacketEnvelope(body)
+            header = envelope.header
             if header and is_final_packet(header):
-                client_id = packet.get("client_id") 
+                packet = envelope.fields()
+                client_id = envelope.client_id
                 results = self.calculator.get_result(client_id)
                 self.output_rabbitmq.confirm_delivery()
                 if not self.exchange:
@@ -87,7 +87,7 @@ class CalculatorNode:
                                     **result
                                 }
                             )
-                            self.output_rabbitmq.publish(data_packet.to_json())
+                            self.output_rabbitmq.publish(data_packet.encode())
                         self.final_rabbitmq.send_final(client_id=client_id)
                     
                     # Si faltan IDs en la lista de acks, reencolo
@@ -112,12 +112,12 @@ class CalculatorNode:
                                 **result
                             }
                         )
-                        self.output_rabbitmq.publish(data_packet.to_json())
+                        self.output_rabbitmq.publish(data_packet.encode())
                     self.final_rabbitmq.send_final(client_id=client_id)
                     ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
             
-            packet = DataPacket.from_json(packet_json)
+            packet = envelope.to_packet()
             movie = packet.data
             client_id = packet.client_id
             # Process movie using calculator
@@ -135,7 +135,7 @@ class CalculatorNode:
             print(f" [!] Error decoding JSON: {e}")
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
         except Exception as e:
-            print(f" [!] Error processing message: {e}, raw packet is {packet_json}")
+            print(f" [!] Error processing message: {e}, raw packet is {body}")
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
 
     def start_node(self): 
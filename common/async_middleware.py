@@ -0,0 +1,353 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from common.middleware import (
+    BlockingMiddleware,
+    _batch_flush_interval,
+    _flush_expired_batches,
+    RABBITMQ_HOST,
+    RABBITMQ_PORT,
+    RABBITMQ_HEARTBEAT,
+)
+
+# Publicaciones sin confirmar por el broker antes de bloquear al que publica
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '1000'))
+ASYNC_CALL_TIMEOUT = float(os.getenv('ASYNC_CALL_TIMEOUT', '30'))
+
+_STOP = object()
+_PERSISTENT = pika.BasicProperties(delivery_mode=2)
+
+
+class _AsyncioConnection:
+    """
+    Loop de asyncio corriendo en un hilo propio con la conexion a RabbitMQ del
+    proceso. Todo lo que toca la conexion o sus canales se ejecuta en ese hilo;
+    el resto de los hilos solo encolan operaciones en el loop.
+
+    Las publicaciones usan publisher confirms: publish() vuelve apenas encola el
+    mensaje y solo bloquea si hay ASYNC_MAX_IN_FLIGHT mensajes sin confirmar.
+    Lo que el broker rechaza (Nack) se vuelve a publicar.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.connection = None
+        self.publish_channel = None
+        self.declared = set()
+        self.users = weakref.WeakSet()
+        # delivery tag -> (exchange, routing_key, body) de lo publicado sin
+        # confirmar, en orden de publicacion (solo hilo del loop)
+        self.unconfirmed = OrderedDict()
+        self.next_delivery_tag = 0
+        self.pending = 0  # publicaciones sin confirmar, visto desde los demas hilos
+        self.condition = threading.Condition()
+        self.call(self._open)
+
+    def call(self, start):
+        """
+        Ejecuta start(done, fail) en el loop y espera a que llame a done(resultado)
+        o a fail(excepcion).
+        """
+        future = Future()
+
+        def done(result=None):
+            if not future.done():
+                future.set_result(result)
+
+        def fail(error):
+            if not future.done():
+                future.set_exception(error if isinstance(error, BaseException) else Exception(str(error)))
+
+        def run():
+            try:
+                start(done, fail)
+            except Exception as e:
+                fail(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return future.result(timeout=ASYNC_CALL_TIMEOUT)
+
+    def call_soon(self, fn, *args, **kwargs):
+        self.loop.call_soon_threadsafe(partial(fn, *args, **kwargs))
+
+    def _open(self, done, fail):
+        def on_channel_open(channel):
+            self.publish_channel = channel
+            channel.confirm_delivery(ack_nack_callback=self._on_confirm, callback=lambda _: done())
+
+        def on_connection_open(connection):
+            connection.channel(on_open_callback=on_channel_open)
+
+        self.connection = AsyncioConnection(
+            pika.ConnectionParameters(host=RABBITMQ_HOST, port=RABBITMQ_PORT, heartbeat=RABBITMQ_HEARTBEAT),
+            on_open_callback=on_connection_open,
+            on_open_error_callback=lambda _, error: fail(error),
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self.loop,
+        )
+
+    def _on_connection_closed(self, _, reason):
+        print(f"[AsyncioMiddleware] Conexion cerrada: {reason}")
+        with self.condition:
+            self.pending = 0
+            self.condition.notify_all()
+
+    def declare(self, key, declare_fn):
+        """Ejecuta declare_fn(channel, callback) en el loop si key no se declaro todavia."""
+        if key in self.declared:
+            return
+        self.call(lambda done, fail: declare_fn(self.publish_channel, lambda _: done()))
+        self.declared.add(key)
+
+    def publish(self, exchange, routing_key, body):
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending < ASYNC_MAX_IN_FLIGHT)
+            self.pending += 1
+        self.loop.call_soon_threadsafe(self._publish, exchange, routing_key, body)
+
+    def _publish(self, exchange, routing_key, body):
+        self.publish_channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=_PERSISTENT)
+        self.next_delivery_tag += 1
+        self.unconfirmed[self.next_delivery_tag] = (exchange, routing_key, body)
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        confirmed = []
+        if method.multiple:
+            # Los delivery tags crecen: lo confirmado esta al principio
+            while self.unconfirmed and next(iter(self.unconfirmed)) <= method.delivery_tag:
+                confirmed.append(self.unconfirmed.popitem(last=False)[1])
+        elif method.delivery_tag in self.unconfirmed:
+            confirmed.append(self.unconfirmed.pop(method.delivery_tag))
+        if isinstance(method, pika.spec.Basic.Nack):
+            # Siguen pendientes: se publican de nuevo con otro delivery tag
+            print(f"[AsyncioMiddleware] El broker rechazo {len(confirmed)} mensajes (delivery tag {method.delivery_tag}), se vuelven a publicar")
+            for exchange, routing_key, body in confirmed:
+                self._publish(exchange, routing_key, body)
+            return
+        with self.condition:
+            self.pending -= len(confirmed)
+            self.condition.notify_all()
+
+    def wait_for_confirms(self):
+        """Bloquea hasta que el broker confirme todo lo publicado."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending <= 0)
+
+    def start_consumer(self, queue_name, consumer_tag, prefetch_count, deliveries):
+        """Abre un canal para consumir queue_name, dejando cada entrega en deliveries."""
+        def start(done, fail):
+            def on_message(_channel, method, properties, body):
+                deliveries.put((method, properties, body))
+
+            def on_qos(channel):
+                channel.basic_consume(
+                    queue=queue_name,
+                    on_message_callback=on_message,
+                    auto_ack=False,
+                    consumer_tag=consumer_tag,
+                    callback=lambda _: done(channel)
+                )
+
+            def on_channel_open(channel):
+                channel.basic_qos(prefetch_count=prefetch_count, callback=lambda _: on_qos(channel))
+
+            self.connection.channel(on_open_callback=on_channel_open)
+        return self.call(start)
+
+    def release(self, user):
+        """Cuando ya no queda ningun Middleware abierto, cierra la conexion."""
+        self.users.discard(user)
+        if len(self.users) > 0:
+            return
+        self.wait_for_confirms()
+        self.call_soon(self._close)
+
+    def _close(self):
+        if self.connection and not self.connection.is_closed:
+            self.connection.close()
+
+
+_connection = None
+_connection_lock = threading.Lock()
+
+def _get_connection(user):
+    global _connection
+    with _connection_lock:
+        if _connection is None or _connection.connection.is_closed:
+            _connection = _AsyncioConnection()
+        _connection.users.add(user)
+        return _connection
+
+def _reset_after_fork():
+    # El hilo del loop no existe en el proceso hijo
+    global _connection, _connection_lock
+    _connection = None
+    _connection_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _AsyncioChannel:
+    """
+    Lo que reciben los callbacks como `ch`: los ack/nack se encolan en el loop
+    sin esperar respuesta del broker.
+    """
+    def __init__(self, io, channel, deliveries):
+        self.io = io
+        self.channel = channel
+        self.deliveries = deliveries
+
+    @property
+    def is_open(self):
+        return self.channel.is_open
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.io.call_soon(self.channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.io.call_soon(self.channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+    def stop_consuming(self):
+        self.deliveries.put(_STOP)
+
+
+class AsyncioMiddleware(BlockingMiddleware):
+    """
+    Middleware sobre pika.AsyncioConnection, con la misma interfaz que
+    BlockingMiddleware. La E/S de red corre en el hilo del loop, en paralelo
+    con el procesamiento de los callbacks: las publicaciones no esperan al
+    broker y las entregas se van recibiendo mientras el callback anterior
+    todavia esta procesando.
+    Se elige con MIDDLEWARE_BACKEND=asyncio.
+    """
+    def connect(self):
+        self.io = _get_connection(self)
+        self.connection = self.io.connection
+        self.channel = self.io.publish_channel
+        if self.exchange:
+            print(f"[Middleware] Declarando exchange '{self.exchange}' de tipo '{self.exchange_type}'...")
+            self.io.declare(('exchange', self.exchange), lambda channel, callback: channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type, durable=True, callback=callback))
+
+            if self.queue:
+                print(f"[Middleware] Declarando cola '{self.queue}' (durable=False)...")
+                self.io.declare(('queue', self.queue), lambda channel, callback: channel.queue_declare(queue=self.queue, durable=True, callback=callback))
+
+                print(f"[Middleware] Enlazando cola '{self.queue}' al exchange '{self.exchange}'...")
+                self.io.declare(('bind', self.queue, self.exchange, self.routing_key), lambda channel, callback: channel.queue_bind(queue=self.queue, exchange=self.exchange, routing_key=self.routing_key, callback=callback))
+        else:
+            self.io.declare(('queue', self.queue), lambda channel, callback: channel.queue_declare(queue=self.queue, durable=True, callback=callback))
+
+    def _send(self, body, routing_key=''):
+        if self.exchange and self.publish_to_exchange:
+            self.io.publish(self.exchange, routing_key, body)
+            print(f" [x] Sent message to exchange {self.exchange} with routing key {routing_key}")
+        else:
+            self.io.publish('', self.queue, body)
+            print(f" [x] Sent message to queue {self.queue}")
+        if self.confirm:
+            self.io.wait_for_confirms()
+
+    def consume(self, callback, process_batch=None):
+        if not self.channel:
+            self.connect()
+        self.deliveries = queue.Queue()
+        consumer_channel = self.io.start_consumer(self.queue, self.consumer_tag, self.prefetch_count, self.deliveries)
+        self.channel = _AsyncioChannel(self.io, consumer_channel, self.deliveries)
+        self.ack_channel = self._make_ack_channel(self.channel)
+
+        # Cada cuanto hay que mandar los acks pendientes y vaciar los batches vencidos
+        intervals = [self.ack_timeout] if self.ack_channel else []
+        batch_interval = _batch_flush_interval()
+        if batch_interval is not None:
+            intervals.append(batch_interval)
+        tick_interval = min(intervals) if intervals else None
+        last_tick = time.monotonic()
+        consumer_thread = threading.get_ident()
+
+        print(f" [*] Waiting for messages in {self.queue}")
+        try:
+            while True:
+                try:
+                    item = self.deliveries.get(timeout=tick_interval)
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                if item is not None:
+                    method, properties, body = item
+                    self._deliver(callback, process_batch, self.channel, method, properties, body)
+                if tick_interval is not None and time.monotonic() - last_tick >= tick_interval:
+                    self._flush_acks()
+                    _flush_expired_batches(consumer_thread)
+                    last_tick = time.monotonic()
+        finally:
+            self._flush_acks()
+
+    def _passive_declare(self):
+        frame = self.io.call(lambda done, fail: self.io.publish_channel.queue_declare(queue=self.queue, passive=True, callback=done))
+        return frame.method
+
+    def check_no_consumers(self):
+        """Verifica si hay 0 consumidores en la cola de control."""
+        if not self.channel:
+            self.connect()
+        consumer_count = self._passive_declare().consumer_count
+        print(f" [x] Control queue has {consumer_count} active consumers")
+        return consumer_count == 1
+
+    def check_messages(self):
+        if not self.channel:
+            self.connect()
+        count = self._passive_declare().message_count
+        print(f" [x] Queue has {count} messages")
+
+    def purge(self):
+        if not self.channel:
+            self.connect()
+        self.io.call(lambda done, fail: self.io.publish_channel.queue_purge(queue=self.queue, callback=done))
+        print(f"[Middleware] Cola '{self.queue}' purgada.")
+
+    def close_graceful(self, method):
+        self.closing = True
+        self._flush_acks()
+        if isinstance(self.channel, _AsyncioChannel):
+            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            self.channel.stop_consuming()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.batches:
+                self.flush()
+        except Exception as e:
+            print(f"Failed to flush pending batches. Error: {e}")
+        try:
+            self.io.release(self)
+        except Exception as e:
+            print(f"Failed to close connection. Error: {e}")
+
+    def cancel_consumer(self):
+        if isinstance(self.channel, _AsyncioChannel):
+            consumer_channel = self.channel.channel
+            if self.consumer_tag and consumer_channel.is_open:
+                self.io.call_soon(consumer_channel.basic_cancel, self.consumer_tag)
+            self.channel.stop_consuming()
+            print("Consumidor cancelado exitosamente")
+
+    def delete_queue(self):
+        if self.channel:
+            self.io.call(lambda done, fail: self.io.publish_channel.queue_delete(queue=self.queue, callback=done))
+            print(f"[Middleware] Cola '{self.queue}' eliminada.")
@@ -0,0 +1,35 @@
+class HeavyHitters:
+    """
+    Sketch de claves frecuentes de un stream en memoria acotada (Misra-Gries,
+    la variante de Space-Saving que descuenta en vez de reemplazar): guarda a
+    lo sumo `capacity` contadores, y toda clave con mas de total / capacity
+    apariciones tiene el suyo. Los conteos subestiman en a lo sumo
+    total / capacity, asi que alcanzan para detectar las claves calientes.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.total = 0
+
+    def add(self, key):
+        """Cuenta una aparicion de key y devuelve su conteo estimado."""
+        self.total += 1
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+        elif len(counts) < self.capacity:
+            counts[key] = 1
+        else:
+            # Descuento uno a todos: cada descuento se paga con una aparicion
+            # ya contada, asi que es O(1) amortizado
+            for other in list(counts):
+                if counts[other] == 1:
+                    del counts[other]
+                else:
+                    counts[other] -= 1
+            return 0
+        return counts[key]
+
+    def share(self, key):
+        """Fraccion estimada del stream que es key."""
+        return self.counts.get(key, 0) / self.total if self.total else 0.0
@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+import orjson
+from common.middleware import Middleware
+
+# Clientes terminados que se recuerdan para ignorar sus key sets atrasados
+FINISHED_CLIENTS_CAPACITY = 1024
+
+
+def key_set_message(client_id, node_id, keys):
+    """Mensaje con las claves del lado main de un join para un cliente (ver KeySetListener)."""
+    return {"client_id": client_id, "node_id": str(node_id), "keys": sorted(keys)}
+
+
+class KeySetListener:
+    """
+    Escucha los conjuntos de claves que publica cada JoinNode cuando termina su
+    lado main (semi-join): para cada cliente y nodo del join, las claves con las
+    que ese nodo puede llegar a joinear. Mientras un nodo no publico su conjunto
+    todas las claves pueden joinear, asi que descartar con may_join nunca pierde
+    resultados; solo evita mandar filas que el join tiraria.
+
+    Cada instancia se suscribe con su propia cola al exchange, porque todas
+    tienen que recibir todos los conjuntos. Un conjunto que llega despues de
+    forget(client_id) se ignora, para no guardarlo para siempre.
+    """
+    def __init__(self, exchange, queue, consumer_tag):
+        self.exchange = exchange
+        self.queue = queue
+        self.key_sets = {}  # (client_id, node_id) -> frozenset de claves
+        self.finished_clients = OrderedDict()  # Ultimos clientes terminados (como un set acotado)
+        self.lock = threading.Lock()
+        self.running = True
+
+        self.key_set_rabbitmq = Middleware(
+            queue=queue,
+            consumer_tag=consumer_tag,
+            exchange=exchange,
+            publish_to_exchange=False
+        )
+
+        self.thread = threading.Thread(target=self.consume)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def callback(self, ch, method, properties, body):
+        try:
+            if self.running == False:
+                self.key_set_rabbitmq.close_graceful(method)
+                return
+            message = orjson.loads(body)
+            client_id = message["client_id"]
+            node_id = message["node_id"]
+            with self.lock:
+                finished = client_id in self.finished_clients
+                if not finished:
+                    self.key_sets[(client_id, node_id)] = frozenset(message["keys"])
+            if finished:
+                print(f" [~] Key set del nodo {node_id} para cliente '{client_id}' ya terminado, se ignora")
+            else:
+                print(f" [~] Key set recibido del nodo {node_id} para cliente '{client_id}': {len(message['keys'])} claves")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+        except Exception as e:
+            print(f" [!] Error processing key set from {self.exchange}: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
+
+    def may_join(self, client_id, node_id, key):
+        """False solo si el nodo ya publico sus claves para el cliente y key no esta entre ellas."""
+        key_set = self.key_sets.get((client_id, node_id))
+        return key_set is None or key in key_set
+
+    def forget(self, client_id):
+        """Descarta los conjuntos de un cliente que ya termino, y los que lleguen despues."""
+        with self.lock:
+            for entry in [entry for entry in self.key_sets if entry[0] == client_id]:
+                del self.key_sets[entry]
+            self.finished_clients[client_id] = None
+            self.finished_clients.move_to_end(client_id)
+            while len(self.finished_clients) > FINISHED_CLIENTS_CAPACITY:
+                self.finished_clients.popitem(last=False)
+
+    def consume(self):
+        try:
+            self.key_set_rabbitmq.consume(self.callback)
+        except Exception as e:
+            print(f" [!] Error consuming key sets from {self.exchange}: {e}")
+        finally:
+            print(f" [!] Stopped consuming key sets from {self.exchange}")
+            self.key_set_rabbitmq.close()
+
+    def close(self):
+        """Corta el consumo y espera al hilo."""
+        self.running = False
+        self.key_set_rabbitmq.cancel_consumer()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.key_set_rabbitmq.close()
@@ -0,0 +1,122 @@
+import ast
+import re
+
+_STRING = r"'(?:[^'\\]|\\.)*'" + r'|"(?:[^"\\]|\\.)*"'
+_WORD = r"""[^\s\[\]{}:,'"]+"""
+
+# Un token por entrada de dict ("'clave': valor," con su separador), string,
+# simbolo, palabra suelta (numeros, None, True, False) o caracter inesperado
+# (una comilla sin cerrar). Las entradas en un solo match ahorran la mayor
+# parte del trabajo en Python: los dicts de TMDB son casi todo entradas.
+_TOKEN = re.compile(
+    rf"""({_STRING})\s*:\s*({_STRING}|{_WORD})\s*([,}}])|({_STRING})|([\[\]{{}}:,])|({_WORD})|(\S)""",
+    re.S
+)
+
+_WORDS = {'None': None, 'True': True, 'False': False}
+
+
+def _string(token):
+    if '\\' in token:
+        # Solo los strings con escapes pasan por el parser de Python
+        return ast.literal_eval(token)
+    return token[1:-1]
+
+
+def _value(token):
+    if token[0] in '\'"':
+        return _string(token)
+    if token in _WORDS:
+        return _WORDS[token]
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+
+def _dict(tokens, position, keys):
+    """Parsea un dict plano desde despues de su '{'. Devuelve (dict, posicion)."""
+    result = {}
+    while True:
+        key, value, end, _, symbol, _, _ = tokens[position]
+        position += 1
+        if key:
+            key = _string(key)
+            if keys is None or key in keys:
+                result[key] = _value(value)
+            if end == '}':
+                return result, position
+        elif symbol == '}':
+            return result, position
+        else:
+            raise ValueError("Expected a flat dict entry in literal")
+
+
+def _list(tokens, position, keys):
+    """Parsea una lista de dicts planos o escalares desde despues de su '['."""
+    result = []
+    while True:
+        _, _, _, string, symbol, word, _ = tokens[position]
+        position += 1
+        if symbol == '{':
+            item, position = _dict(tokens, position, keys)
+        elif string:
+            item = _string(string)
+        elif word:
+            item = _value(word)
+        elif symbol == ']':
+            return result, position
+        else:
+            raise ValueError("Unexpected token in literal list")
+        result.append(item)
+        symbol = tokens[position][4]
+        position += 1
+        if symbol == ']':
+            return result, position
+        if symbol != ',':
+            raise ValueError("Expected ',' or ']' in literal")
+
+
+def scan_literal(text, keys=None):
+    """
+    Parsea en una sola pasada un literal de Python como los de TMDB: una lista
+    de dicts planos ("[{'id': 16, 'name': 'Animation'}, ...]"), una lista de
+    escalares o un dict plano. De cada dict se quedan solo las claves de keys
+    (todas si es None). Levanta ValueError si el literal no tiene esa forma.
+    """
+    tokens = _TOKEN.findall(text)
+    try:
+        symbol = tokens[0][4]
+        if symbol == '[':
+            result, position = _list(tokens, 1, keys)
+        elif symbol == '{':
+            result, position = _dict(tokens, 1, keys)
+        else:
+            raise ValueError("Literal is not a list or a dict")
+    except IndexError:
+        raise ValueError("Unexpected end of literal")
+    if position != len(tokens):
+        raise ValueError("Unexpected data after literal")
+    return result
+
+
+def parse_literal(text, keys=None):
+    """
+    Igual que scan_literal, pero los literales con otra forma los parsea
+    ast.literal_eval (en ese caso los dicts vienen con todas sus claves).
+    Levanta ValueError o SyntaxError como ast.literal_eval.
+    """
+    try:
+        return scan_literal(text, keys)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
+def literal_names(text):
+    """Los 'name' de una lista de dicts como "[{'id': 16, 'name': 'Animation'}]"."""
+    parsed = parse_literal(text, keys=('name',))
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        raise ValueError(f"Expected a list, got {type(parsed).__name__}")
+    return [item.get('name', '') if isinstance(item, dict) else str(item) for item in parsed]
@@ -0,0 +1,357 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from multiprocessing.managers import BaseManager
+import pika
+from common.middleware import (
+    BlockingMiddleware,
+    _batch_flush_interval,
+    _flush_expired_batches,
+)
+
+# host:port del broker compartido entre procesos (ver serve_broker). Si no se
+# indica, cada proceso tiene su propio broker en memoria.
+MEMORY_BROKER_ADDRESS = os.getenv('MEMORY_BROKER_ADDRESS', '')
+MEMORY_BROKER_AUTHKEY = os.getenv('MEMORY_BROKER_AUTHKEY', 'memory-broker')
+# Cada cuanto el consumidor revisa si lo cancelaron mientras espera mensajes
+MEMORY_POLL_INTERVAL = float(os.getenv('MEMORY_POLL_INTERVAL', '0.1'))
+
+_PERSISTENT = pika.BasicProperties(delivery_mode=2)
+
+
+class MemoryBroker:
+    """
+    Broker en memoria con la semantica de RabbitMQ que usa el pipeline:
+    exchanges direct, colas compartidas entre varios consumidores, prefetch,
+    ack/nack (con multiple) y reencolado de los mensajes sin ackear cuando un
+    consumidor se va. Los mensajes publicados a un exchange sin colas enlazadas
+    para la routing key se descartan, igual que en RabbitMQ.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.exchanges = {}  # exchange -> {routing_key: [colas]}
+        self.queues = {}  # cola -> deque de (body, redelivered)
+        self.conditions = {}  # cola -> Condition sobre self.lock
+        self.consumers = {}  # cola -> cantidad de consumidores
+        self.unacked = {}  # consumer_id -> OrderedDict(delivery_tag -> (cola, body))
+        self.next_delivery_tag = 0
+        self.next_consumer_id = 0
+
+    def exchange_declare(self, exchange):
+        with self.lock:
+            self.exchanges.setdefault(exchange, {})
+
+    def queue_declare(self, queue):
+        """Declara la cola si no existe y devuelve (mensajes, consumidores)."""
+        with self.lock:
+            self._queue(queue)
+            return len(self.queues[queue]), self.consumers.get(queue, 0)
+
+    def queue_bind(self, queue, exchange, routing_key=''):
+        with self.lock:
+            self._queue(queue)
+            bound = self.exchanges.setdefault(exchange, {}).setdefault(routing_key, [])
+            if queue not in bound:
+                bound.append(queue)
+
+    def queue_purge(self, queue):
+        with self.lock:
+            if queue in self.queues:
+                self.queues[queue].clear()
+
+    def queue_delete(self, queue):
+        with self.lock:
+            self.queues.pop(queue, None)
+            condition = self.conditions.pop(queue, None)
+            for bindings in self.exchanges.values():
+                for bound in bindings.values():
+                    if queue in bound:
+                        bound.remove(queue)
+            if condition is not None:
+                condition.notify_all()
+
+    def _queue(self, queue):
+        if queue not in self.queues:
+            self.queues[queue] = deque()
+            self.conditions[queue] = threading.Condition(self.lock)
+
+    def publish(self, exchange, routing_key, body):
+        with self.lock:
+            if exchange:
+                targets = self.exchanges.get(exchange, {}).get(routing_key, ())
+            else:
+                targets = (routing_key,) if routing_key in self.queues else ()
+            for queue in targets:
+                self.queues[queue].append((body, False))
+                self.conditions[queue].notify_all()
+
+    def basic_consume(self, queue):
+        """Registra un consumidor de la cola y devuelve su id."""
+        with self.lock:
+            self._queue(queue)
+            self.next_consumer_id += 1
+            self.consumers[queue] = self.consumers.get(queue, 0) + 1
+            self.unacked[self.next_consumer_id] = OrderedDict()
+            return self.next_consumer_id
+
+    def basic_cancel(self, consumer_id, queue):
+        """Da de baja al consumidor, reencolando lo que no llego a ackear."""
+        with self.lock:
+            self.consumers[queue] = max(0, self.consumers.get(queue, 0) - 1)
+            self._requeue(self.unacked.pop(consumer_id, OrderedDict()))
+
+    def get(self, consumer_id, queue, prefetch_count, timeout):
+        """
+        Espera hasta timeout segundos un mensaje de la cola para el consumidor,
+        respetando su prefetch. Devuelve (delivery_tag, body, redelivered) o None.
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            unacked = self.unacked.get(consumer_id)
+            while True:
+                pending = self.queues.get(queue)
+                if unacked is None or pending is None:
+                    return None
+                if pending and len(unacked) < prefetch_count:
+                    body, redelivered = pending.popleft()
+                    self.next_delivery_tag += 1
+                    unacked[self.next_delivery_tag] = (queue, body)
+                    return self.next_delivery_tag, body, redelivered
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.conditions[queue].wait(remaining)
+
+    def ack(self, consumer_id, delivery_tag, multiple=False):
+        with self.lock:
+            self._resolve(consumer_id, delivery_tag, multiple)
+
+    def nack(self, consumer_id, delivery_tag, multiple=False, requeue=True):
+        with self.lock:
+            resolved = OrderedDict(self._resolve(consumer_id, delivery_tag, multiple))
+            if requeue:
+                self._requeue(resolved)
+
+    def _resolve(self, consumer_id, delivery_tag, multiple):
+        unacked = self.unacked.get(consumer_id)
+        if not unacked:
+            return []
+        if not multiple:
+            message = unacked.pop(delivery_tag, None)
+            resolved = [(delivery_tag, message)] if message else []
+        else:
+            tags = [tag for tag in unacked if tag <= delivery_tag]
+            resolved = [(tag, unacked.pop(tag)) for tag in tags]
+        # Al liberar lugar del prefetch puede haber consumidores esperando
+        for queue in {queue for _, (queue, _) in resolved}:
+            if queue in self.conditions:
+                self.conditions[queue].notify_all()
+        return resolved
+
+    def _requeue(self, messages):
+        # Vuelven al principio de la cola, en el orden en que se habian entregado
+        for queue, body in reversed(list(messages.values())):
+            if queue in self.queues:
+                self.queues[queue].appendleft((body, True))
+                self.conditions[queue].notify_all()
+
+
+class _BrokerManager(BaseManager):
+    pass
+
+_served_broker = None
+
+def _serve_local_broker():
+    global _served_broker
+    if _served_broker is None:
+        _served_broker = MemoryBroker()
+    return _served_broker
+
+_BrokerManager.register('broker', callable=_serve_local_broker)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    """Broker del proceso: el compartido en MEMORY_BROKER_ADDRESS o uno local."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            if MEMORY_BROKER_ADDRESS:
+                host, port = MEMORY_BROKER_ADDRESS.rsplit(':', 1)
+                manager = _BrokerManager(address=(host, int(port)), authkey=MEMORY_BROKER_AUTHKEY.encode())
+                manager.connect()
+                _broker = manager.broker()
+            else:
+                _broker = MemoryBroker()
+        return _broker
+
+def serve_broker(host='127.0.0.1', port=0, authkey=MEMORY_BROKER_AUTHKEY):
+    """
+    Levanta el broker en un proceso aparte para compartirlo entre procesos y lo
+    deja como broker de este proceso. Devuelve el manager (para apagarlo con
+    shutdown()) y la direccion host:port que hay que pasarle a los demas
+    procesos en MEMORY_BROKER_ADDRESS.
+    """
+    global _broker
+    manager = _BrokerManager(address=(host, port), authkey=authkey.encode())
+    manager.start()
+    with _broker_lock:
+        _broker = manager.broker()
+    address = manager.address
+    return manager, f"{address[0]}:{address[1]}"
+
+def _reset_after_fork():
+    # Un broker local copiado por el fork no lo comparte nadie mas
+    global _broker, _broker_lock
+    _broker = None
+    _broker_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _MemoryChannel:
+    """Lo que reciben los callbacks como `ch`, sobre el consumidor del broker."""
+    def __init__(self, broker, queue):
+        self.broker = broker
+        self.queue = queue
+        self.consumer_id = None
+        self.stopped = threading.Event()
+        self.closed = False
+
+    @property
+    def is_open(self):
+        return not self.closed
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.broker.ack(self.consumer_id, delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.broker.nack(self.consumer_id, delivery_tag, multiple, requeue)
+
+    def stop_consuming(self):
+        self.stopped.set()
+
+
+class MemoryMiddleware(BlockingMiddleware):
+    """
+    Middleware sobre un broker en memoria, con la misma interfaz que
+    BlockingMiddleware. Permite correr el pipeline entero en un proceso (o en
+    varios procesos de una misma maquina con serve_broker) sin RabbitMQ, para
+    medirlo y perfilarlo. Los mensajes no se persisten.
+    Se elige con MIDDLEWARE_BACKEND=memory.
+    """
+    def connect(self):
+        self.broker = get_broker()
+        self.channel = _MemoryChannel(self.broker, self.queue)
+        if self.exchange:
+            print(f"[Middleware] Declarando exchange '{self.exchange}' de tipo '{self.exchange_type}'...")
+            self.broker.exchange_declare(self.exchange)
+
+            if self.queue:
+                print(f"[Middleware] Declarando cola '{self.queue}' (durable=False)...")
+                self.broker.queue_declare(self.queue)
+
+                print(f"[Middleware] Enlazando cola '{self.queue}' al exchange '{self.exchange}'...")
+                self.broker.queue_bind(self.queue, self.exchange, self.routing_key)
+        else:
+            self.broker.queue_declare(self.queue)
+
+    def _send(self, body, routing_key=''):
+        if self.exchange and self.publish_to_exchange:
+            self.broker.publish(self.exchange, routing_key, body)
+            print(f" [x] Sent message to exchange {self.exchange} with routing key {routing_key}")
+        else:
+            self.broker.publish('', self.queue, body)
+            print(f" [x] Sent message to queue {self.queue}")
+
+    def consume(self, callback, process_batch=None):
+        if not self.channel:
+            self.connect()
+        channel = self.channel
+        if channel.stopped.is_set():
+            return
+        channel.consumer_id = self.broker.basic_consume(self.queue)
+        self.ack_channel = self._make_ack_channel(channel)
+
+        # Cada cuanto hay que mandar los acks pendientes y vaciar los batches vencidos
+        intervals = [self.ack_timeout] if self.ack_channel else []
+        batch_interval = _batch_flush_interval()
+        if batch_interval is not None:
+            intervals.append(batch_interval)
+        tick_interval = min(intervals) if intervals else None
+        poll_interval = min([MEMORY_POLL_INTERVAL] + intervals)
+        last_tick = time.monotonic()
+        consumer_thread = threading.get_ident()
+
+        print(f" [*] Waiting for messages in {self.queue}")
+        try:
+            while not channel.stopped.is_set():
+                delivery = self.broker.get(channel.consumer_id, self.queue, self.prefetch_count, poll_interval)
+                if delivery is not None:
+                    delivery_tag, body, redelivered = delivery
+                    method = pika.spec.Basic.Deliver(
+                        consumer_tag=self.consumer_tag,
+                        delivery_tag=delivery_tag,
+                        redelivered=redelivered,
+                        routing_key=self.routing_key
+                    )
+                    self._deliver(callback, process_batch, channel, method, _PERSISTENT, body)
+                if tick_interval is not None and time.monotonic() - last_tick >= tick_interval:
+                    self._flush_acks()
+                    _flush_expired_batches(consumer_thread)
+                    last_tick = time.monotonic()
+        finally:
+            self._flush_acks()
+            self.broker.basic_cancel(channel.consumer_id, self.queue)
+            channel.closed = True
+
+    def check_no_consumers(self):
+        """Verifica si hay 0 consumidores en la cola de control."""
+        if not self.channel:
+            self.connect()
+        _, consumer_count = self.broker.queue_declare(self.queue)
+        print(f" [x] Control queue has {consumer_count} active consumers")
+        return consumer_count == 1
+
+    def check_messages(self):
+        if not self.channel:
+            self.connect()
+        count, _ = self.broker.queue_declare(self.queue)
+        print(f" [x] Queue has {count} messages")
+
+    def purge(self):
+        if not self.channel:
+            self.connect()
+        self.broker.queue_purge(self.queue)
+        print(f"[Middleware] Cola '{self.queue}' purgada.")
+
+    def close_graceful(self, method):
+        self.closing = True
+        self._flush_acks()
+        if self.channel:
+            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            self.channel.stop_consuming()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.batches:
+                self.flush()
+        except Exception as e:
+            print(f"Failed to flush pending batches. Error: {e}")
+
+    def cancel_consumer(self):
+        if self.channel:
+            self.channel.stop_consuming()
+            print("Consumidor cancelado exitosamente")
+
+    def delete_queue(self):
+        if self.channel:
+            self.broker.queue_delete(self.queue)
+            print(f"[Middleware] Cola '{self.queue}' eliminada.")
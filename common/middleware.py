@@ -5,13 +5,228 @@ import os
 import time
 from datetime import datetime
 import uuid
-from common.packet import FinalPacket
+import threading
+import weakref
+from common.packet import (
+    FinalPacket,
+    encode_batch,
+    decode_batch,
+    is_batch_message,
+    compression_codec,
+    compress_message,
+    decompress_message,
+    is_compressed_message,
+)
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
 RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', '5672'))
 RABBITMQ_HEARTBEAT = int(os.getenv('RABBITMQ_HEARTBEAT', '1200'))
+RABBITMQ_PREFETCH_COUNT = int(os.getenv('RABBITMQ_PREFETCH_COUNT', '1'))
+ACK_BATCH_SIZE = int(os.getenv('ACK_BATCH_SIZE', '1'))
+ACK_BATCH_TIMEOUT_MS = int(os.getenv('ACK_BATCH_TIMEOUT_MS', '100'))
+# Los mensajes mas chicos que esto se mandan sin comprimir
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
 
-class Middleware:
-    def __init__(self, queue, consumer_tag = None, exchange=None, exchange_type='direct', publish_to_exchange=True, routing_key=''):
+def _parse_compression(value):
+    """
+    Parsea la variable COMPRESSION: los exchanges (o colas sin exchange) a los
+    que el nodo publica comprimido, como "nombre:codec" separados por coma
+    (codec: zstd, lz4 o zlib; sin codec, el mejor instalado). Los consumidores
+    descomprimen solos, sin configuracion.
+    """
+    compression = {}
+    for entry in value.split(','):
+        name, _, codec = entry.strip().partition(':')
+        if name:
+            compression[name] = codec
+    return compression
+
+# Middlewares con batching por tiempo, para poder vaciar sus batches vencidos
+# desde el loop de consumo aunque no se publique nada nuevo
+_timed_batching_middlewares = weakref.WeakSet()
+
+def _batch_flush_interval():
+    timeouts = [m.batch_timeout for m in list(_timed_batching_middlewares)]
+    return min(timeouts) if timeouts else None
+
+def _flush_expired_batches(thread_id):
+    for middleware in list(_timed_batching_middlewares):
+        if middleware.publisher_thread == thread_id:
+            middleware.flush_expired()
+
+class _ThreadConnection:
+    """Conexion de un hilo, con su canal y las declaraciones ya hechas en el broker."""
+    def __init__(self, connection):
+        self.connection = connection
+        self.channel = connection.channel()
+        self.confirm_channel = None
+        self.declared = set()
+
+    def get_channel(self, confirm=False):
+        if self.channel.is_closed:
+            self.channel = self.connection.channel()
+        if not confirm:
+            return self.channel
+        if self.confirm_channel is None or self.confirm_channel.is_closed:
+            self.confirm_channel = self.connection.channel()
+            self.confirm_channel.confirm_delivery()
+        return self.confirm_channel
+
+class ConnectionManager:
+    """
+    Comparte la conexion a RabbitMQ entre todos los Middleware del proceso.
+    pika.BlockingConnection no es thread-safe, asi que cada hilo tiene una
+    unica conexion con un canal, que usan todos los Middleware desde ese hilo
+    para publicar y declarar. Cada consumo abre su propio canal en esa
+    conexion, asi un error de canal al publicar o declarar no corta el consumo.
+    Las colas, exchanges y bindings ya declarados en una conexion no se
+    vuelven a declarar.
+    """
+    def __init__(self):
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Las conexiones del padre no se pueden usar desde un proceso hijo
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connections = []
+        self.users = weakref.WeakSet()
+
+    def _state(self):
+        state = getattr(self.local, 'state', None)
+        if state is None or state.connection.is_closed:
+            connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST,
+                    port=RABBITMQ_PORT,
+                    heartbeat=RABBITMQ_HEARTBEAT))
+            state = _ThreadConnection(connection)
+            self.local.state = state
+            with self.lock:
+                self.connections.append(connection)
+        return state
+
+    def channel(self, user, confirm=False):
+        """Devuelve (conexion, canal) del hilo actual, registrando a user como usuario."""
+        self.users.add(user)
+        state = self._state()
+        return state.connection, state.get_channel(confirm)
+
+    def consumer_channel(self, user):
+        """Devuelve (conexion, canal nuevo) del hilo actual para consumir, registrando a user como usuario."""
+        self.users.add(user)
+        state = self._state()
+        return state.connection, state.connection.channel()
+
+    def declare(self, key, declare_fn):
+        """Ejecuta declare_fn(channel) si key no se declaro todavia en la conexion del hilo."""
+        state = self._state()
+        if key in state.declared:
+            return
+        declare_fn(state.get_channel())
+        state.declared.add(key)
+
+    def process_events(self):
+        """Atiende los eventos pendientes (heartbeats) de la conexion del hilo actual, si tiene una."""
+        state = getattr(self.local, 'state', None)
+        if state is not None and state.connection.is_open:
+            state.connection.process_data_events(time_limit=0)
+
+    def release(self, user):
+        """Cuando ya no queda ningun Middleware abierto, cierra todas las conexiones."""
+        self.users.discard(user)
+        if len(self.users) > 0:
+            return
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            try:
+                if not connection.is_closed:
+                    connection.close()
+            except Exception as e:
+                print(f"Failed to close connection. Error: {e}")
+
+CONNECTIONS = ConnectionManager()
+
+class _BatchChannel:
+    """
+    Proxy del canal que se le pasa a un callback que procesa paquetes de a uno
+    cuando llega un mensaje BATCH: junta los ack/nack de cada paquete en un
+    unico ack/nack del mensaje real.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.requeue = False
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        pass
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        # Un paquete descartado (requeue=False) se pierde igual que sin batch,
+        # pero si alguno pide reencolar se reencola el batch entero
+        if requeue:
+            self.requeue = True
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+class _AckBatchingChannel:
+    """
+    Proxy del canal que junta los basic_ack de los callbacks y los manda como
+    un unico basic_ack(multiple=True) cada ack_batch_size mensajes (o cuando
+    vence el timer del consumo). Si el nodo se cae, los mensajes todavia no
+    ackeados los reentrega el broker.
+    Asume que los callbacks resuelven los mensajes en el orden en que llegan.
+    before_flush se llama antes de cada ack: ahi el nodo publica lo que todavia
+    tiene en memoria de esos mensajes (ver BlockingMiddleware.set_before_ack).
+    """
+    def __init__(self, channel, ack_batch_size, before_flush=None):
+        self.channel = channel
+        self.ack_batch_size = ack_batch_size
+        self.before_flush = before_flush
+        self.pending = 0
+        self.last_delivery_tag = None
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        if self.last_delivery_tag is None or delivery_tag > self.last_delivery_tag:
+            self.last_delivery_tag = delivery_tag
+        self.pending += 1
+        if self.pending >= self.ack_batch_size:
+            self.flush()
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.flush()
+        self.channel.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+    def flush(self):
+        """Ackea de una vez todos los mensajes resueltos hasta el ultimo delivery tag."""
+        if self.pending and self.channel.is_open:
+            if self.before_flush is not None:
+                self.before_flush()
+            self.channel.basic_ack(delivery_tag=self.last_delivery_tag, multiple=True)
+        self.pending = 0
+        self.last_delivery_tag = None
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+class BlockingMiddleware:
+    def __init__(self, queue, consumer_tag = None, exchange=None, exchange_type='direct', publish_to_exchange=True, routing_key='', batch_size=1, batch_timeout=None,
+                 prefetch_count=None, ack_batch_size=None, ack_timeout=None, compression=None):
+        """
+        batch_size: cantidad de mensajes que se juntan por routing key antes de
+            publicarlos como un unico mensaje BATCH (1 deshabilita el batching).
+        batch_timeout: segundos maximos que un mensaje puede esperar en un batch
+            incompleto antes de publicarse (None para esperar hasta completarlo).
+        prefetch_count: mensajes sin ackear que el broker entrega a este consumidor
+            (por defecto RABBITMQ_PREFETCH_COUNT).
+        ack_batch_size: cantidad de acks que se juntan en un unico ack multiple
+            (por defecto ACK_BATCH_SIZE, nunca mas que prefetch_count).
+        ack_timeout: segundos maximos que un ack puede quedar pendiente
+            (por defecto ACK_BATCH_TIMEOUT_MS).
+        compression: codec con el que se comprimen los mensajes publicados
+            ("zstd", "lz4", "zlib" o "" para el mejor instalado). Por defecto
+            el de la variable COMPRESSION para este exchange/cola, o sin comprimir.
+        """
         self.host = RABBITMQ_HOST
         self.consumer_tag = consumer_tag
         self.queue = queue
@@ -22,38 +237,128 @@ class Middleware:
         self.connection = None
         self.channel = None
         self.is_consumed = False
+        self.closing = False
+        self.batch_size = max(1, int(batch_size))
+        self.batch_timeout = batch_timeout
+        self.batches = {}  # routing_key -> [bodies]
+        self.batch_started_at = {}  # routing_key -> time.monotonic() del primer mensaje
+        self.publisher_thread = None
+        self.prefetch_count = prefetch_count if prefetch_count is not None else RABBITMQ_PREFETCH_COUNT
+        self.ack_batch_size = ack_batch_size if ack_batch_size is not None else ACK_BATCH_SIZE
+        self.ack_timeout = ack_timeout if ack_timeout is not None else ACK_BATCH_TIMEOUT_MS / 1000
+        if self.ack_batch_size > self.prefetch_count:
+            # El broker no entregaria mas mensajes hasta que venza el timer
+            print(f"[Middleware] ack_batch_size={self.ack_batch_size} mayor al prefetch, se usa {self.prefetch_count}")
+            self.ack_batch_size = self.prefetch_count
+        self.ack_channel = None
+        self.before_ack = None
+        if compression is None:
+            compression = _parse_compression(os.getenv('COMPRESSION', '')).get(exchange or queue)
+        self.compression = compression_codec(compression) if compression is not None else None
+        self.confirm = False
+        self.closed = False
+        if self.batch_size > 1 and self.batch_timeout is not None:
+            _timed_batching_middlewares.add(self)
         if not self.channel:
             self.connect()
 
     def connect(self):
-        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host,
-                port=RABBITMQ_PORT,
-                heartbeat=RABBITMQ_HEARTBEAT))
-        self.channel = self.connection.channel()
+        self.connection, self.channel = CONNECTIONS.channel(self)
         if self.exchange:
             print(f"[Middleware] Declarando exchange '{self.exchange}' de tipo '{self.exchange_type}'...")
-            self.channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type, durable=True)
+            CONNECTIONS.declare(('exchange', self.exchange), lambda channel: channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type, durable=True))
             
             if self.queue:
                 print(f"[Middleware] Declarando cola '{self.queue}' (durable=False)...")
-                self.channel.queue_declare(queue=self.queue, durable=True)
+                CONNECTIONS.declare(('queue', self.queue), lambda channel: channel.queue_declare(queue=self.queue, durable=True))
                 
                 print(f"[Middleware] Enlazando cola '{self.queue}' al exchange '{self.exchange}'...")
-                self.channel.queue_bind(queue=self.queue, exchange=self.exchange, routing_key=self.routing_key)
+                CONNECTIONS.declare(('bind', self.queue, self.exchange, self.routing_key), lambda channel: channel.queue_bind(queue=self.queue, exchange=self.exchange, routing_key=self.routing_key))
         else:
-            self.channel.queue_declare(queue=self.queue, durable=True)
+            CONNECTIONS.declare(('queue', self.queue), lambda channel: channel.queue_declare(queue=self.queue, durable=True))
+
+    def process_events(self):
+        """
+        Atiende los heartbeats de la conexion del hilo actual. Un hilo que
+        publica sin consumir y pasa tiempo sin publicar (esperando trabajo)
+        tiene que llamarlo seguido, o el broker le cierra la conexion.
+        """
+        CONNECTIONS.process_events()
+
+    def _current_channel(self):
+        """Canal del hilo que esta usando el middleware en este momento."""
+        _, channel = CONNECTIONS.channel(self, confirm=self.confirm)
+        return channel
 
     def publish(self, message, routing_key=''):
         if not self.channel:
             self.connect()
+        body = self._to_bytes(message)
+        if self.batch_size > 1:
+            self._add_to_batch(body, routing_key)
+            return
+        self._send(self._compress(body), routing_key)
+
+    def publish_batch(self, messages, routing_key=''):
+        """Publica una lista de mensajes como un unico mensaje BATCH."""
+        if not self.channel:
+            self.connect()
+        bodies = [self._to_bytes(message) for message in messages]
+        if not bodies:
+            return
+        if len(bodies) == 1:
+            self._send(self._compress(bodies[0]), routing_key)
+            return
+        # El batch se comprime entero: comprime mucho mejor que cada paquete suelto
+        self._send(self._compress(encode_batch(bodies)), routing_key)
+        print(f" [x] Sent batch of {len(bodies)} messages with routing key {routing_key}")
+
+    def flush(self, routing_key=None):
+        """Publica los batches pendientes (de una routing key o de todas)."""
+        keys = list(self.batches) if routing_key is None else [routing_key]
+        for key in keys:
+            bodies = self.batches.pop(key, None)
+            self.batch_started_at.pop(key, None)
+            if bodies:
+                self.publish_batch(bodies, key)
+
+    def flush_expired(self):
+        """Publica los batches cuyo primer mensaje espero mas de batch_timeout."""
+        if self.batch_timeout is None:
+            return
+        now = time.monotonic()
+        expired = [key for key, started_at in self.batch_started_at.items() if now - started_at >= self.batch_timeout]
+        for key in expired:
+            self.flush(key)
+
+    def _add_to_batch(self, body, routing_key):
+        self.publisher_thread = threading.get_ident()
+        batch = self.batches.setdefault(routing_key, [])
+        if not batch:
+            self.batch_started_at[routing_key] = time.monotonic()
+        batch.append(body)
+        if len(batch) >= self.batch_size:
+            self.flush(routing_key)
+        else:
+            self.flush_expired()
+
+    def _compress(self, body):
+        if self.compression is None or len(body) < COMPRESSION_MIN_SIZE:
+            return body
+        return compress_message(body, self.compression)
+
+    def _to_bytes(self, message):
         if isinstance(message, bytes):  # Handle bytes from to_json()
-            body = message
+            return message
         elif isinstance(message, str):  # Handle str directly
-            body = message.encode('utf-8')  # Convert to bytes for RabbitMQ
+            return message.encode('utf-8')  # Convert to bytes for RabbitMQ
         else:  # Handle dict or other JSON-serializable objects
-            body = orjson.dumps(message)  # Returns bytes
+            return orjson.dumps(message)  # Returns bytes
+
+    def _send(self, body, routing_key=''):
+        channel = self._current_channel()
         if self.exchange and self.publish_to_exchange:
-            self.channel.basic_publish(
+            channel.basic_publish(
                 exchange=self.exchange,
                 routing_key=routing_key,
                 body=body,
@@ -62,7 +367,7 @@ class Middleware:
             print(f" [x] Sent message to exchange {self.exchange} with routing key {routing_key}")
 
         else:
-            self.channel.basic_publish(
+            channel.basic_publish(
                 exchange='',
                 routing_key=self.queue,
                 body=body,
@@ -71,16 +376,24 @@ class Middleware:
             print(f" [x] Sent message to queue {self.queue}")
 
     
-    def consume(self, callback):
+    def consume(self, callback, process_batch=None):
+        """
+        Consume la cola llamando a callback(ch, method, properties, body) por mensaje.
+        Los mensajes BATCH se le pasan enteros a
+        process_batch(ch, method, properties, bodies) si se indica; si no, se
+        despacha cada paquete del batch a callback y se ackea el mensaje al final.
+        """
         if not self.channel:
             self.connect()
+        # Se consume con la conexion del hilo que llama a consume, en un canal propio
+        self.connection, self.channel = CONNECTIONS.consumer_channel(self)
         
-        self.channel.basic_qos(prefetch_count=1)
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.ack_channel = self._make_ack_channel(self.channel)
         
         # Envolver el callback para actualizar is_consumed
         def wrapped_callback(ch, method, properties, body):
-            self.is_consumed = True  # Activar is_consumed al recibir el primer mensaje
-            callback(ch, method, properties, body)  # Llamar al callback original
+            self._deliver(callback, process_batch, ch, method, properties, body)
 
         # Iniciar el consumo
         self.channel.basic_consume(
@@ -89,23 +402,108 @@ class Middleware:
             auto_ack=False,
             consumer_tag=self.consumer_tag
         )
+        self._schedule_batch_timeouts()
+        self._schedule_ack_flush()
         print(f" [*] Waiting for messages in {self.queue}")
-        self.channel.start_consuming()
+        try:
+            self.channel.start_consuming()
+        finally:
+            self._flush_acks()
+
+    def set_before_ack(self, hook):
+        """
+        Llama a hook() antes de ackear mensajes consumidos. Es para nodos que
+        publican con batching: si ackean un mensaje cuyas filas siguen en un
+        batch sin publicar y se caen, el broker no lo reentrega y esas filas se
+        pierden. Tiene que llamarse antes de consume.
+        """
+        self.before_ack = hook
+
+    def _make_ack_channel(self, channel):
+        """Canal que junta los acks, si se juntan o si hay que publicar algo antes de ackear."""
+        if self.ack_batch_size > 1 or self.before_ack is not None:
+            return _AckBatchingChannel(channel, self.ack_batch_size, self.before_ack)
+        return None
+
+    def _schedule_ack_flush(self):
+        """Mientras se consume, manda los acks pendientes cada ack_timeout segundos."""
+        if not self.ack_channel:
+            return
+
+        def flush_pending_acks():
+            self._flush_acks()
+            if self.connection and self.connection.is_open:
+                self.connection.call_later(self.ack_timeout, flush_pending_acks)
+
+        self.connection.call_later(self.ack_timeout, flush_pending_acks)
+
+    def _flush_acks(self):
+        try:
+            if self.ack_channel:
+                self.ack_channel.flush()
+        except Exception as e:
+            print(f"Failed to flush pending acks. Error: {e}")
+
+    def _deliver(self, callback, process_batch, ch, method, properties, body):
+        self.is_consumed = True  # Activar is_consumed al recibir el primer mensaje
+        if self.ack_channel:
+            ch = self.ack_channel
+        if is_compressed_message(body):
+            body = decompress_message(body)
+        if is_batch_message(body):
+            bodies = decode_batch(body)
+            if process_batch:
+                process_batch(ch, method, properties, bodies)
+            else:
+                self._dispatch_batch(callback, ch, method, properties, bodies)
+            return
+        callback(ch, method, properties, body)  # Llamar al callback original
+
+    def _dispatch_batch(self, callback, ch, method, properties, bodies):
+        batch_channel = _BatchChannel(ch)
+        for body in bodies:
+            callback(batch_channel, method, properties, body)
+            if self.closing:
+                # close_graceful ya reencolo el mensaje entero
+                return
+        if batch_channel.requeue:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        else:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _schedule_batch_timeouts(self):
+        """
+        Mientras se consume, vacia periodicamente los batches vencidos de los
+        middlewares que publican desde este mismo hilo.
+        """
+        interval = _batch_flush_interval()
+        if interval is None:
+            return
+        consumer_thread = threading.get_ident()
+
+        def flush_expired_batches():
+            _flush_expired_batches(consumer_thread)
+            if self.connection and self.connection.is_open:
+                self.connection.call_later(interval, flush_expired_batches)
+
+        self.connection.call_later(interval, flush_expired_batches)
     
     # TODO: sacar client_id=0 como default
     def send_final(self, client_id=0, routing_key=''):
         """Publica un paquete FINAL a través de este middleware."""
         if not self.channel:
             self.connect()
+        # Los datos pendientes tienen que llegar antes que el FINAL
+        self.flush()
         final_packet = FinalPacket(client_id)
-        self.publish(final_packet.to_json(), routing_key)
+        self._send(final_packet.to_json(), routing_key)
         print(f"[Middleware] FinalPacket {final_packet.to_json()} enviado directamente.")
                 
     def check_no_consumers(self):
         """Verifica si hay 0 consumidores en la cola de control."""
         if not self.channel:
             self.connect()
-        result = self.channel.queue_declare(queue=self.queue, passive=True)
+        result = self._current_channel().queue_declare(queue=self.queue, passive=True)
         consumer_count = result.method.consumer_count
         print(f" [x] Control queue has {consumer_count} active consumers")
         return consumer_count == 1
@@ -113,28 +511,35 @@ class Middleware:
     def check_messages(self):
         if not self.channel:
             self.connect()
-        result = self.channel.queue_declare(queue=self.queue, passive=True)
+        result = self._current_channel().queue_declare(queue=self.queue, passive=True)
         count = result.method.message_count
         print(f" [x] Queue has {count} messages")
     
     def purge(self):
         if not self.channel:
             self.connect()
-        self.channel.queue_purge(queue=self.queue)
+        self._current_channel().queue_purge(queue=self.queue)
         print(f"[Middleware] Cola '{self.queue}' purgada.")
         
     def close_graceful(self, method):
+        self.closing = True
+        self._flush_acks()
         if self.channel:
             self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
         if self.connection and not self.connection.is_closed:
             self.connection.add_callback_threadsafe(self.channel.stop_consuming)
 
     def close(self):
+        if self.closed:
+            return
+        self.closed = True
         try:
-            if self.connection and not self.connection.is_closed:
-                self.connection.close()
+            if self.batches:
+                self.flush()
         except Exception as e:
-            print(f"Failed to close connection. Error: {e}")
+            print(f"Failed to flush pending batches. Error: {e}")
+        # La conexion es compartida: se cierra cuando no queda ningun middleware abierto
+        CONNECTIONS.release(self)
             
     def cancel_consumer(self):
         if self.channel and self.channel.is_open:
@@ -144,10 +549,34 @@ class Middleware:
             print("Consumidor cancelado exitosamente")
 
     def confirm_delivery(self):
-        if self.channel:
-            self.channel.confirm_delivery()    
+        # Se publica por un canal aparte en modo confirm, para no volver
+        # sincronicas las publicaciones de los demas middlewares del hilo
+        self.confirm = True
 
     def delete_queue(self):
         if self.channel:
-            self.channel.queue_delete(queue=self.queue)
-            print(f"[Middleware] Cola '{self.queue}' eliminada.") 
+            self._current_channel().queue_delete(queue=self.queue)
+            print(f"[Middleware] Cola '{self.queue}' eliminada.")
+
+def _select_backend():
+    """
+    Elige la implementacion de Middleware segun MIDDLEWARE_BACKEND, para poder
+    comparar el throughput de cada etapa con uno u otro backend.
+    """
+    backend = os.getenv("MIDDLEWARE_BACKEND", "blocking").lower()
+    if backend == "asyncio":
+        from common.async_middleware import AsyncioMiddleware
+        middleware = AsyncioMiddleware
+    elif backend == "memory":
+        from common.memory_middleware import MemoryMiddleware
+        middleware = MemoryMiddleware
+    else:
+        middleware = BlockingMiddleware
+    if os.getenv("SHM_LINKS"):
+        # Los exchanges con productores y consumidores en la misma maquina
+        # pasan por memoria compartida (ver common/shm_middleware.py)
+        from common.shm_middleware import with_shm_links
+        middleware = with_shm_links(middleware)
+    return middleware
+
+Middleware = _select_backend()
@@ -1,9 +1,52 @@
 import orjson
+import os
+import zlib
 from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 import time
 
+try:
+    import msgpack
+except ImportError:  # Depende de la imagen del nodo
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
 FINAL = "FINAL"
 
+# Primer byte de los mensajes que no son un paquete JSON suelto
+# (un JSON siempre empieza con '{' o '[')
+MSGPACK_TAG = 0x01
+BATCH_TAG = 0x02
+COMPRESSED_TAG = 0x03
+
+# Codec con el que cada nodo serializa sus DataPacket: "json" o "msgpack".
+# Al decodificar se detecta el codec por el primer byte, asi que nodos con
+# distinto codec pueden convivir en un mismo deploy.
+PACKET_CODEC = os.getenv("PACKET_CODEC", "json").lower()
+
+# Esquema compartido por todos los nodos: las columnas conocidas viajan como
+# un id de un byte en vez de repetir el nombre en cada fila. Solo se pueden
+# agregar columnas al final, para no cambiar el id de las existentes.
+COLUMNS = (
+    "id", "title", "genres", "production_countries", "release_date", "budget",
+    "revenue", "overview", "original_language", "cast", "userId", "rating",
+    "sentiment", "source", "operation", "key", "value", "value_field", "count",
+    "average", "total", "feeling", "ratio",
+)
+COLUMN_IDS = {name: column_id for column_id, name in enumerate(COLUMNS)}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
 @dataclass
 class Packet:
     timestamp: str
@@ -38,6 +81,15 @@ class DataPacket(Packet):
     def from_json(cls, data):
         return cls(**orjson.loads(data))
 
+    def encode(self) -> bytes:
+        """Serialize the packet with the node's PACKET_CODEC."""
+        return encode_data_packet(self.client_id, self.timestamp, self.data)
+
+    @classmethod
+    def decode(cls, body):
+        """Build a DataPacket from a message serialized with any codec."""
+        return cls(**decode_packet(body))
+
 # Definiendo FinalPacket
 @dataclass  
 class FinalPacket:  
@@ -87,4 +139,194 @@ def keep_columns_from(data: dict, columns: list) -> dict:
         dict: A new dictionary with only the specified keys.
     """
     return {k: v for k, v in data.items() if k in columns}
-     
\ No newline at end of file
+
+def encode_data_packet(client_id, timestamp: str, data: dict) -> bytes:
+    """
+    Serialize a DataPacket with the node's PACKET_CODEC.
+
+    The msgpack layout is the tag byte followed by three msgpack objects:
+    client_id, the timestamp as microseconds since the epoch (UTC) and the
+    data map, keyed by column id (see COLUMNS) or by name for unknown columns.
+    Falls back to JSON when msgpack is not available or the packet does not
+    fit the layout.
+    """
+    if PACKET_CODEC == "msgpack" and msgpack is not None:
+        try:
+            micros = (datetime.fromisoformat(timestamp) - _EPOCH) // _MICROSECOND
+            columns = {COLUMN_IDS.get(name, name): value for name, value in data.items()}
+            return (
+                bytes((MSGPACK_TAG,))
+                + msgpack.packb(client_id)
+                + msgpack.packb(micros)
+                + msgpack.packb(columns)
+            )
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return orjson.dumps({"timestamp": timestamp, "data": data, "client_id": client_id})
+
+def decode_packet(body) -> dict:
+    """
+    Decode a single packet serialized with any codec.
+
+    Args:
+        body (bytes): Message body.
+
+    Returns:
+        dict: The packet fields (the same ones the JSON codec carries).
+    """
+    return PacketEnvelope(body).fields()
+
+class PacketEnvelope:
+    """
+    A received message, parsed once.
+
+    The control fields (header, client_id, acks) are available right away.
+    With the msgpack codec the data map is only decoded the first time it is
+    accessed, so stages that only look at the control fields never pay for it.
+    The original bytes are kept in `body`, so pass-through stages can forward
+    the message untouched.
+    """
+    __slots__ = ("body", "_fields", "_unpacker")
+
+    def __init__(self, body):
+        self.body = body
+        self._unpacker = None
+        if len(body) > 0 and body[0] == MSGPACK_TAG:
+            if msgpack is None:
+                raise ValueError("Received a msgpack packet but msgpack is not installed")
+            unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+            unpacker.feed(body[1:])
+            self._fields = {"client_id": unpacker.unpack(), "timestamp": unpacker.unpack()}
+            self._unpacker = unpacker
+        else:
+            self._fields = orjson.loads(body)
+
+    @property
+    def header(self):
+        return self._fields.get("header")
+
+    @property
+    def client_id(self):
+        return self._fields.get("client_id")
+
+    @property
+    def acks(self):
+        return self._fields.get("acks")
+
+    @property
+    def timestamp(self) -> str:
+        timestamp = self._fields.get("timestamp")
+        if self._unpacker is not None and isinstance(timestamp, int):
+            timestamp = (_EPOCH + timestamp * _MICROSECOND).isoformat()
+            self._fields["timestamp"] = timestamp
+        return timestamp
+
+    @property
+    def data(self) -> dict:
+        if self._unpacker is not None and "data" not in self._fields:
+            columns = self._unpacker.unpack()
+            self._fields["data"] = {
+                COLUMNS[key] if isinstance(key, int) else key: value for key, value in columns.items()
+            }
+        return self._fields.get("data")
+
+    def fields(self) -> dict:
+        """Return every packet field, decoding the data payload if needed."""
+        if self._unpacker is not None:
+            self._fields["timestamp"] = self.timestamp
+            self._fields["data"] = self.data
+        return self._fields
+
+    def to_packet(self) -> "DataPacket":
+        return DataPacket(client_id=self.client_id, timestamp=self.timestamp, data=self.data)
+
+def encode_batch(bodies: list) -> bytes:
+    """
+    Frame a list of already serialized packets into a single BATCH message,
+    without re-serializing them.
+
+    Layout: tag (1 byte) | count (4 bytes) | (length (4 bytes) | body) * count
+
+    Args:
+        bodies (list): Serialized packets (bytes).
+
+    Returns:
+        bytes: The framed batch.
+    """
+    parts = [BATCH_TAG.to_bytes(1, "big"), len(bodies).to_bytes(4, "big")]
+    for body in bodies:
+        parts.append(len(body).to_bytes(4, "big"))
+        parts.append(body)
+    return b"".join(parts)
+
+def is_batch_message(body) -> bool:
+    return len(body) > 0 and body[0] == BATCH_TAG
+
+def decode_batch(body) -> list:
+    """
+    Split a BATCH message into the serialized packets it carries.
+
+    Args:
+        body (bytes): Message built with encode_batch.
+
+    Returns:
+        list: The serialized packets (bytes), in publish order.
+    """
+    count = int.from_bytes(body[1:5], "big")
+    offset = 5
+    bodies = []
+    for _ in range(count):
+        length = int.from_bytes(body[offset:offset + 4], "big")
+        offset += 4
+        bodies.append(body[offset:offset + length])
+        offset += length
+    return bodies
+
+# Codecs de compresion: id (el byte que viaja en el mensaje) y funciones.
+# zlib esta siempre; zstd y lz4 solo si la imagen tiene la libreria.
+ZLIB_CODEC = 0
+ZSTD_CODEC = 1
+LZ4_CODEC = 2
+
+_compressors = {ZLIB_CODEC: (lambda data: zlib.compress(data, 1), zlib.decompress)}
+if zstandard is not None:
+    _compressors[ZSTD_CODEC] = (
+        lambda data: zstandard.ZstdCompressor(level=1).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+if lz4_frame is not None:
+    _compressors[LZ4_CODEC] = (lz4_frame.compress, lz4_frame.decompress)
+
+CODECS = {"zlib": ZLIB_CODEC, "zstd": ZSTD_CODEC, "lz4": LZ4_CODEC}
+
+def compression_codec(name: str) -> int:
+    """
+    Resolve a codec name ("zstd", "lz4", "zlib" or "" for the best available)
+    to the codec id to use, falling back to zlib when the library is missing.
+    """
+    name = (name or "").strip().lower()
+    if name and name not in CODECS:
+        raise ValueError(f"Unknown compression codec: {name}")
+    for candidate in ([CODECS[name]] if name else []) + [ZSTD_CODEC, LZ4_CODEC, ZLIB_CODEC]:
+        if candidate in _compressors:
+            return candidate
+
+def compress_message(body: bytes, codec: int) -> bytes:
+    """
+    Compress an already serialized message (a packet or a whole BATCH).
+
+    Layout: tag (1 byte) | codec (1 byte) | compressed body
+    """
+    compress, _ = _compressors[codec]
+    return bytes((COMPRESSED_TAG, codec)) + compress(body)
+
+def is_compressed_message(body) -> bool:
+    return len(body) > 1 and body[0] == COMPRESSED_TAG
+
+def decompress_message(body) -> bytes:
+    """Undo compress_message, returning the original message."""
+    codec = body[1]
+    if codec not in _compressors:
+        raise ValueError(f"Received a message compressed with codec {codec}, which is not installed")
+    _, decompress = _compressors[codec]
+    return decompress(bytes(body[2:]))
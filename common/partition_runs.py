@@ -0,0 +1,122 @@
+import os
+import struct
+import threading
+import time
+import logging
+import orjson
+from common.storage_handler import STORAGE_SYNC_EVERY, STORAGE_SYNC_INTERVAL_MS
+
+# Registro: largo del valor, valor (JSON)
+_HEADER = struct.Struct('>I')
+
+_RUN_PREFIX = 'run_'
+_RUN_SUFFIX = '.log'
+
+
+class PartitionRuns:
+    """
+    Archivos append-only, uno por partición, para filas que solo se leen de
+    corrido al final (el lado probe de un grace hash join). A diferencia de
+    StorageHandler no hay índice por clave: en memoria solo quedan los
+    archivos abiertos, así que el costo no crece con la cantidad de filas.
+
+    Los fsync se agrupan como en StorageHandler (STORAGE_SYNC_EVERY y
+    STORAGE_SYNC_INTERVAL_MS).
+    """
+    def __init__(self, data_dir, sync_every=None, sync_interval=None):
+        self.data_dir = data_dir
+        self.sync_every = sync_every or STORAGE_SYNC_EVERY
+        self.sync_interval = sync_interval if sync_interval is not None else STORAGE_SYNC_INTERVAL_MS / 1000
+        self.files = {}  # partición -> archivo abierto para agregar
+        self.dirty = set()  # particiones con escrituras sin fsync
+        self.lock = threading.Lock()
+        self.pending_sync = 0
+        self.last_sync = time.monotonic()
+        if not os.path.exists(data_dir):
+            logging.info(f"Creando directorio: {data_dir}")
+            os.makedirs(data_dir)
+
+    def _run_path(self, partition):
+        return os.path.join(self.data_dir, f'{_RUN_PREFIX}{partition:04d}{_RUN_SUFFIX}')
+
+    def append(self, partition, value):
+        """Agrega un valor al final del archivo de la partición."""
+        data = orjson.dumps(value)
+        with self.lock:
+            run = self.files.get(partition)
+            if run is None:
+                run = self.files[partition] = open(self._run_path(partition), 'ab')
+            run.write(_HEADER.pack(len(data)) + data)
+            self.dirty.add(partition)
+            self.pending_sync += 1
+            if self.pending_sync >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+                self._sync()
+
+    def sync(self):
+        """Baja a disco (fsync) todo lo escrito hasta ahora."""
+        with self.lock:
+            self._sync()
+
+    def _sync(self):
+        for partition in self.dirty:
+            run = self.files[partition]
+            run.flush()
+            os.fsync(run.fileno())
+        self.dirty.clear()
+        self.pending_sync = 0
+        self.last_sync = time.monotonic()
+
+    def partitions(self):
+        """Particiones que tienen un archivo en disco, en orden."""
+        return sorted(
+            int(name[len(_RUN_PREFIX):-len(_RUN_SUFFIX)])
+            for name in os.listdir(self.data_dir)
+            if name.startswith(_RUN_PREFIX) and name.endswith(_RUN_SUFFIX)
+        )
+
+    def read(self, partition):
+        """Recorre los valores de la partición en el orden en que se agregaron."""
+        with self.lock:
+            run = self.files.get(partition)
+            if run is not None:
+                run.flush()
+        path = self._run_path(partition)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                (length,) = _HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length:
+                    # Registro a medio escribir (el nodo se cayó antes del fsync): se descarta
+                    logging.error(f"Descartando un registro incompleto al final de {path}")
+                    break
+                yield orjson.loads(data)
+
+    def clean(self):
+        """Borra todos los archivos de particiones."""
+        with self.lock:
+            self._close_files()
+            for partition in self.partitions():
+                try:
+                    os.remove(self._run_path(partition))
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logging.error(f"Error al eliminar la partición {partition}: {e}")
+
+    def close(self):
+        """Baja a disco lo pendiente y cierra los archivos."""
+        with self.lock:
+            self._sync()
+            self._close_files()
+
+    def _close_files(self):
+        for run in self.files.values():
+            run.close()
+        self.files = {}
+        self.dirty.clear()
+        self.pending_sync = 0
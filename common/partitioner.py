@@ -0,0 +1,61 @@
+import bisect
+import hashlib
+
+# Puntos por nodo en el anillo: con mas puntos la carga queda mas pareja
+DEFAULT_VIRTUAL_NODES = 256
+
+
+def stable_hash(value):
+    """Hash de 64 bits de str(value), igual en todos los procesos (hash() cambia por proceso)."""
+    digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class ModuloPartitioner:
+    """Particion key % number_of_nodes (las claves tienen que ser enteros)."""
+    def __init__(self, number_of_nodes, virtual_nodes=None):
+        self.number_of_nodes = number_of_nodes
+
+    def partition(self, key):
+        return int(key) % self.number_of_nodes
+
+
+class ConsistentHashPartitioner:
+    """
+    Hashing consistente con nodos virtuales: cada nodo ocupa virtual_nodes
+    puntos de un anillo de hashes y una clave va al primer punto a partir de su
+    hash. Al pasar de N a N+1 nodos solo cambian de nodo ~1/(N+1) de las
+    claves, y el hash reparte parejo aunque los ids no sean uniformes.
+    """
+    def __init__(self, number_of_nodes, virtual_nodes=None):
+        self.number_of_nodes = number_of_nodes
+        self.virtual_nodes = virtual_nodes or DEFAULT_VIRTUAL_NODES
+        ring = sorted(
+            (stable_hash(f"{node}#{replica}"), node)
+            for node in range(number_of_nodes)
+            for replica in range(self.virtual_nodes)
+        )
+        self.points = [point for point, _ in ring]
+        self.nodes = [node for _, node in ring]
+        # Las claves son ids de peliculas: pocas y repetidas, asi que se cachean
+        self.cache = {}
+
+    def partition(self, key):
+        node = self.cache.get(key)
+        if node is None:
+            position = bisect.bisect(self.points, stable_hash(key)) % len(self.points)
+            node = self.cache[key] = self.nodes[position]
+        return node
+
+
+PARTITIONERS = {
+    'modulo': ModuloPartitioner,
+    'consistent': ConsistentHashPartitioner,
+}
+
+
+def make_partitioner(name, number_of_nodes, virtual_nodes=None):
+    """Arma el particionador `name` (ver PARTITIONERS) para number_of_nodes nodos."""
+    if name not in PARTITIONERS:
+        raise ValueError(f"Unknown partitioner '{name}', expected one of {sorted(PARTITIONERS)}")
+    return PARTITIONERS[name](number_of_nodes, virtual_nodes)
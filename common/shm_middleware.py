@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from collections import deque
+import pika
+from common.middleware import _batch_flush_interval, _flush_expired_batches
+from common.shm_ring import ShmExchange, open_ring
+
+# Exchanges (o colas sin exchange) cuyos productores y consumidores corren
+# todos en esta maquina: sus mensajes viajan por memoria compartida en vez de
+# pasar por el broker. El resto sigue por AMQP.
+SHM_LINKS = {link.strip() for link in os.getenv('SHM_LINKS', '').split(',') if link.strip()}
+SHM_POLL_INTERVAL = float(os.getenv('SHM_POLL_INTERVAL', '0.1'))
+
+_PERSISTENT = pika.BasicProperties(delivery_mode=2)
+
+
+class _ShmChannel:
+    """
+    Lo que reciben los callbacks como `ch` al consumir un anillo. Los mensajes
+    entregados quedan guardados hasta el ack. Un nack con requeue los deja en
+    una lista que el consumo entrega antes que el anillo; al cortar el consumo
+    lo que no se ackeo vuelve al principio del anillo, adelante de un FINAL que
+    ya este encolado. Nada de esto espera a que el anillo tenga lugar: el
+    consumidor es el que lo libera.
+    """
+    def __init__(self, ring):
+        self.ring = ring
+        self.unacked = {}  # delivery_tag -> body
+        self.requeued = deque()  # bodies reencolados, a entregar antes que el anillo
+        self.next_delivery_tag = 0
+        self.stopped = threading.Event()
+
+    @property
+    def is_open(self):
+        return True
+
+    def track(self, body):
+        self.next_delivery_tag += 1
+        self.unacked[self.next_delivery_tag] = body
+        return self.next_delivery_tag
+
+    def _resolve(self, delivery_tag, multiple):
+        if not multiple:
+            body = self.unacked.pop(delivery_tag, None)
+            return [body] if body is not None else []
+        tags = [tag for tag in self.unacked if tag <= delivery_tag]
+        return [self.unacked.pop(tag) for tag in tags]
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._resolve(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        bodies = self._resolve(delivery_tag, multiple)
+        if requeue:
+            self.requeued.extendleft(reversed(bodies))
+
+    def next_requeued(self):
+        """El proximo mensaje reencolado, o None si no hay."""
+        return self.requeued.popleft() if self.requeued else None
+
+    def requeue_unacked(self):
+        """Devuelve al principio del anillo lo reencolado y lo entregado sin ack, en orden."""
+        self.requeued.extend(self.unacked.values())
+        self.unacked = {}
+        while self.requeued:
+            if not self.ring.put_front(self.requeued[-1]):
+                # Quedan para el proximo consume de este proceso
+                print(f" [!] {len(self.requeued)} mensajes reencolados no entran al principio del anillo '{self.ring.queue}'")
+                return
+            self.requeued.pop()
+
+    def stop_consuming(self):
+        self.stopped.set()
+
+
+class ShmMiddlewareMixin:
+    """
+    Agrega a un backend de Middleware el transporte por memoria compartida
+    (ver common/shm_ring.py) para los exchanges y colas de SHM_LINKS. Para los
+    demas, el middleware se comporta igual que el backend.
+    """
+    shm_linked = False
+    shm_ring = None
+    shm_exchange = None
+
+    def _is_shm_linked(self):
+        return (self.exchange or self.queue) in SHM_LINKS
+
+    def connect(self):
+        if not self._is_shm_linked():
+            super().connect()
+            return
+        self.shm_linked = True
+        if self.exchange:
+            self.shm_exchange = ShmExchange(self.exchange)
+        if self.queue:
+            print(f"[Middleware] Abriendo cola '{self.queue}' en memoria compartida...")
+            self.shm_ring = open_ring(self.queue)
+            if self.exchange:
+                print(f"[Middleware] Enlazando cola '{self.queue}' al exchange '{self.exchange}' en memoria compartida...")
+                self.shm_exchange.bind(self.queue, self.routing_key)
+        self.channel = _ShmChannel(self.shm_ring)
+
+    def _send(self, body, routing_key=''):
+        if not self.shm_linked:
+            super()._send(body, routing_key)
+            return
+        if self.exchange and self.publish_to_exchange:
+            for queue in self.shm_exchange.queues(routing_key):
+                open_ring(queue).put(body)
+            print(f" [x] Sent message to exchange {self.exchange} with routing key {routing_key} (shm)")
+        else:
+            self.shm_ring.put(body)
+            print(f" [x] Sent message to queue {self.queue} (shm)")
+
+    def consume(self, callback, process_batch=None):
+        if not self.shm_linked:
+            super().consume(callback, process_batch)
+            return
+        channel = self.channel
+        if channel.stopped.is_set():
+            return
+        batch_interval = _batch_flush_interval()
+        poll_interval = min(SHM_POLL_INTERVAL, batch_interval) if batch_interval is not None else SHM_POLL_INTERVAL
+        last_tick = time.monotonic()
+        consumer_thread = threading.get_ident()
+
+        self.shm_ring.add_consumer(1)
+        print(f" [*] Waiting for messages in {self.queue} (shm)")
+        try:
+            while not channel.stopped.is_set():
+                body = channel.next_requeued()
+                if body is None:
+                    body = self.shm_ring.get(poll_interval)
+                if body is not None:
+                    method = pika.spec.Basic.Deliver(
+                        consumer_tag=self.consumer_tag,
+                        delivery_tag=channel.track(body),
+                        routing_key=self.routing_key
+                    )
+                    self._deliver(callback, process_batch, channel, method, _PERSISTENT, body)
+                if batch_interval is not None and time.monotonic() - last_tick >= batch_interval:
+                    _flush_expired_batches(consumer_thread)
+                    last_tick = time.monotonic()
+        finally:
+            channel.requeue_unacked()
+            self.shm_ring.add_consumer(-1)
+
+    def check_no_consumers(self):
+        if not self.shm_linked:
+            return super().check_no_consumers()
+        consumer_count = self.shm_ring.consumer_count()
+        print(f" [x] Control queue has {consumer_count} active consumers")
+        return consumer_count == 1
+
+    def check_messages(self):
+        if not self.shm_linked:
+            super().check_messages()
+            return
+        print(f" [x] Queue has {self.shm_ring.message_count()} messages")
+
+    def purge(self):
+        if not self.shm_linked:
+            super().purge()
+            return
+        self.shm_ring.purge()
+        print(f"[Middleware] Cola '{self.queue}' purgada.")
+
+    def close_graceful(self, method):
+        if not self.shm_linked:
+            super().close_graceful(method)
+            return
+        self.closing = True
+        self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        self.channel.stop_consuming()
+
+    def close(self):
+        if not self.shm_linked:
+            super().close()
+            return
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.batches:
+                self.flush()
+        except Exception as e:
+            print(f"Failed to flush pending batches. Error: {e}")
+
+    def cancel_consumer(self):
+        if not self.shm_linked:
+            super().cancel_consumer()
+            return
+        self.channel.stop_consuming()
+        print("Consumidor cancelado exitosamente")
+
+    def delete_queue(self):
+        if not self.shm_linked:
+            super().delete_queue()
+            return
+        if self.shm_exchange:
+            self.shm_exchange.unbind(self.queue)
+        if self.shm_ring:
+            self.shm_ring.unlink()
+            print(f"[Middleware] Cola '{self.queue}' eliminada.")
+
+
+def with_shm_links(backend):
+    """Devuelve el backend con el transporte por memoria compartida para SHM_LINKS."""
+    return type(f"Shm{backend.__name__}", (ShmMiddlewareMixin, backend), {})
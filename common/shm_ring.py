@@ -0,0 +1,251 @@
+import fcntl
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from urllib.parse import quote, unquote
+
+try:
+    from multiprocessing import resource_tracker
+except ImportError:
+    resource_tracker = None
+
+# Donde viven los segmentos, los locks y los bindings. Los contenedores que
+# comparten anillos tienen que compartir este directorio (ipc: host).
+SHM_DIR = os.getenv('SHM_DIR', '/dev/shm')
+SHM_PREFIX = os.getenv('SHM_PREFIX', 'tpring_')
+SHM_RING_SIZE = int(os.getenv('SHM_RING_SIZE', str(64 * 1024 * 1024)))
+
+# head (offset de lectura), tail (offset de escritura), consumidores, mensajes
+_HEADER = struct.Struct('<QQqq')
+_DATA_START = 64
+_LENGTH = struct.Struct('<I')
+# Marca de fin de vuelta: el mensaje siguiente empieza al principio del buffer
+_WRAP = 0xFFFFFFFF
+
+_MIN_WAIT = 0.0005
+_MAX_WAIT = 0.01
+
+
+def _open_segment(name, size):
+    try:
+        segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        segment = shared_memory.SharedMemory(name=name)
+    # El segmento es del pipeline, no de este proceso: que no lo borre al salir
+    if resource_tracker is not None:
+        try:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        except Exception:
+            pass
+    return segment
+
+
+class ShmRing:
+    """
+    Cola FIFO de mensajes sobre un segmento de memoria compartida, con varios
+    productores y consumidores en distintos procesos de la misma maquina.
+    Los accesos se serializan con un flock sobre un archivo de lock, mas un
+    lock de threads: el flock no excluye a los threads del proceso, que
+    comparten el descriptor. Los segmentos nuevos arrancan en cero, que es una
+    cola vacia valida.
+
+    Layout: header (64 bytes) | buffer circular de mensajes (length | body).
+    """
+    def __init__(self, queue, size=SHM_RING_SIZE):
+        self.queue = queue
+        self.name = f"{SHM_PREFIX}{quote(queue, safe='')}"
+        self.segment = _open_segment(self.name, _DATA_START + size)
+        self.buffer = self.segment.buf
+        self.capacity = self.segment.size - _DATA_START
+        self.lock_fd = os.open(os.path.join(SHM_DIR, f"{self.name}.lock"), os.O_RDWR | os.O_CREAT, 0o666)
+        self.thread_lock = threading.Lock()
+
+    def _lock(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def _unlock(self):
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+        finally:
+            self.thread_lock.release()
+
+    def _header(self):
+        return _HEADER.unpack_from(self.buffer, 0)
+
+    def _try_put(self, body):
+        head, tail, consumers, messages = self._header()
+        position = tail % self.capacity
+        needed = _LENGTH.size + len(body)
+        wasted = 0
+        if self.capacity - position < needed:
+            # No entra antes del final del buffer: se salta a la vuelta siguiente
+            wasted = self.capacity - position
+        if self.capacity - (tail - head) < wasted + needed:
+            return False
+        if wasted:
+            if wasted >= _LENGTH.size:
+                _LENGTH.pack_into(self.buffer, _DATA_START + position, _WRAP)
+            tail += wasted
+            position = 0
+        _LENGTH.pack_into(self.buffer, _DATA_START + position, len(body))
+        start = _DATA_START + position + _LENGTH.size
+        self.buffer[start:start + len(body)] = body
+        _HEADER.pack_into(self.buffer, 0, head, tail + needed, consumers, messages + 1)
+        return True
+
+    def _try_put_front(self, body):
+        head, tail, consumers, messages = self._header()
+        needed = _LENGTH.size + len(body)
+        if self.capacity - (tail - head) < needed or head % self.capacity < needed:
+            # Lleno, o no entra entre el principio del buffer y head
+            return False
+        head -= needed
+        position = head % self.capacity
+        _LENGTH.pack_into(self.buffer, _DATA_START + position, len(body))
+        start = _DATA_START + position + _LENGTH.size
+        self.buffer[start:start + len(body)] = body
+        _HEADER.pack_into(self.buffer, 0, head, tail, consumers, messages + 1)
+        return True
+
+    def _try_get(self):
+        head, tail, consumers, messages = self._header()
+        if head == tail:
+            return None
+        position = head % self.capacity
+        remaining = self.capacity - position
+        if remaining < _LENGTH.size or _LENGTH.unpack_from(self.buffer, _DATA_START + position)[0] == _WRAP:
+            head += remaining
+            position = 0
+        length = _LENGTH.unpack_from(self.buffer, _DATA_START + position)[0]
+        start = _DATA_START + position + _LENGTH.size
+        body = bytes(self.buffer[start:start + length])
+        _HEADER.pack_into(self.buffer, 0, head + _LENGTH.size + length, tail, consumers, messages - 1)
+        return body
+
+    def put(self, body):
+        """Encola body, esperando mientras el anillo este lleno."""
+        if _LENGTH.size + len(body) > self.capacity:
+            raise ValueError(f"Message of {len(body)} bytes does not fit in ring '{self.queue}'")
+        wait = _MIN_WAIT
+        while True:
+            self._lock()
+            try:
+                if self._try_put(body):
+                    return
+            finally:
+                self._unlock()
+            time.sleep(wait)
+            wait = min(wait * 2, _MAX_WAIT)
+
+    def put_front(self, body):
+        """Vuelve a encolar body al principio del anillo, sin esperar. False si no entra."""
+        self._lock()
+        try:
+            return self._try_put_front(body)
+        finally:
+            self._unlock()
+
+    def get(self, timeout):
+        """Desencola un mensaje, esperando hasta timeout segundos. None si no llego ninguno."""
+        deadline = time.monotonic() + timeout
+        wait = _MIN_WAIT
+        while True:
+            self._lock()
+            try:
+                body = self._try_get()
+            finally:
+                self._unlock()
+            if body is not None:
+                return body
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(wait, remaining))
+            wait = min(wait * 2, _MAX_WAIT)
+
+    def add_consumer(self, delta):
+        self._lock()
+        try:
+            head, tail, consumers, messages = self._header()
+            _HEADER.pack_into(self.buffer, 0, head, tail, max(0, consumers + delta), messages)
+        finally:
+            self._unlock()
+
+    def consumer_count(self):
+        return self._header()[2]
+
+    def message_count(self):
+        return self._header()[3]
+
+    def purge(self):
+        self._lock()
+        try:
+            head, tail, consumers, _ = self._header()
+            _HEADER.pack_into(self.buffer, 0, tail, tail, consumers, 0)
+        finally:
+            self._unlock()
+
+    def unlink(self):
+        if resource_tracker is not None:
+            # SharedMemory.unlink() lo da de baja del resource tracker
+            resource_tracker.register(self.segment._name, 'shared_memory')
+        for remove in (self.segment.unlink, lambda: os.unlink(os.path.join(SHM_DIR, f"{self.name}.lock"))):
+            try:
+                remove()
+            except FileNotFoundError:
+                pass
+
+
+class ShmExchange:
+    """
+    Bindings de un exchange direct entre anillos: cada binding es un archivo
+    vacio `<routing_key>@<cola>` en un directorio por exchange, que crean los
+    consumidores al conectarse y leen los productores al publicar.
+    """
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.directory = os.path.join(SHM_DIR, f"{SHM_PREFIX}bindings_{quote(exchange, safe='')}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.modified_at = None
+        self.bindings = {}  # routing_key -> [colas]
+
+    def bind(self, queue, routing_key=''):
+        path = os.path.join(self.directory, f"{quote(routing_key, safe='')}@{quote(queue, safe='')}")
+        with open(path, 'a'):
+            pass
+
+    def unbind(self, queue):
+        for entry in os.listdir(self.directory):
+            if unquote(entry.rsplit('@', 1)[1]) == queue:
+                os.unlink(os.path.join(self.directory, entry))
+
+    def queues(self, routing_key=''):
+        """Colas enlazadas a la routing key (se relee el directorio solo si cambio)."""
+        modified_at = os.stat(self.directory).st_mtime_ns
+        if modified_at != self.modified_at:
+            bindings = {}
+            for entry in os.listdir(self.directory):
+                key, queue = entry.rsplit('@', 1)
+                bindings.setdefault(unquote(key), []).append(unquote(queue))
+            self.bindings = bindings
+            self.modified_at = modified_at
+        return self.bindings.get(routing_key, [])
+
+
+_rings = {}
+_rings_lock = threading.Lock()
+
+def open_ring(queue):
+    """Anillo de la cola, abierto una sola vez por proceso (y compartido por sus threads)."""
+    with _rings_lock:
+        ring = _rings.get(queue)
+        if ring is None:
+            ring = _rings[queue] = ShmRing(queue)
+        return ring
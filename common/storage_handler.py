@@ -1,103 +1,234 @@
 import os
-import json
-import uuid
+import struct
+import threading
+import time
 import logging
+import orjson
+
+# Tamaño a partir del cual se abre un segmento nuevo
+STORAGE_SEGMENT_SIZE = int(os.getenv('STORAGE_SEGMENT_SIZE', str(64 * 1024 * 1024)))
+# Group commit: se hace fsync cada tantos registros o cada tantos ms, lo que pase primero
+STORAGE_SYNC_EVERY = int(os.getenv('STORAGE_SYNC_EVERY', '256'))
+STORAGE_SYNC_INTERVAL_MS = int(os.getenv('STORAGE_SYNC_INTERVAL_MS', '50'))
+
+# Registro: operacion, largo de la clave, largo del valor, clave, valor (JSON)
+_HEADER = struct.Struct('>BII')
+_ADD = 1     # agrega el valor a la lista de la clave
+_STORE = 2   # reemplaza el valor de la clave
+_DELETE = 3  # borra las claves con el prefijo (la clave del registro)
+
+_SEGMENT_PREFIX = 'segment_'
+_SEGMENT_SUFFIX = '.log'
+
 
 class StorageHandler:
-    def __init__(self, data_dir='./data'):
+    """
+    Almacenamiento en disco clave -> valores sobre un log de segmentos
+    append-only: cada add/store/clean escribe un registro al final del segmento
+    activo, y un índice en memoria guarda dónde está cada valor. Al abrir un
+    directorio existente el índice se reconstruye leyendo los segmentos.
+
+    Los fsync se agrupan (ver STORAGE_SYNC_EVERY y STORAGE_SYNC_INTERVAL_MS).
+    Un segmento se borra entero cuando ya no tiene valores vivos y todos los
+    anteriores se borraron, así que limpiar claves no reescribe nada.
+    """
+    def __init__(self, data_dir='./data', segment_size=None, sync_every=None, sync_interval=None):
         """Inicializa el manejador de almacenamiento con un directorio base."""
         self.data_dir = data_dir
-        self.index = {}  # Diccionario para almacenar índices de claves {key: file_id}
+        self.segment_size = segment_size or STORAGE_SEGMENT_SIZE
+        self.sync_every = sync_every or STORAGE_SYNC_EVERY
+        self.sync_interval = sync_interval if sync_interval is not None else STORAGE_SYNC_INTERVAL_MS / 1000
+        self.index = {}  # clave -> [(segmento, offset, largo, operacion)] de sus valores vivos
+        self.live = {}  # segmento -> cantidad de valores vivos
+        self.segments = []  # segmentos existentes, del más viejo al activo
+        self.read_fds = {}  # segmento -> fd para leer con pread
+        self.lock = threading.RLock()
+        self.active = None
+        self.active_size = 0
+        self.unflushed = False
+        self.pending_sync = 0
+        self.last_sync = time.monotonic()
         if not os.path.exists(data_dir):
             logging.info(f"Creando directorio: {data_dir}")
             os.makedirs(data_dir)
         self._load_index()
 
+    def _segment_path(self, segment):
+        return os.path.join(self.data_dir, f'{_SEGMENT_PREFIX}{segment:06d}{_SEGMENT_SUFFIX}')
+
     def _load_index(self):
-        """Carga el índice de claves desde el archivo de metadatos."""
-        meta_file = os.path.join(self.data_dir, 'meta.json')
-        if os.path.exists(meta_file):
-            try:
-                with open(meta_file, 'r', encoding='utf-8') as f:
-                    self.index = json.load(f)
-                logging.debug(f"Índice cargado: {self.index}")
-            except Exception as e:
-                logging.error(f"Error al cargar índice {meta_file}: {e}")
-        else:
-            logging.debug("No se encontró archivo de metadatos, inicializando índice vacío")
+        """Reconstruye el índice leyendo los segmentos en orden."""
+        segments = sorted(
+            int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.data_dir)
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)
+        )
+        for segment in segments:
+            self.segments.append(segment)
+            self.live[segment] = 0
+            self._replay(segment)
+        if self.segments:
+            logging.debug(f"Índice cargado de {len(self.segments)} segmentos: {len(self.index)} claves")
+        self.active_segment = self.segments[-1] if self.segments else 0
+
+    def _replay(self, segment):
+        path = self._segment_path(segment)
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            op, key_length, value_length = _HEADER.unpack_from(data, offset)
+            end = offset + _HEADER.size + key_length + value_length
+            if end > len(data) or op not in (_ADD, _STORE, _DELETE):
+                break
+            key = data[offset + _HEADER.size:offset + _HEADER.size + key_length].decode('utf-8')
+            self._apply(op, key, (segment, offset, end - offset, op))
+            offset = end
+        if offset < len(data):
+            # Registro a medio escribir (el nodo se cayó antes del fsync): se descarta
+            logging.error(f"Descartando {len(data) - offset} bytes incompletos al final de {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+    def _apply(self, op, key, location):
+        """Actualiza el índice con un registro ya escrito en location."""
+        if op == _DELETE:
+            for stored_key in [k for k in self.index if k.startswith(key)]:
+                self._drop(stored_key)
+            return
+        if op == _STORE:
+            self._drop(key)
+        self.index.setdefault(key, []).append(location)
+        self.live[location[0]] += 1
+
+    def _drop(self, key):
+        for segment, _, _, _ in self.index.pop(key, ()):
+            self.live[segment] -= 1
 
-    def _save_index(self):
-        """Guarda el índice en un archivo JSON."""
-        meta_file = os.path.join(self.data_dir, 'meta.json')
+    def _open_segment(self, segment):
+        """El segmento activo se abre recién con la primera escritura."""
+        if segment not in self.live:
+            self.segments.append(segment)
+            self.live[segment] = 0
+        self.active_segment = segment
+        self.active = open(self._segment_path(segment), 'ab')
+        self.active_size = self.active.tell()
+
+    def _write(self, op, key, value=b''):
+        key_bytes = key.encode('utf-8')
+        record = _HEADER.pack(op, len(key_bytes), len(value)) + key_bytes + value
+        if self.active is None:
+            self._open_segment(self.active_segment)
+        if self.active_size and self.active_size + len(record) > self.segment_size:
+            self._roll()
+        location = (self.active_segment, self.active_size, len(record), op)
+        self.active.write(record)
+        self.active_size += len(record)
+        self.unflushed = True
+        self.pending_sync += 1
+        if self.pending_sync >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+        return location
+
+    def _roll(self):
+        """Cierra el segmento activo y abre el siguiente."""
+        self.sync()
+        self.active.close()
+        self._open_segment(self.active_segment + 1)
+
+    def sync(self):
+        """Baja a disco (fsync) todo lo escrito hasta ahora."""
+        with self.lock:
+            if self.active is None:
+                return
+            if self.pending_sync:
+                self.active.flush()
+                os.fsync(self.active.fileno())
+            self.unflushed = False
+            self.pending_sync = 0
+            self.last_sync = time.monotonic()
+
+    def _read(self, location):
+        segment, offset, length, _ = location
+        if segment == self.active_segment and self.unflushed:
+            # Lo escrito tiene que estar en el archivo (no hace falta el fsync) para leerlo
+            self.active.flush()
+            self.unflushed = False
+        fd = self.read_fds.get(segment)
+        if fd is None:
+            fd = self.read_fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        record = os.pread(fd, length, offset)
+        _, key_length, _ = _HEADER.unpack_from(record)
+        return orjson.loads(record[_HEADER.size + key_length:])
+
+    def _release_segments(self):
+        """Borra los segmentos del principio del log que ya no tienen valores vivos."""
         if not self.index:
-            # Si el índice está vacío, elimina el archivo de metadatos
-            if os.path.exists(meta_file):
-                try:
-                    os.remove(meta_file)
-                    logging.debug(f"Archivo de metadatos {meta_file} eliminado")
-                except Exception as e:
-                    logging.error(f"Error al eliminar {meta_file}: {e}")
+            # No queda nada vivo: se descartan todos los segmentos, incluido el activo
+            self._remove_segments(list(self.segments))
+            self.active_segment += 1
             return
-        try:
-            with open(meta_file, 'w', encoding='utf-8') as f:
-                json.dump(self.index, f, ensure_ascii=False, indent=2)
-            logging.debug(f"Índice guardado en {meta_file}")
-        except Exception as e:
-            logging.error(f"Error al guardar índice: {e}")
+        while len(self.segments) > 1 and self.live[self.segments[0]] == 0:
+            self._remove_segments([self.segments[0]])
 
-    def _get_file_id(self, key):
-        """Obtiene o genera un ID único para una clave."""
-        if key not in self.index:
-            file_id = str(uuid.uuid4())
-            self.index[key] = file_id
-            self._save_index()
-        return self.index[key]
+    def _remove_segments(self, segments):
+        for segment in segments:
+            if segment == self.active_segment and self.active is not None:
+                self.active.close()
+                self.active = None
+                self.pending_sync = 0
+                self.unflushed = False
+            fd = self.read_fds.pop(segment, None)
+            if fd is not None:
+                os.close(fd)
+            try:
+                os.remove(self._segment_path(segment))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.error(f"Error al eliminar segmento {segment}: {e}")
+            self.segments.remove(segment)
+            del self.live[segment]
 
     def store(self, key, value):
         """Almacena un valor para una clave."""
-        file_id = self._get_file_id(key)
-        file_path = os.path.join(self.data_dir, f'data_{file_id}.json')
         try:
-            data = {'value': value}
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False)
-            logging.debug(f"Almacenado {key} en {file_path}")
+            with self.lock:
+                location = self._write(_STORE, key, orjson.dumps(value))
+                self._apply(_STORE, key, location)
+            logging.debug(f"Almacenado {key}")
         except Exception as e:
             logging.error(f"Error al almacenar {key}: {e}")
 
     def add(self, key, value):
         """Agrega un valor a una clave existente, concatenándolo como lista."""
-        file_id = self._get_file_id(key)
-        file_path = os.path.join(self.data_dir, f'data_{file_id}.json')
         try:
-            # Leer datos existentes
-            data = {'value': []}
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            # Asegurarse de que 'value' sea una lista
-            if not isinstance(data['value'], list):
-                data['value'] = [data['value']]
-            data['value'].append(value)
-            # Guardar datos actualizados
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False)
-            logging.debug(f"Agregado {value} a {key} en {file_path}")
+            with self.lock:
+                location = self._write(_ADD, key, orjson.dumps(value))
+                self._apply(_ADD, key, location)
+            logging.debug(f"Agregado {value} a {key}")
         except Exception as e:
             logging.error(f"Error al agregar {value} a {key}: {e}")
 
     def retrieve(self, key):
         """Recupera el valor asociado a una clave."""
-        if key not in self.index:
-            return ''
-        file_id = self.index[key]
-        file_path = os.path.join(self.data_dir, f'data_{file_id}.json')
         try:
-            if not os.path.exists(file_path):
-                return ''
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data['value']
+            with self.lock:
+                locations = self.index.get(key)
+                if not locations:
+                    return ''
+                value = None
+                for location in locations:
+                    item = self._read(location)
+                    if location[3] == _STORE:
+                        value = item
+                        continue
+                    if value is None:
+                        value = []
+                    elif not isinstance(value, list):
+                        value = [value]
+                    value.append(item)
+                return value
         except Exception as e:
             logging.error(f"Error al recuperar {key}: {e}")
             return ''
@@ -105,7 +236,8 @@ class StorageHandler:
     def list_keys(self, prefix=''):
         """Lista las claves que coinciden con un prefijo."""
         try:
-            return [key for key in self.index if key.startswith(prefix)]
+            with self.lock:
+                return [key for key in self.index if key.startswith(prefix)]
         except Exception as e:
             logging.error(f"Error al listar claves con prefijo {prefix}: {e}")
             return []
@@ -113,50 +245,40 @@ class StorageHandler:
     def clean(self, prefix=''):
         """Elimina claves que coinciden con un prefijo."""
         try:
-            keys_to_remove = self.list_keys(prefix)
-            for key in keys_to_remove:
-                file_id = self.index[key]
-                file_path = os.path.join(self.data_dir, f'data_{file_id}.json')
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                    del self.index[key]
-                    logging.debug(f"Eliminada clave {key}")
-                except Exception as e:
-                    logging.error(f"Error al eliminar {key}: {e}")
-            self._save_index()
+            with self.lock:
+                if not self.list_keys(prefix):
+                    return
+                if prefix and len(self.index) > len(self.list_keys(prefix)):
+                    # Queda algo vivo: el borrado se registra en el log para reconstruir el índice.
+                    # Tiene que estar en disco antes de borrar segmentos: si no, al
+                    # reabrir reaparecen las claves de los segmentos que quedan
+                    self._write(_DELETE, prefix)
+                    self.sync()
+                self._apply(_DELETE, prefix, None)
+                self._release_segments()
+            logging.debug(f"Eliminadas claves con prefijo {prefix}")
         except Exception as e:
             logging.error(f"Error al eliminar claves con prefijo {prefix}: {e}")
 
     def clean_all(self):
         """Elimina todos los datos almacenados en el disco y reinicia el índice."""
         try:
-            # Eliminar todos los archivos de datos asociados a las claves
-            for key in list(self.index.keys()):
-                file_id = self.index[key]
-                file_path = os.path.join(self.data_dir, f'data_{file_id}.json')
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                    del self.index[key]
-                    logging.debug(f"Eliminada clave {key}")
-                except Exception as e:
-                    logging.error(f"Error al eliminar {key}: {e}")
-
-            # Reiniciar el índice
-            self.index = {}
-            self._save_index()
-
-            # Eliminar cualquier archivo data_*.json residual
-            for file_name in os.listdir(self.data_dir):
-                if file_name.startswith('data_') and file_name.endswith('.json'):
-                    file_path = os.path.join(self.data_dir, file_name)
-                    try:
-                        print(f"Borrando archivo residual {file_path}")
-                        os.remove(file_path)
-                    except Exception as e:
-                        logging.error(f"Error al eliminar archivo residual {file_path}: {e}")
-
+            with self.lock:
+                self.index = {}
+                for segment in self.live:
+                    self.live[segment] = 0
+                self._release_segments()
             logging.info("Todos los datos en el disco y el índice han sido eliminados.")
         except Exception as e:
-            logging.error(f"Error al limpiar todos los datos: {e}")
\ No newline at end of file
+            logging.error(f"Error al limpiar todos los datos: {e}")
+
+    def close(self):
+        """Baja a disco lo pendiente y cierra los archivos."""
+        with self.lock:
+            if self.active is not None:
+                self.sync()
+                self.active.close()
+                self.active = None
+            for fd in self.read_fds.values():
+                os.close(fd)
+            self.read_fds = {}
@@ -1,11 +1,11 @@
-import ast
 import json
 import os
 from datetime import datetime
 import threading
 import signal
 from common.leader_queue import LeaderQueue
-from common.packet import DataPacket, QueryPacket, is_final_packet
+from common.literal_scanner import parse_literal
+from common.packet import DataPacket, QueryPacket, PacketEnvelope, is_final_packet
 from common.middleware import Middleware
 
 
@@ -135,9 +135,9 @@ class DeliverNode:
             value = movie.get(key, "")
 
             # Intentamos parsear strings que parezcan listas/dicts
-            if isinstance(value, str):
+            if isinstance(value, str) and value[:1] in ('[', '{'):
                 try:
-                    parsed = ast.literal_eval(value)
+                    parsed = parse_literal(value, keys=('name',))
                     value = parsed
                 except (ValueError, SyntaxError):
                     pass
@@ -192,10 +192,9 @@ class DeliverNode:
                 self.input_rabbitmq.close_graceful(method)
                 return
             # Recibo el paquete, si es el último mando los resultados
-            body_decoded = body.decode()
-            packet = json.loads(body_decoded)
-            if is_final_packet(packet.get("header")):
-                    client_id = packet.get("client_id")
+            envelope = PacketEnvelope(body)
+            if is_final_packet(envelope.header):
+                    client_id = envelope.client_id
                     response_str = self._generate_response(client_id)
                     query_packet = QueryPacket(
                         timestamp=datetime.utcnow().isoformat(),
@@ -207,7 +206,7 @@ class DeliverNode:
                     ch.basic_ack(delivery_tag=method.delivery_tag)
                     return
 
-            packet = DataPacket.from_json(body_decoded)
+            packet = envelope.to_packet()
             filtered_movie = self._process_movie(packet.data, packet.client_id)
 
             print(f" [DeliverNode] Movie added: {filtered_movie} with id: {packet.client_id}")
@@ -1,90 +1,188 @@
 # check_condition.py
-import ast
 import math
-from datetime import datetime
+import numpy as np
+from common.literal_scanner import parse_literal
 
 def parse_string(value):
     try:
         # Parseo el string JSON a un objeto de Python
-        parsed = ast.literal_eval(value)
+        parsed = parse_literal(value)
         return parsed
     except (ValueError, SyntaxError) as e:
         print(f"Error parsing string: {e}")
         return None
 
-def check_condition(value, condition):
-    if value is None or (isinstance(value, float) and math.isnan(value)):
-        return False
-    if condition is None:
-        return True
-    op, target, _ = condition
-    if op == 'more_date':
-        try:
-            if value:
-                year_str = value.split('-')[0]
-                year = datetime.strptime(year_str, '%Y').year
-                result = year > float(target)
-                return result
-            return False
-        except (ValueError, TypeError) as e:
-            return False
-    elif op == 'less_date':
-        try:
-            if value:
-                year_str = value.split('-')[0]
-                year = datetime.strptime(year_str, '%Y').year
-                result = year < float(target)
-                return result
-            return False
-        except (ValueError, TypeError) as e:
+def parse_year(value):
+    """Anio de una fecha 'YYYY-MM-DD' (o del anio ya convertido por el parser, ver TYPED_COLUMNS)."""
+    if isinstance(value, int):
+        return value
+    year_str = value.split('-')[0]
+    # Mismo formato que acepta strptime('%Y'): exactamente cuatro digitos
+    if len(year_str) != 4 or not year_str.isascii() or not year_str.isdigit():
+        raise ValueError(f"Invalid year: {year_str}")
+    return int(year_str)
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def _compare_year(compare):
+    def predicate(value):
+        if _is_missing(value) or not value:
             return False
-    elif op == 'more':
         try:
-            if value:
-                num = int(value)  
-                result = num > float(target)
-                return result
+            return compare(parse_year(value))
+        except (ValueError, TypeError, AttributeError):
             return False
-        except (ValueError, TypeError) as e:
+    return predicate
+
+def _compare_number(compare):
+    def predicate(value):
+        if _is_missing(value) or not value:
             return False
-    elif op == 'less':
         try:
-            if value:
-                num = int(value)  
-                result = num < float(target)
-                return result
+            return compare(int(value))
+        except (ValueError, TypeError):
             return False
-        except (ValueError, TypeError) as e:
+    return predicate
+
+def _equal(target):
+    target = str(target).lower()
+    def predicate(value):
+        return not _is_missing(value) and str(value).lower() == target
+    return predicate
+
+def _parsed(value):
+    return parse_string(value) if isinstance(value, str) else value
+
+def _contains(targets):
+    targets_lower = frozenset(str(t).lower() for t in targets)
+    def predicate(value):
+        if _is_missing(value):
             return False
-    elif op == 'equal':
-        result = str(value).lower() == str(target).lower()
-        return result
-    elif op == 'in':
-        parsed = parse_string(value) if isinstance(value, str) else value
-        target_lower = [str(t).lower() for t in target]
-        match_found = False
+        parsed = _parsed(value)
         if isinstance(parsed, list):
             for item in parsed:
                 if isinstance(item, dict):
                     # Si es un diccionario compara contra todos sus elementos
-                    for key, item_value in item.items():
-                        if any(t_lower == str(item_value).lower() for t_lower in target_lower):
-                            match_found = True
-                            break
-                    if match_found:
-                        break
-                elif any(t_lower == str(item).lower() for t_lower in target_lower):
-                    match_found = True
-                    break
-        elif isinstance(parsed, str):
-            match_found = any(t_lower in str(parsed).lower() for t_lower in target_lower)
-        return match_found
-    elif op == "count":
-        parsed = parse_string(value) if isinstance(value, str) else value
-        if not isinstance(parsed, list):
+                    if any(str(item_value).lower() in targets_lower for item_value in item.values()):
+                        return True
+                elif str(item).lower() in targets_lower:
+                    return True
+            return False
+        if isinstance(parsed, str):
+            parsed_lower = parsed.lower()
+            return any(t_lower in parsed_lower for t_lower in targets_lower)
+        return False
+    return predicate
+
+def _count(target):
+    target = int(target)
+    def predicate(value):
+        if _is_missing(value):
             return False
-        return len(parsed) == int(target)
-        
+        parsed = _parsed(value)
+        return isinstance(parsed, list) and len(parsed) == target
+    return predicate
+
+def _never(value):
     return False
 
-   
\ No newline at end of file
+def compile_condition(condition):
+    """
+    Compila una condicion (op, target, key) de FILTERS en un predicado
+    predicate(value) -> bool, con el target ya normalizado.
+    """
+    if condition is None:
+        return lambda value: not _is_missing(value)
+    op, target, _ = condition
+    if op in ('more_date', 'less_date', 'more', 'less'):
+        threshold = float(target)
+    if op == 'more_date':
+        return _compare_year(lambda year: year > threshold)
+    if op == 'less_date':
+        return _compare_year(lambda year: year < threshold)
+    if op == 'more':
+        return _compare_number(lambda num: num > threshold)
+    if op == 'less':
+        return _compare_number(lambda num: num < threshold)
+    if op == 'equal':
+        return _equal(target)
+    if op == 'in':
+        return _contains(target)
+    if op == 'count':
+        return _count(target)
+    return _never
+
+def check_condition(value, condition):
+    return compile_condition(condition)(value)
+
+
+# Mascaras por columna: evaluan una condicion sobre los valores de una columna
+# de todo un batch a la vez y devuelven un array de bools. Las columnas que
+# numpy puede representar como un array de numeros (o de strings, para equal)
+# se comparan vectorizadas; las demas (listas, fechas sin convertir, faltantes)
+# aplican el predicado valor por valor.
+
+def _as_array(values):
+    try:
+        array = np.asarray(values)
+    except ValueError:
+        return None
+    return array if array.ndim == 1 else None
+
+def _map_predicate(values, predicate):
+    return np.fromiter((predicate(value) for value in values), dtype=bool, count=len(values))
+
+def _year_mask(compare, predicate):
+    def mask(values):
+        array = _as_array(values)
+        if array is not None and array.dtype.kind in 'iu':
+            # Anios ya convertidos por el parser (TYPED_COLUMNS)
+            return (array != 0) & compare(array)
+        return _map_predicate(values, predicate)
+    return mask
+
+def _number_mask(compare, predicate):
+    def mask(values):
+        array = _as_array(values)
+        if array is not None and array.dtype.kind in 'iu':
+            return (array != 0) & compare(array)
+        if array is not None and array.dtype.kind == 'f':
+            # int(value) trunca hacia cero; el 0 y los NaN no pasan
+            with np.errstate(invalid='ignore'):
+                return ~np.isnan(array) & (array != 0) & compare(np.trunc(array))
+        return _map_predicate(values, predicate)
+    return mask
+
+def _equal_mask(target, predicate):
+    target = str(target).lower()
+    def mask(values):
+        array = _as_array(values)
+        if array is not None and array.dtype.kind == 'U':
+            return np.char.lower(array) == target
+        return _map_predicate(values, predicate)
+    return mask
+
+def compile_mask(condition):
+    """
+    Compila una condicion (op, target, key) de FILTERS en una mascara
+    mask(values: list) -> np.ndarray de bools, equivalente a aplicar
+    compile_condition(condition) a cada valor.
+    """
+    predicate = compile_condition(condition)
+    if condition is None:
+        return lambda values: _map_predicate(values, predicate)
+    op, target, _ = condition
+    if op in ('more_date', 'less_date', 'more', 'less'):
+        threshold = float(target)
+    if op == 'more_date':
+        return _year_mask(lambda years: years > threshold, predicate)
+    if op == 'less_date':
+        return _year_mask(lambda years: years < threshold, predicate)
+    if op == 'more':
+        return _number_mask(lambda nums: nums > threshold, predicate)
+    if op == 'less':
+        return _number_mask(lambda nums: nums < threshold, predicate)
+    if op == 'equal':
+        return _equal_mask(target, predicate)
+    return lambda values: _map_predicate(values, predicate)
@@ -1,7 +1,7 @@
 import json
 from common.middleware import Middleware
-from common.packet import DataPacket, is_final_packet
-from src.check_condition import check_condition
+from common.packet import DataPacket, PacketEnvelope, is_final_packet
+from src.filter_sets import FilterSet, parse_filter_argument
 from datetime import datetime
 import os
 import signal
@@ -10,7 +10,7 @@ class FilterNode:
     def __init__(self):
         signal.signal(signal.SIGTERM, self._sigterm_handler)
         self.running = True
-        self.filters = {}
+        self.filter_sets = []
         self.input_queue = os.getenv("RABBITMQ_QUEUE", "movie_queue")
         self.exchange = os.getenv("RABBITMQ_EXCHANGE", "")
         self.routing_key = os.getenv("RABBITMQ_ROUTING_KEY", "")
@@ -21,12 +21,23 @@ class FilterNode:
         keep_columns = os.getenv("KEEP_COLUMNS", "")
         self.cluster_size = int(os.getenv("CLUSTER_SIZE"))
         self.node_id = int(os.getenv("NODE_ID"))
+        # Desde cuantas filas se filtra un batch con mascaras por columna
+        self.vectorized_min_rows = int(os.getenv("VECTORIZED_MIN_ROWS", "32"))
+        # Cada cuantas filas se reordenan las condiciones segun su costo y selectividad (0 desactiva)
+        self.reorder_interval = int(os.getenv("FILTER_REORDER_INTERVAL", "1000"))
 
 
         if keep_columns:
-         self.keep_columns = [col.strip() for col in keep_columns.split(",") if col.strip()]
+         self.keep_columns = _parse_columns(keep_columns)
          
-        if self.output_exchange: 
+        self.output_rabbitmq = None
+        filter_sets = os.getenv("FILTER_SETS", "")
+        if filter_sets:
+            # Shared scan: un solo nodo evalua los filtros de varios servicios
+            # sobre cada fila y publica a la salida de cada uno lo que le pasa
+            for name in [name.strip() for name in filter_sets.split(",") if name.strip()]:
+                self.filter_sets.append(self._filter_set_from_env(name))
+        elif self.output_exchange: 
             self.output_rabbitmq = Middleware(queue=None, exchange=self.output_exchange)
         else:
             self.output_rabbitmq = Middleware(queue=self.output_queue)
@@ -53,10 +64,10 @@ class FilterNode:
                 self.input_rabbitmq.close_graceful(method)
                 return
 
-            packet_json = body.decode()
-            packet = json.loads(packet_json)
-            header = packet.get("header")
+            envelope = PacketEnvelope(body)
+            header = envelope.header
             if is_final_packet(header):
+                packet = envelope.fields()
                 # Si la lista de acks es None, entonces soy el primero en recibir el mensaje FIN
                 # Agrego la lista con mi id y la reencolo
                 if packet.get("acks") is None:
@@ -74,7 +85,9 @@ class FilterNode:
                     client_id = packet["client_id"]
                     acks = packet["acks"]
                     print(f"[Filter - FIN] - Lista de acks completa ({acks}), mando final packet (client_id = {client_id})")
-                    self.output_rabbitmq.send_final(client_id=client_id)
+                    for filter_set in self.filter_sets:
+                        filter_set.output_rabbitmq.send_final(client_id=client_id)
+                        filter_set.report()
                 
                 # Si faltan ids en la lista de ids, reencolo el mensaje (despues de haberme agregado)
                 else:
@@ -84,29 +97,24 @@ class FilterNode:
                 ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
 
-            movie = packet.get("data")
-            client_id = packet.get("client_id")
-
-            # Aplicar los filtros de la instancia
-            for _, condition in self.filters.items():
-                _, _, key = condition
-                value = movie.get(key)
-                if not check_condition(value, condition):
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                    return
-
-            filtered_packet = DataPacket(
-                client_id=client_id,
-                timestamp=datetime.utcnow().isoformat(),
-                data=movie,
-                keep_columns=self.keep_columns
-            )
+            movie = envelope.data
+            client_id = envelope.client_id
+
+            # Aplicar los filtros de cada conjunto y publicar a su salida
+            results = {}
+            for filter_set in self.filter_sets:
+                if not filter_set.passes(movie, results):
+                    continue
+
+                filtered_packet = DataPacket(
+                    client_id=client_id,
+                    timestamp=datetime.utcnow().isoformat(),
+                    data=movie,
+                    keep_columns=filter_set.keep_columns
+                )
+                filter_set.output_rabbitmq.publish(filtered_packet.encode())
+                print(f" [✓] Filtered and Published to {filter_set.name}: ID: {movie.get('id')}, Title: {movie.get('title', 'Unknown')}, Genres: {movie.get('genres')}")
 
-            # Publicar el paquete filtrado a la cola del gateway
-            
-            self.output_rabbitmq.publish(filtered_packet.to_json())
-            
-            print(f" [✓] Filtered and Published to {self.output_queue}: ID: {movie.get('id')}, Title: {movie.get('title', 'Unknown')}, Genres: {movie.get('genres')}")
             ch.basic_ack(delivery_tag=method.delivery_tag)
             print(f" [x] Message {method.delivery_tag} acknowledged")
 
@@ -117,12 +125,72 @@ class FilterNode:
             print(f" [!] Error processing message: {e}")
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
 
+    def process_batch(self, ch, method, properties, bodies):
+        """
+        Filtra todos los paquetes de un mensaje BATCH de una vez y publica los
+        que pasan en un unico BATCH. Los FIN nunca viajan dentro de un batch.
+        """
+        try:
+            if self.running == False:
+                self.input_rabbitmq.close_graceful(method)
+                return
+
+            envelopes = [PacketEnvelope(body) for body in bodies]
+            movies = [envelope.data for envelope in envelopes]
+            # Los batches grandes se evaluan con una mascara por condicion sobre
+            # la columna entera; los chicos, fila a fila
+            vectorized = len(movies) >= self.vectorized_min_rows
+            columns, batch_results = {}, {}
+            row_results = [{} for _ in movies]
+
+            timestamp = datetime.utcnow().isoformat()
+            for filter_set in self.filter_sets:
+                if vectorized:
+                    passed = filter_set.mask(movies, columns, batch_results)
+                else:
+                    passed = [filter_set.passes(movie, results) for movie, results in zip(movies, row_results)]
+                filtered_bodies = [
+                    DataPacket(
+                        client_id=envelope.client_id,
+                        timestamp=timestamp,
+                        data=movie,
+                        keep_columns=filter_set.keep_columns
+                    ).encode()
+                    for envelope, movie, keep in zip(envelopes, movies, passed) if keep
+                ]
+                filter_set.output_rabbitmq.publish_batch(filtered_bodies)
+                print(f" [✓] Filtered batch: {len(filtered_bodies)} of {len(bodies)} published to {filter_set.name}")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            print(f" [x] Message {method.delivery_tag} acknowledged")
+        except Exception as e:
+            print(f" [!] Error processing batch: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
+
+    def _filter_set_from_env(self, name):
+        """
+        Arma un conjunto de filtros de FILTER_SETS a partir de sus variables
+        {NOMBRE}_FILTERS, {NOMBRE}_KEEP_COLUMNS, {NOMBRE}_OUTPUT_EXCHANGE y
+        {NOMBRE}_OUTPUT_QUEUE (por defecto, el nombre del conjunto).
+        """
+        prefix = name.upper()
+        filters = parse_filter_argument(os.getenv(f"{prefix}_FILTERS", ""))
+        keep_columns = _parse_columns(os.getenv(f"{prefix}_KEEP_COLUMNS", "")) or None
+        output_exchange = os.getenv(f"{prefix}_OUTPUT_EXCHANGE", "")
+        if output_exchange:
+            output_rabbitmq = Middleware(queue=None, exchange=output_exchange)
+        else:
+            output_rabbitmq = Middleware(queue=os.getenv(f"{prefix}_OUTPUT_QUEUE", name))
+        return FilterSet(name, filters, keep_columns, output_rabbitmq, self.reorder_interval)
+
     def start_node(self, filters):
-        self.filters = filters
-        print(f" [~] Applying filters: {self.filters}")
+        if not self.filter_sets:
+            # Los filtros se compilan una sola vez en predicados por columna
+            self.filter_sets = [FilterSet(self.output_exchange or self.output_queue, filters, self.keep_columns, self.output_rabbitmq, self.reorder_interval)]
+        for filter_set in self.filter_sets:
+            print(f" [~] Applying filters for {filter_set.name}: {filter_set.filters}")
 
         try:
-            self.input_rabbitmq.consume(self.callback)
+            self.input_rabbitmq.consume(self.callback, self.process_batch)
         except Exception as e:
             print(f" [!] Error in filter node: {e}")
         finally:
@@ -138,8 +206,14 @@ class FilterNode:
         print(f"Closing queues")
         if self.input_rabbitmq:
             self.input_rabbitmq.close()
-        if self.output_rabbitmq:
+        for filter_set in self.filter_sets:
+            filter_set.report()
+            filter_set.output_rabbitmq.close()
+        if self.output_rabbitmq and not self.filter_sets:
             self.output_rabbitmq.close()
        
         
 
+
+def _parse_columns(columns):
+    return [col.strip() for col in columns.split(",") if col.strip()]
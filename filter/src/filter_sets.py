@@ -0,0 +1,198 @@
+# filter_sets.py
+import time
+import numpy as np
+from src.check_condition import compile_condition, compile_mask
+
+def parse_filter_argument(filter_str):
+    filters = {}
+    count = 0
+    if filter_str:
+        conditions = filter_str.split(';')
+        for condition in conditions:
+            count += 1
+            parts = condition.strip().split(':')
+            if len(parts) == 2:
+                key = parts[0].strip()
+                value_part = parts[1].strip()
+                if value_part.startswith('equal(') and value_part.endswith(')'):
+                    target = value_part[len('equal('):-1].strip()
+                    filters[count] = ('equal', target, key)
+                elif value_part.startswith('less(') and value_part.endswith(')'):
+                    try:
+                        target = float(value_part[len('less('):-1].strip())
+                        filters[count] = ('less', target, key)
+                    except ValueError:
+                        print(f" [!] Invalid 'less' value: {value_part}")
+                elif value_part.startswith('more(') and value_part.endswith(')'):
+                    try:
+                        target = float(value_part[len('more('):-1].strip())
+                        filters[count] = ('more', target, key)
+                    except ValueError:
+                        print(f" [!] Invalid 'more' value: {value_part}")
+                elif value_part.startswith('less_date(') and value_part.endswith(')'):
+                    try:
+                        target = float(value_part[len('less_date('):-1].strip())
+                        filters[count] = ('less_date', target, key)
+                    except ValueError:
+                        print(f" [!] Invalid 'less_date' value: {value_part}")
+                elif value_part.startswith('more_date(') and value_part.endswith(')'):
+                    try:
+                        target = float(value_part[len('more_date('):-1].strip())
+                        filters[count] = ('more_date', target, key)
+                    except ValueError:
+                        print(f" [!] Invalid 'more_date' value: {value_part}")
+                elif value_part.startswith('in(') and value_part.endswith(')'):
+                    targets_str = value_part[len('in('):-1].strip()
+                    targets = [t.strip() for t in targets_str.split(',')]
+                    filters[count] = ('in', targets, key)
+                elif value_part.startswith('count(') and value_part.endswith(')'):
+                    target = float(value_part[len('count('):-1].strip())
+                    filters[count] = ('count', target, key)
+                else:
+                    filters[count] = ('equal', value_part, key) # Default to equal if no function
+            else:
+                print(f" [!] Invalid filter format: {condition}")
+    return filters
+
+
+def _condition_key(condition):
+    op, target, key = condition
+    return (op, tuple(target) if isinstance(target, list) else target, key)
+
+# En el camino fila a fila se mide una de cada STATS_SAMPLE_ROWS filas, para
+# que las estadisticas no cuesten mas que los filtros
+STATS_SAMPLE_ROWS = 8
+
+
+class Condition:
+    """
+    Una condicion compilada (predicado por valor y mascara por columna) con lo
+    que se midio de ella en tiempo de ejecucion: cuantos valores evaluo,
+    cuantos pasaron y cuanto tardo.
+    """
+    def __init__(self, condition):
+        self.condition = condition
+        self.key = _condition_key(condition)
+        self.column = condition[2]
+        self.predicate = compile_condition(condition)
+        self.mask = compile_mask(condition)
+        self.evaluated = 0
+        self.passed = 0
+        self.seconds = 0.0
+
+    def record(self, evaluated, passed, seconds):
+        self.evaluated += evaluated
+        self.passed += passed
+        self.seconds += seconds
+
+    def pass_rate(self):
+        return self.passed / self.evaluated if self.evaluated else 1.0
+
+    def cost(self):
+        """Segundos por valor evaluado."""
+        return self.seconds / self.evaluated if self.evaluated else 0.0
+
+    def rank(self):
+        # Para una conjuncion de condiciones independientes, evaluarlas de menor
+        # a mayor costo / (1 - tasa de paso) minimiza el costo esperado por fila.
+        # Las que todavia no se midieron van primero, para medirlas.
+        if not self.evaluated:
+            return 0.0
+        return self.cost() / max(1.0 - self.pass_rate(), 1e-6)
+
+    def describe(self):
+        op, target, column = self.condition
+        return f"{column}:{op}({target}) pass={self.pass_rate():.1%} cost={self.cost() * 1e6:.2f}us n={self.evaluated}"
+
+
+class FilterSet:
+    """
+    Un conjunto de filtros con nombre (lo que antes era un servicio filter):
+    sus condiciones compiladas, las columnas que conserva y el middleware por
+    el que publica lo que pasa. Varios conjuntos pueden evaluarse sobre la misma
+    fila decodificada; las condiciones repetidas entre conjuntos se evaluan una
+    sola vez por fila o por batch (ver `results`).
+
+    Las condiciones se reordenan cada reorder_interval filas segun su costo y
+    su tasa de paso medidos, para descartar cada fila lo antes posible.
+    """
+    def __init__(self, name, filters, keep_columns, output_rabbitmq, reorder_interval=1000):
+        self.name = name
+        self.filters = filters
+        self.keep_columns = keep_columns
+        self.output_rabbitmq = output_rabbitmq
+        self.conditions = [Condition(condition) for condition in filters.values()]
+        self.reorder_interval = reorder_interval
+        self.rows = 0
+        self.rows_since_reorder = 0
+
+    def passes(self, movie, results):
+        """Si la pelicula pasa todos los filtros. results cachea cada condicion ya evaluada para esta fila."""
+        self._count_rows(1)
+        sampled = self.rows % STATS_SAMPLE_ROWS == 0
+        for condition in self.conditions:
+            passed = results.get(condition.key)
+            if passed is None:
+                if sampled:
+                    start = time.perf_counter()
+                    passed = condition.predicate(movie.get(condition.column))
+                    condition.record(1, passed, time.perf_counter() - start)
+                else:
+                    passed = condition.predicate(movie.get(condition.column))
+                results[condition.key] = passed
+            if not passed:
+                return False
+        return True
+
+    def mask(self, movies, columns, results):
+        """
+        Un bool por pelicula del batch. Cada condicion se evalua con su mascara
+        solo sobre las filas que pasaron las anteriores, asi que el orden de las
+        condiciones ahorra trabajo tambien en los batches. columns cachea las
+        columnas enteras ya extraidas y results, por condicion, (evaluadas,
+        valores): que filas ya se evaluaron para este batch y su resultado.
+        """
+        self._count_rows(len(movies))
+        passed = np.ones(len(movies), dtype=bool)
+        for condition in self.conditions:
+            rows = np.flatnonzero(passed)
+            if not len(rows):
+                break
+            cached = results.get(condition.key)
+            if cached is None:
+                cached = results[condition.key] = (np.zeros(len(movies), dtype=bool), np.zeros(len(movies), dtype=bool))
+            evaluated, values = cached
+            pending = rows[~evaluated[rows]]
+            if len(pending):
+                start = time.perf_counter()
+                if len(pending) == len(movies):
+                    if condition.column not in columns:
+                        columns[condition.column] = [movie.get(condition.column) for movie in movies]
+                    column = columns[condition.column]
+                else:
+                    column = [movies[row].get(condition.column) for row in pending]
+                condition_mask = condition.mask(column)
+                values[pending] = condition_mask
+                evaluated[pending] = True
+                condition.record(len(pending), int(condition_mask.sum()), time.perf_counter() - start)
+            passed[rows] = values[rows]
+        return passed
+
+    def _count_rows(self, rows):
+        self.rows += rows
+        self.rows_since_reorder += rows
+        if self.reorder_interval and self.rows_since_reorder >= self.reorder_interval:
+            self.rows_since_reorder = 0
+            self.reorder()
+
+    def reorder(self):
+        """Ordena las condiciones por costo esperado y reporta sus estadisticas."""
+        order = sorted(self.conditions, key=Condition.rank)
+        if order != self.conditions:
+            print(f" [~] Reordering filters for {self.name}: {[condition.key for condition in order]}")
+            self.conditions = order
+        self.report()
+
+    def report(self):
+        for condition in self.conditions:
+            print(f" [~] Filter stats {self.name} ({self.rows} rows): {condition.describe()}")
@@ -20,7 +20,19 @@ class ClientConnection:
         self.input_queue = os.getenv("RABBITMQ_INPUT_QUEUE", "query_queue")
         self.consumer_tag = os.getenv("RABBITMQ_CONSUMER_TAG", "default_consumer")
         self.output_exchange = os.getenv("RABBITMQ_OUTPUT_EXCHANGE")
+        # Los middlewares se crean en el proceso del cliente (ver _connect): en
+        # el proceso del gateway la conexion quedaria sin atender entre accepts
+        self.rabbitmq = None
+        self.rabbitmq_receiver = None
         
+        self.process = multiprocessing.Process(
+                    target=self.handle_client,
+                    args=(addr, client_id)
+        )
+        self.process.start()
+
+    def _connect(self):
+        """Crea los middlewares del cliente, con una conexion propia de este proceso."""
         if self.output_exchange:
             self.rabbitmq = Middleware(queue=None, exchange=self.output_exchange)
         else:
@@ -33,12 +45,6 @@ class ClientConnection:
                 publish_to_exchange=False,
                 routing_key=str(self.client_id)
         )
-        
-        self.process = multiprocessing.Process(
-                    target=self.handle_client,
-                    args=(addr, client_id)
-        )
-        self.process.start()
 
     def handle_client(self, addr, client_id):
         """Maneja un cliente en un proceso separado."""
@@ -46,6 +52,7 @@ class ClientConnection:
         client_running = True
 
         try:
+            self._connect()
             while client_running:
                 if self.running == False:
                     break
@@ -77,7 +84,8 @@ class ClientConnection:
             print(f"[Client {client_id}] Error: {e}")
         finally:
             print(f"[Client {client_id}] Cerrando recursos del cliente")
-            self.rabbitmq_receiver.delete_queue()
+            if self.rabbitmq_receiver:
+                self.rabbitmq_receiver.delete_queue()
             self.close()
 
     def publish_file_batch(self, batch: dict, msg_filename):
@@ -124,13 +132,16 @@ class ClientConnection:
         """Maneja la señal SIGTERM para cerrar el servidor."""
         print(f"[Client {self.client_id}] Recibida señal SIGTERM")
         self.running = False
-        self.rabbitmq_receiver.cancel_consumer()
+        if self.rabbitmq_receiver:
+            self.rabbitmq_receiver.cancel_consumer()
 
     def close(self):
         """Cierra el servidor y todos los procesos."""
         try:
-            self.rabbitmq.close()
-            self.rabbitmq_receiver.close()
+            if self.rabbitmq:
+                self.rabbitmq.close()
+            if self.rabbitmq_receiver:
+                self.rabbitmq_receiver.close()
             self.client.close()
         except Exception as e:
             print(f"[Client {self.client_id}] Closing Error: {e}")
@@ -25,6 +25,7 @@ def initialize_config(config_file="config.ini"):
         "FILTER_2000s_SPAIN",
         "FILTER_UNIQUE_COUNTRY",
         "FILTER_BUDGET_REVENUE",
+        "FILTER_MOVIES",
         "ROUTER_RATINGS",
         "ROUTER_2000_ARGENTINA",
         "ROUTER_ACTORS",
@@ -48,6 +49,41 @@ def initialize_config(config_file="config.ini"):
     for file, path in config["FILES"].items():
         config_params[file] = path
 
+    # Variables del middleware que se le pasan a todos los nodos (prefetch, acks, etc.)
+    config_params["middleware"] = {}
+    if config.has_section("MIDDLEWARE"):
+        for key, value in config["MIDDLEWARE"].items():
+            config_params["middleware"][key.upper()] = value
+
+    # Exchanges/colas que van por memoria compartida en vez de por RabbitMQ
+    config_params["shm_links"] = ""
+    if config.has_section("SHM"):
+        config_params["shm_links"] = config["SHM"].get("LINKS", "").replace(" ", "")
+
+    # Codec para comprimir las aristas con columnas de texto grandes (cast, overview)
+    config_params["compression"] = None
+    if config.has_section("COMPRESSION"):
+        config_params["compression"] = config["COMPRESSION"].get("CODEC", "")
+
+    # Como se reparten las claves entre los nodos detras de cada router
+    config_params["partitioner"] = None
+    if config.has_section("PARTITIONING"):
+        config_params["partitioner"] = config["PARTITIONING"].get("PARTITIONER", "modulo")
+        config_params["virtual_nodes"] = config["PARTITIONING"].get("VIRTUAL_NODES", "")
+        config_params["hot_key_split"] = int(config["PARTITIONING"].get("HOT_KEY_SPLIT", 1))
+        config_params["hot_key_share"] = config["PARTITIONING"].get("HOT_KEY_SHARE", "0.01")
+
+    # Modo, presupuesto de memoria y particiones de los joins (variables de los dos joins)
+    config_params["join"] = {}
+    config_params["fused_average_ratings"] = False
+    if config.has_section("JOIN"):
+        for key, value in config["JOIN"].items():
+            if key.upper() == "FUSED_AVERAGE_RATINGS":
+                # No es una variable de los joins: cambia la topologia de la query 3
+                config_params["fused_average_ratings"] = config["JOIN"].getboolean(key)
+                continue
+            config_params["join"][key.upper()] = value
+
     return config_params
 
 
@@ -1,5 +1,8 @@
+from common.partitioner import PARTITIONERS
+
 CLIENTS = 'clients'
 FINAL = 'final'
+KEY_SET = 'key_set'
 QUERY_1 = 'query_1'
 QUERY_2 = 'query_2'
 QUERY_3 = 'query_3'
@@ -18,6 +21,7 @@ FILTER_2000_ARGENTINA = 'filter_2000_argentina'
 FILTER_2000S_SPAIN = 'filter_2000s_spain'
 FILTER_UNIQUE_COUNTRY = 'filter_unique_country'
 FILTER_BUDGET_REVENUE = 'filter_budget_revenue'
+FILTER_MOVIES = 'filter_movies'
 ROUTER_RATINGS = 'router_ratings'
 ROUTER_2000_ARGENTINA = "router_2000_argentina"
 ROUTER_ACTORS = "router_actors"
@@ -37,6 +41,16 @@ SENTIMENT_NEGATIVE = 'sentiment_negative_queue'
 AGGREGATOR_CALCULATOR_RATIO_FEELINGS = 'aggregator_calculator_ratio_feelings'
 AGGREGATOR_CALCULATOR_BUDGET_COUNTRY = 'aggregator_calculator_budget_country' 
 AGGREGATOR_CALCULATOR_COUNT_ACTORS = 'aggregator_calculator_count_actors' 
+AGGREGATOR_CALCULATOR_AVERAGE_RATINGS = 'aggregator_calculator_average_ratings'
+
+FILTERS_2000_ARGENTINA = 'production_countries:in(Argentina);release_date:more_date(1999)'
+KEEP_2000_ARGENTINA = 'production_countries,release_date,title,genres,id'
+FILTERS_2000S_SPAIN = 'production_countries:in(Spain);release_date:less_date(2010)'
+KEEP_2000S_SPAIN = 'title,genres,id'
+FILTERS_UNIQUE_COUNTRY = 'production_countries:count(1)'
+KEEP_UNIQUE_COUNTRY = 'production_countries,budget,id'
+FILTERS_BUDGET_REVENUE = 'budget:more(0);revenue:more(0)'
+KEEP_BUDGET_REVENUE = 'overview,budget,revenue'
 
 class ConfigGenerator:
     def __init__(self, config_params):
@@ -65,6 +79,40 @@ class ConfigGenerator:
         self._generate_clients()
         return self.compose
     
+    def _compression(self, link):
+        """Variables para que el servicio publique comprimido a `link`, si se configuro un codec."""
+        codec = self.config_params.get('compression')
+        if codec is None:
+            return []
+        return [f'COMPRESSION={link}:{codec}']
+
+    def _partitioner(self):
+        """Variables del particionador de los routers; tiene que ser el mismo en todos."""
+        partitioner = self.config_params.get('partitioner')
+        if partitioner is None:
+            return []
+        if partitioner not in PARTITIONERS:
+            raise ValueError(f"Unknown partitioner '{partitioner}', expected one of {sorted(PARTITIONERS)}")
+        environment = [f'PARTITIONER={partitioner}']
+        if self.config_params.get('virtual_nodes'):
+            environment.append(f"VIRTUAL_NODES={self.config_params['virtual_nodes']}")
+        return environment
+
+    def _hot_keys(self):
+        """Variables para repartir las claves calientes; solo para routers cuyos parciales junta un aggregator."""
+        hot_key_split = self.config_params.get('hot_key_split')
+        if not hot_key_split or hot_key_split <= 1:
+            return []
+        return [f'HOT_KEY_SPLIT={hot_key_split}', f"HOT_KEY_SHARE={self.config_params['hot_key_share']}"]
+
+    def _broadcast_join(self):
+        """True si los joins replican el lado main en cada nodo en vez de particionar por id."""
+        return self.config_params.get('join', {}).get('JOIN_MODE', 'partitioned') == 'broadcast'
+
+    def _fused_average_ratings(self):
+        """True si join_ratings calcula los promedios de la query 3 (sin router ni calculators)."""
+        return bool(self.config_params.get('fused_average_ratings'))
+
     def _generate_rabbitmq(self):
         """Generate RabbitMQ service."""
         config = {
@@ -144,6 +192,7 @@ class ConfigGenerator:
             f'RABBITMQ_EXCHANGE={GATEWAY}', 
             f'RABBITMQ_OUTPUT_EXCHANGE={PARSER}',
             'KEEP_COLUMNS=budget,genres,id,original_language,overview,production_countries,release_date,revenue,title',
+            'TYPED_COLUMNS=genres:names,production_countries:names,release_date:year,budget:int,revenue:int',
             f'FILENAME={MOVIES_FILE}'
             ],
             networks=['app-network'],
@@ -181,8 +230,9 @@ class ConfigGenerator:
             f'RABBITMQ_EXCHANGE={GATEWAY}', 
             f'RABBITMQ_OUTPUT_EXCHANGE={PARSER}',
             'KEEP_COLUMNS=cast,id',
+            'TYPED_COLUMNS=cast:names',
             f'FILENAME={CREDITS_FILE}'
-            ],
+            ] + self._compression(PARSER),
             networks=['app-network'],
             depends_on={
                 'rabbitmq': {'condition': 'service_healthy'}
@@ -225,6 +275,11 @@ class ConfigGenerator:
             current_environment.extend(environment)
             current_environment.append(f'NODE_ID={node_id}')
             current_environment.append(f'CLUSTER_SIZE={cluster_size if cluster_size is not None else instances}')
+            if service_name != 'client':
+                for key, value in self.config_params.get('middleware', {}).items():
+                    current_environment.append(f'{key}={value}')
+                if self.config_params.get('shm_links'):
+                    current_environment.append(f"SHM_LINKS={self.config_params['shm_links']}")
 
             
 
@@ -249,6 +304,10 @@ class ConfigGenerator:
             if current_environment:
                 config['environment'] = current_environment
 
+            # Los anillos de memoria compartida viven en /dev/shm del host
+            if service_name != 'client' and self.config_params.get('shm_links'):
+                config['ipc'] = 'host'
+
             # Add volume in case the service is the client
             if service_name == 'client':
                 config['volumes'] = ['./output:/app/output']
@@ -285,7 +344,7 @@ class ConfigGenerator:
         self.generate_service(
             service_name=service_name,
             dockerfile='router/Dockerfile',
-            environment=environment,
+            environment=environment + self._partitioner(),
             networks=['app-network'],
             depends_on={
                 'rabbitmq': {'condition': 'service_healthy'}
@@ -294,7 +353,8 @@ class ConfigGenerator:
         )
         
     def _generate_join(self, service_name, environment, instances):
-        
+        # Presupuesto de memoria y particiones del grace hash join, iguales para todos los joins
+        environment = environment + [f'{key}={value}' for key, value in self.config_params.get('join', {}).items()]
         self.generate_service(
             service_name=service_name,
             dockerfile='join/Dockerfile',
@@ -335,6 +395,10 @@ class ConfigGenerator:
         )
         
     def _generate_filters(self):
+        if self.config_params.get(FILTER_MOVIES):
+            self._generate_shared_filter()
+            return
+
         instances = self.config_params[FILTER_2000_ARGENTINA]
         self._generate_filter(
             service_name=FILTER_2000_ARGENTINA,
@@ -345,8 +409,8 @@ class ConfigGenerator:
                 f'RABBITMQ_EXCHANGE={PARSER}',
                 f'RABBITMQ_ROUTING_KEY={MOVIES_FILE}',
                 f'RABBITMQ_OUTPUT_EXCHANGE={FILTER_2000_ARGENTINA}',
-                f'KEEP_COLUMNS=production_countries,release_date,title,genres,id',
-                'FILTERS=production_countries:in(Argentina);release_date:more_date(1999)'
+                f'KEEP_COLUMNS={KEEP_2000_ARGENTINA}',
+                f'FILTERS={FILTERS_2000_ARGENTINA}'
             ],
             instances=instances
             )
@@ -359,8 +423,8 @@ class ConfigGenerator:
                 f'RABBITMQ_CONSUMER_TAG={FILTER_2000S_SPAIN}',
                 f'RABBITMQ_OUTPUT_QUEUE={FILTER_2000S_SPAIN}',
                 f'RABBITMQ_EXCHANGE={FILTER_2000_ARGENTINA}',
-                f'KEEP_COLUMNS=title,genres,id',
-                'FILTERS=production_countries:in(Spain);release_date:less_date(2010)'
+                f'KEEP_COLUMNS={KEEP_2000S_SPAIN}',
+                f'FILTERS={FILTERS_2000S_SPAIN}'
             ],
             instances=instances
             )
@@ -374,8 +438,8 @@ class ConfigGenerator:
                 f'RABBITMQ_OUTPUT_QUEUE={FILTER_UNIQUE_COUNTRY}',
                 f'RABBITMQ_EXCHANGE={PARSER}',
                 f'RABBITMQ_ROUTING_KEY={MOVIES_FILE}',
-                f'KEEP_COLUMNS=production_countries,budget,id',
-                'FILTERS=production_countries:count(1)'
+                f'KEEP_COLUMNS={KEEP_UNIQUE_COUNTRY}',
+                f'FILTERS={FILTERS_UNIQUE_COUNTRY}'
             ],
             instances=instances
             )
@@ -389,11 +453,45 @@ class ConfigGenerator:
                 f'RABBITMQ_OUTPUT_QUEUE={FILTER_BUDGET_REVENUE}',
                 f'RABBITMQ_EXCHANGE={PARSER}',
                 f'RABBITMQ_ROUTING_KEY={MOVIES_FILE}',
-                f'KEEP_COLUMNS=overview,budget,revenue',
-                'FILTERS=budget:more(0);revenue:more(0)'
-            ],
+                f'KEEP_COLUMNS={KEEP_BUDGET_REVENUE}',
+                f'FILTERS={FILTERS_BUDGET_REVENUE}'
+            ] + self._compression(FILTER_BUDGET_REVENUE),
             instances=instances
             )
+
+    def _generate_shared_filter(self):
+        """
+        Generate a single filter service that reads the parser's movies stream
+        once and evaluates the four filters over each row (shared scan), each
+        one publishing to the same output as its standalone service.
+        filter_2000s_spain reads filter_2000_argentina's output, so its set
+        includes the Argentina conditions.
+        """
+        filter_sets = [
+            (FILTER_2000_ARGENTINA, FILTERS_2000_ARGENTINA, KEEP_2000_ARGENTINA, f'OUTPUT_EXCHANGE={FILTER_2000_ARGENTINA}'),
+            (FILTER_2000S_SPAIN, f'{FILTERS_2000_ARGENTINA};{FILTERS_2000S_SPAIN}', KEEP_2000S_SPAIN, f'OUTPUT_QUEUE={FILTER_2000S_SPAIN}'),
+            (FILTER_UNIQUE_COUNTRY, FILTERS_UNIQUE_COUNTRY, KEEP_UNIQUE_COUNTRY, f'OUTPUT_QUEUE={FILTER_UNIQUE_COUNTRY}'),
+            (FILTER_BUDGET_REVENUE, FILTERS_BUDGET_REVENUE, KEEP_BUDGET_REVENUE, f'OUTPUT_QUEUE={FILTER_BUDGET_REVENUE}'),
+        ]
+        environment = [
+            f'RABBITMQ_QUEUE={PARSER}{FILTER_MOVIES}',
+            f'RABBITMQ_CONSUMER_TAG={FILTER_MOVIES}',
+            f'RABBITMQ_EXCHANGE={PARSER}',
+            f'RABBITMQ_ROUTING_KEY={MOVIES_FILE}',
+            f'FILTER_SETS={",".join(name for name, _, _, _ in filter_sets)}'
+        ]
+        for name, filters, keep_columns, output in filter_sets:
+            prefix = name.upper()
+            environment += [
+                f'{prefix}_FILTERS={filters}',
+                f'{prefix}_KEEP_COLUMNS={keep_columns}',
+                f'{prefix}_{output}'
+            ]
+        self._generate_filter(
+            service_name=FILTER_MOVIES,
+            environment=environment + self._compression(FILTER_BUDGET_REVENUE),
+            instances=self.config_params[FILTER_MOVIES]
+            )
       
  
     def _generate_routers(self):
@@ -410,6 +508,40 @@ class ConfigGenerator:
             instances=instances
             )
         
+        # En broadcast los joins leen directo del filtro y del parser
+        if not self._broadcast_join():
+            self._generate_join_routers()
+
+        # Con el join de ratings fusionado con el promedio no hace falta repartir por id
+        if not self._fused_average_ratings():
+            instances = self.config_params[ROUTER_RATINGS_CALCULATED]
+            self._generate_router(
+                service_name=ROUTER_RATINGS_CALCULATED,
+                environment=[
+                    f'RABBITMQ_QUEUE={JOIN_RATINGS}',
+                    f'RABBITMQ_CONSUMER_TAG={ROUTER_RATINGS_CALCULATED}',
+                    f'RABBITMQ_OUTPUT_EXCHANGE={ROUTER_RATINGS_CALCULATED}',
+                    f'ROUTER_BY=id',
+                    f'NUMBER_OF_NODES={self.config_params[CALCULATOR_AVERAGE_RATINGS]}'
+                ] + self._hot_keys(),
+                instances=instances
+                )
+        
+        instances = self.config_params[ROUTER_ACTORS_2000_ARGENTINA]
+        self._generate_router(
+            service_name=ROUTER_ACTORS_2000_ARGENTINA,
+            environment=[
+                f'RABBITMQ_QUEUE={JOIN_ACTORS}',
+                f'RABBITMQ_CONSUMER_TAG={ROUTER_ACTORS_2000_ARGENTINA}',
+                f'RABBITMQ_OUTPUT_EXCHANGE={ROUTER_ACTORS_2000_ARGENTINA}',
+                f'ROUTER_BY=id',
+                f'NUMBER_OF_NODES={self.config_params[CALCULATOR_COUNT_ACTORS]}'
+            ],
+            instances=instances
+            )
+
+    def _generate_join_routers(self):
+        """Routers que particionan por id los dos lados de join_actors y join_ratings."""
         instances = self.config_params[ROUTER_2000_ARGENTINA]
         self._generate_router(
             service_name=ROUTER_2000_ARGENTINA,
@@ -433,9 +565,10 @@ class ConfigGenerator:
                 f'RABBITMQ_OUTPUT_EXCHANGE={ROUTER_ACTORS}',
                 f'RABBITMQ_EXCHANGE={PARSER}',
                 f'RABBITMQ_ROUTING_KEY={CREDITS_FILE}',
+                f'KEY_SET_EXCHANGE={JOIN_ACTORS}{KEY_SET}',
                 f'ROUTER_BY=id',
                 f'NUMBER_OF_NODES={self.config_params[JOIN_MOVIES]}'
-            ],
+            ] + self._compression(ROUTER_ACTORS),
             instances=instances
             )
         
@@ -448,40 +581,13 @@ class ConfigGenerator:
                 f'RABBITMQ_OUTPUT_EXCHANGE={ROUTER_RATINGS}',
                 f'RABBITMQ_EXCHANGE={PARSER}',
                 f'RABBITMQ_ROUTING_KEY={RATINGS_FILE}',
+                f'KEY_SET_EXCHANGE={JOIN_RATINGS}{KEY_SET}',
                 f'ROUTER_BY=id',
                 f'NUMBER_OF_NODES={self.config_params[JOIN_MOVIES]}'
             ],
             instances=instances
             )
         
-        instances = self.config_params[ROUTER_RATINGS_CALCULATED]
-        self._generate_router(
-            service_name=ROUTER_RATINGS_CALCULATED,
-            environment=[
-                f'RABBITMQ_QUEUE={JOIN_RATINGS}',
-                f'RABBITMQ_CONSUMER_TAG={ROUTER_RATINGS_CALCULATED}',
-                f'RABBITMQ_OUTPUT_EXCHANGE={ROUTER_RATINGS_CALCULATED}',
-                f'ROUTER_BY=id',
-                f'NUMBER_OF_NODES={self.config_params[CALCULATOR_AVERAGE_RATINGS]}'
-            ],
-            instances=instances
-            )
-        
-        instances = self.config_params[ROUTER_ACTORS_2000_ARGENTINA]
-        self._generate_router(
-            service_name=ROUTER_ACTORS_2000_ARGENTINA,
-            environment=[
-                f'RABBITMQ_QUEUE={JOIN_ACTORS}',
-                f'RABBITMQ_CONSUMER_TAG={ROUTER_ACTORS_2000_ARGENTINA}',
-                f'RABBITMQ_OUTPUT_EXCHANGE={ROUTER_ACTORS_2000_ARGENTINA}',
-                f'ROUTER_BY=id',
-                f'NUMBER_OF_NODES={self.config_params[CALCULATOR_COUNT_ACTORS]}'
-            ],
-            instances=instances
-            )
-        
-       
-        
     def _generate_calculators(self):
         instances = self.config_params[CALCULATOR_BUDGET_COUNTRY]
         self._generate_calculator(
@@ -497,19 +603,20 @@ class ConfigGenerator:
             instances=instances
             )
         
-        instances = self.config_params[CALCULATOR_AVERAGE_RATINGS]
-        self._generate_calculator(
-            service_name=CALCULATOR_AVERAGE_RATINGS,
-            environment=[
-                F'RABBITMQ_QUEUE={ROUTER_RATINGS_CALCULATED}{CALCULATOR_AVERAGE_RATINGS}',
-                f'RABBITMQ_CONSUMER_TAG={CALCULATOR_AVERAGE_RATINGS}',
-                f'RABBITMQ_EXCHANGE={ROUTER_RATINGS_CALCULATED}',
-                f'RABBITMQ_OUTPUT_QUEUE={CALCULATOR_AVERAGE_RATINGS}',
-                f'RABBITMQ_FINAL_QUEUE={CALCULATOR_AVERAGE_RATINGS}{FINAL}',
-                f'OPERATION=average_by:id,rating'
-            ],
-            instances=instances
-            )
+        if not self._fused_average_ratings():
+            instances = self.config_params[CALCULATOR_AVERAGE_RATINGS]
+            self._generate_calculator(
+                service_name=CALCULATOR_AVERAGE_RATINGS,
+                environment=[
+                    F'RABBITMQ_QUEUE={ROUTER_RATINGS_CALCULATED}{CALCULATOR_AVERAGE_RATINGS}',
+                    f'RABBITMQ_CONSUMER_TAG={CALCULATOR_AVERAGE_RATINGS}',
+                    f'RABBITMQ_EXCHANGE={ROUTER_RATINGS_CALCULATED}',
+                    f'RABBITMQ_OUTPUT_QUEUE={CALCULATOR_AVERAGE_RATINGS}',
+                    f'RABBITMQ_FINAL_QUEUE={CALCULATOR_AVERAGE_RATINGS}{FINAL}',
+                    f'OPERATION=average_by:id,rating'
+                ],
+                instances=instances
+                )
         
         instances = self.config_params[CALCULATOR_COUNT_ACTORS]
         self._generate_calculator(
@@ -557,35 +664,58 @@ class ConfigGenerator:
         instances = self.config_params[JOIN_MOVIES]
         self._generate_join(
             service_name=JOIN_ACTORS,
-            environment=[
-                F'RABBITMQ_QUEUE_1={ROUTER_2000_ARGENTINA}{JOIN_ACTORS}',
-                f'RABBITMQ_EXCHANGE_1={ROUTER_2000_ARGENTINA}',
-                F'RABBITMQ_QUEUE_2={ROUTER_ACTORS}{JOIN_ACTORS}',
-                f'RABBITMQ_EXCHANGE_2={ROUTER_ACTORS}',
+            environment=self._join_inputs(JOIN_ACTORS, ROUTER_ACTORS, CREDITS_FILE) + [
                 f'RABBITMQ_CONSUMER_TAG={JOIN_ACTORS}',
                 f'RABBITMQ_OUTPUT_QUEUE={JOIN_ACTORS}',
                 f'KEEP_COLUMNS=title,id,cast',
                 f'JOIN_BY=id',
                 f'RABBITMQ_FINAL_QUEUE={JOIN_ACTORS}{FINAL}'
-            ],
+            ] + self._compression(JOIN_ACTORS),
             instances=instances
             )
         
+        # Fusionado: join_ratings publica los promedios parciales por id directo
+        # al aggregator, en la cola en la que los publicarian los calculators
+        if self._fused_average_ratings():
+            ratings_output = [
+                f'RABBITMQ_OUTPUT_QUEUE={CALCULATOR_AVERAGE_RATINGS}',
+                f'JOIN_AGGREGATE=average:rating'
+            ]
+        else:
+            ratings_output = [f'RABBITMQ_OUTPUT_QUEUE={JOIN_RATINGS}']
         self._generate_join(
             service_name=JOIN_RATINGS,
-            environment=[
-                F'RABBITMQ_QUEUE_1={ROUTER_2000_ARGENTINA}{JOIN_RATINGS}',
-                f'RABBITMQ_EXCHANGE_1={ROUTER_2000_ARGENTINA}',
-                F'RABBITMQ_QUEUE_2={ROUTER_RATINGS}{JOIN_RATINGS}',
-                f'RABBITMQ_EXCHANGE_2={ROUTER_RATINGS}',
+            environment=self._join_inputs(JOIN_RATINGS, ROUTER_RATINGS, RATINGS_FILE) + [
                 f'RABBITMQ_CONSUMER_TAG={JOIN_RATINGS}',
-                f'RABBITMQ_OUTPUT_QUEUE={JOIN_RATINGS}',
                 f'KEEP_COLUMNS=title,id,rating',
                 f'JOIN_BY=id',
                 f'RABBITMQ_FINAL_QUEUE={JOIN_RATINGS}{FINAL}'
-            ],
+            ] + ratings_output,
             instances=instances
             )
+
+    def _join_inputs(self, join, router, file):
+        """
+        Colas de entrada de un join. Particionado: los dos lados vienen de sus
+        routers. Broadcast: cada nodo bindea su cola al exchange del filtro
+        (recibe todas las peliculas) y el lado join es una unica cola
+        compartida bindeada al parser.
+        """
+        if self._broadcast_join():
+            return [
+                F'RABBITMQ_QUEUE_1={FILTER_2000_ARGENTINA}{join}',
+                f'RABBITMQ_EXCHANGE_1={FILTER_2000_ARGENTINA}',
+                F'RABBITMQ_QUEUE_2={PARSER}{join}',
+                f'RABBITMQ_EXCHANGE_2={PARSER}',
+                f'RABBITMQ_ROUTING_KEY_2={file}'
+            ]
+        return [
+            F'RABBITMQ_QUEUE_1={ROUTER_2000_ARGENTINA}{join}',
+            f'RABBITMQ_EXCHANGE_1={ROUTER_2000_ARGENTINA}',
+            F'RABBITMQ_QUEUE_2={router}{join}',
+            f'RABBITMQ_EXCHANGE_2={router}',
+            f'KEY_SET_EXCHANGE={join}{KEY_SET}'
+        ]
             
         
     def _generate_deliver_1(self):
@@ -639,11 +769,23 @@ class ConfigGenerator:
         )
     
     def _generate_deliver_3(self):
+        # Junta los promedios parciales de los ids que el router repartio entre calculators
+        self._generate_aggregator(
+            service_name=AGGREGATOR_CALCULATOR_AVERAGE_RATINGS,
+            environment=[
+                F'RABBITMQ_QUEUE={CALCULATOR_AVERAGE_RATINGS}',
+                f'RABBITMQ_CONSUMER_TAG={AGGREGATOR_CALCULATOR_AVERAGE_RATINGS}',
+                f'RABBITMQ_OUTPUT_QUEUE={AGGREGATOR_CALCULATOR_AVERAGE_RATINGS}',
+                'operation=average_by'
+            ],
+            instances=1
+            )
+
         self.generate_service(
             service_name=QUERY_3,
             dockerfile='deliver/Dockerfile',
             environment=[
-                F'RABBITMQ_QUEUE={CALCULATOR_AVERAGE_RATINGS}',
+                F'RABBITMQ_QUEUE={AGGREGATOR_CALCULATOR_AVERAGE_RATINGS}',
                 f'RABBITMQ_CONSUMER_TAG={QUERY_3}',
                 f'RABBITMQ_OUTPUT_EXCHANGE={DELIVER}',
                 f'RABBITMQ_FINAL_QUEUE={DELIVER}{FINAL}',
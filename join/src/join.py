@@ -2,11 +2,15 @@ import json
 import os
 import signal
 import threading
+import queue
 from datetime import datetime
 from common.middleware import Middleware
 from common.storage_handler import StorageHandler
+from common.partition_runs import PartitionRuns
 from common.leader_queue import LeaderQueue
-from common.packet import DataPacket, is_final_packet
+from common.key_set import key_set_message
+from common.partitioner import stable_hash
+from common.packet import DataPacket, PacketEnvelope, is_final_packet
 
 class JoinNode:
     def __init__(self):
@@ -16,10 +20,26 @@ class JoinNode:
         self.eof_main_by_client = {}  # EOF main por cliente
         self.storages_by_client = {}  # StorageHandler por cliente
         self.lock = threading.Lock()
+        # Al terminar el lado main de un cliente, un unico drain joinea lo que quedo en disco
+        self.drain_queue = queue.Queue()
+        self.drain_thread = None
+        # Cada cuanto el drain atiende los heartbeats de su conexion mientras espera
+        self.drain_idle_interval = float(os.getenv("JOIN_DRAIN_IDLE_INTERVAL", "1"))
+        self.drained_by_client = {}  # True cuando el drain del cliente termino
+        self.final_pending = set()  # Clientes cuyo FIN del lado join espera al drain
         self.node_id = os.getenv("NODE_ID", "")
         self.cluster_size = int(os.getenv("CLUSTER_SIZE", ""))
+        # JOIN_MODE=partitioned: los dos lados llegan particionados por id desde routers.
+        # JOIN_MODE=broadcast: cada nodo recibe todo el lado main (chico) y el lado
+        # join sale de una cola compartida por todos los nodos, sin router
+        self.join_mode = os.getenv("JOIN_MODE", "partitioned")
+        if self.join_mode not in ("partitioned", "broadcast"):
+            raise ValueError(f"Unknown JOIN_MODE '{self.join_mode}', expected 'partitioned' or 'broadcast'")
+        self.broadcast = self.join_mode == "broadcast"
         self.input_queue_1 = f"{os.getenv('RABBITMQ_QUEUE_1', 'movie_queue_1')}_{self.node_id}"
-        self.input_queue_2 = f"{os.getenv('RABBITMQ_QUEUE_2', 'movie_queue_2')}_{self.node_id}"
+        self.input_queue_2 = os.getenv('RABBITMQ_QUEUE_2', 'movie_queue_2')
+        if not self.broadcast:
+            self.input_queue_2 = f"{self.input_queue_2}_{self.node_id}"
         self.exchange_1 = os.getenv("RABBITMQ_EXCHANGE_1", "")
         self.exchange_2 = os.getenv("RABBITMQ_EXCHANGE_2", "")
         self.consumer_tag = f"{os.getenv('RABBITMQ_CONSUMER_TAG', 'default_consumer')}_{self.node_id}"
@@ -27,6 +47,30 @@ class JoinNode:
         self.final_queue = os.getenv("RABBITMQ_FINAL_QUEUE", "default_final")
         self.output_exchange = os.getenv("RABBITMQ_OUTPUT_EXCHANGE", "")
         self.join_by = os.getenv("JOIN_BY", "id")
+        self.storage_dir = os.getenv("STORAGE_DIR", ".")
+        # Exchange por el que se publican las claves del lado main al terminarlo,
+        # para que los routers del otro lado descarten lo que no va a joinear
+        self.key_set_exchange = os.getenv("KEY_SET_EXCHANGE", "")
+        # Grace hash join: cuando el lado main de un cliente ocupa mas de
+        # JOIN_MEMORY_BUDGET_MB (0 = sin limite), los dos lados van a disco en
+        # JOIN_GRACE_PARTITIONS particiones que se joinean de a una al final
+        self.memory_budget = int(float(os.getenv("JOIN_MEMORY_BUDGET_MB", "0")) * 1024 * 1024)
+        self.grace_partitions = int(os.getenv("JOIN_GRACE_PARTITIONS", "16"))
+        self.buffer_bytes_by_client = {}  # Bytes aproximados del router_buffer por cliente
+        self.build_storages_by_client = {}  # Clientes en modo grace: StorageHandler del lado main
+        self.build_keys_by_client = {}  # Clientes en modo grace: claves del lado main ya guardadas
+        self.probe_runs_by_client = {}  # Clientes en modo grace: PartitionRuns del lado join
+        # JOIN_AGGREGATE=average:<columna>: en vez de publicar cada par joineado,
+        # acumula (total, count, title) de la columna por clave y al terminar el
+        # cliente publica una fila por clave, como un calculator average_by
+        self.aggregate_field = None
+        aggregate = os.getenv("JOIN_AGGREGATE", "")
+        if aggregate:
+            operation, _, field = aggregate.partition(":")
+            if operation != "average" or not field:
+                raise ValueError(f"Invalid JOIN_AGGREGATE '{aggregate}', expected 'average:<column>'")
+            self.aggregate_field = field
+        self.aggregates_by_client = {}  # client_id -> {clave -> [total, count, title]}
         
         self.keep_columns = None
         keep_columns = os.getenv("KEEP_COLUMNS", "")
@@ -40,19 +84,25 @@ class JoinNode:
         else:
             self.output_rabbitmq = Middleware(queue=self.output_queue)
 
+        self.key_set_rabbitmq = None
+        if self.key_set_exchange:
+            self.key_set_rabbitmq = Middleware(queue=None, exchange=self.key_set_exchange)
+
+        # En broadcast las colas se bindean con las routing keys del productor
+        # (filtro y parser) en vez de con el id del nodo
         self.input_rabbitmq_1 = Middleware(
             queue=self.input_queue_1,
             consumer_tag=self.consumer_tag,
             exchange=self.exchange_1,
             publish_to_exchange=False,
-            routing_key=self.node_id
+            routing_key=os.getenv("RABBITMQ_ROUTING_KEY_1", "") if self.broadcast else self.node_id
         )
         self.input_rabbitmq_2 = Middleware(
             queue=self.input_queue_2,
             consumer_tag=self.consumer_tag,
             exchange=self.exchange_2,
             publish_to_exchange=False,
-            routing_key=self.node_id
+            routing_key=os.getenv("RABBITMQ_ROUTING_KEY_2", "") if self.broadcast else self.node_id
         )
         
         self.final_rabbitmq = Middleware(
@@ -61,6 +111,11 @@ class JoinNode:
             publish_to_exchange=False
         )
         
+        # Lo guardado en disco se ackea recien despues del fsync: con los fsync
+        # agrupados, un mensaje ackeado podria perderse si el nodo se cae
+        self.input_rabbitmq_1.set_before_ack(self._sync_build_side)
+        self.input_rabbitmq_2.set_before_ack(self._sync_probe_side)
+
         self.leader_queue = None
         if int(self.node_id) == 0:
             self.leader_queue = LeaderQueue(self.final_queue, self.output_queue, self.consumer_tag, self.cluster_size)
@@ -72,7 +127,7 @@ class JoinNode:
             if client_id not in self.storages_by_client:
                 if client_id not in self.eof_main_by_client:
                     self.eof_main_by_client[client_id] = False
-                storage_dir = f'./storage_{self.node_id}_{client_id}'
+                storage_dir = os.path.join(self.storage_dir, f'storage_{self.node_id}_{client_id}')
                 self.storages_by_client[client_id] = StorageHandler(data_dir=storage_dir)
                 print(f" [🆕] Creado StorageHandler para cliente '{client_id}' en '{storage_dir}'")
             return self.storages_by_client[client_id]
@@ -83,19 +138,30 @@ class JoinNode:
                 self.input_rabbitmq_1.close_graceful(method)
                 return
             
-            packet_json = body.decode()
-            packet = json.loads(packet_json)
-            header = packet.get("header")
-            client_id = packet.get("client_id")
+            envelope = PacketEnvelope(body)
+            header = envelope.header
+            client_id = envelope.client_id
             
             if is_final_packet(header):
                 print(f" [*] Cola '{self.input_queue_1}' terminó.")
                 with self.lock:
                     self.eof_main_by_client[client_id] = True
+                    grace = client_id in self.build_storages_by_client
+                    if grace:
+                        keys = list(self.build_keys_by_client[client_id])
+                    else:
+                        keys = list(self.router_buffer_by_client.get(client_id, {}))
+                    # En modo grace el join se hace recien con los dos EOF
+                    ready = not grace or client_id in self.final_pending
+                if self.key_set_rabbitmq:
+                    self.key_set_rabbitmq.publish(key_set_message(client_id, self.node_id, keys))
+                    print(f" [~] Publicadas {len(keys)} claves del lado main para cliente '{client_id}'")
+                if ready:
+                    self.drain_queue.put(client_id)
                 ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
 
-            packet = DataPacket.from_json(packet_json)
+            packet = envelope.to_packet()
             movie = packet.data
             router = int(movie.get(self.join_by))
 
@@ -104,14 +170,13 @@ class JoinNode:
                 return
 
             with self.lock:
-                # Inicializar router_buffer para el cliente si no existe
-                if client_id not in self.router_buffer_by_client:
-                    self.router_buffer_by_client[client_id] = {}
-                if router not in self.router_buffer_by_client[client_id]:
-                    print(f" [🆕] Creating new router_buffer entry for router '{router}' para cliente '{client_id}'")
-                    self.router_buffer_by_client[client_id][router] = movie
-                    print(f" [✅] Router '{router}' entry saved para cliente '{client_id}'. Current buffer size: {len(self.router_buffer_by_client[client_id])}")
+                if client_id in self.build_storages_by_client:
+                    # Modo grace: el lado main va directo a disco
+                    self._spill_build_row(client_id, router, movie)
+                else:
+                    self._buffer_build_row(client_id, router, movie, len(body))
             
+            # Se ackea sin el lock: antes del ack se hace el fsync (ver _sync_build_side)
             ch.basic_ack(delivery_tag=method.delivery_tag)
 
         except json.JSONDecodeError as e:
@@ -121,24 +186,49 @@ class JoinNode:
             print(f" [!] Error processing message: {e}")
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
 
+    def _buffer_build_row(self, client_id, router, movie, size):
+        """Guarda una fila del lado main en el router_buffer (la primera por clave). Se llama con el lock tomado."""
+        # Inicializar router_buffer para el cliente si no existe
+        if client_id not in self.router_buffer_by_client:
+            self.router_buffer_by_client[client_id] = {}
+        if router not in self.router_buffer_by_client[client_id]:
+            print(f" [🆕] Creating new router_buffer entry for router '{router}' para cliente '{client_id}'")
+            self.router_buffer_by_client[client_id][router] = movie
+            print(f" [✅] Router '{router}' entry saved para cliente '{client_id}'. Current buffer size: {len(self.router_buffer_by_client[client_id])}")
+            if self.memory_budget:
+                buffer_bytes = self.buffer_bytes_by_client.get(client_id, 0) + size
+                self.buffer_bytes_by_client[client_id] = buffer_bytes
+                if buffer_bytes > self.memory_budget:
+                    self._start_grace(client_id)
+
     def join_callback(self, ch, method, properties, body):
         try:
             if not self.running:
                 self.input_rabbitmq_2.close_graceful(method)
                 return
             
-            packet_json = body.decode()
-            packet = json.loads(packet_json)
-            header = packet.get("header")
-            client_id = packet.get("client_id")
+            envelope = PacketEnvelope(body)
+            header = envelope.header
+            client_id = envelope.client_id
             if is_final_packet(header):
                 print(f" [*] Cola '{self.input_queue_2}' terminó.")
-                self.clean(client_id)
-                self.final_rabbitmq.send_final(client_id=client_id)
+                if self.broadcast and not self._ack_shared_final(envelope):
+                    ch.basic_ack(delivery_tag=method.delivery_tag)
+                    return
+                with self.lock:
+                    drained = self.drained_by_client.get(client_id, False)
+                    if not drained:
+                        # Lo guardado en disco todavia no se joineo: el FINAL lo manda el drain
+                        self.final_pending.add(client_id)
+                    grace_ready = client_id in self.build_storages_by_client and self.eof_main_by_client.get(client_id, False)
+                if grace_ready:
+                    self.drain_queue.put(client_id)
+                if drained:
+                    self.finish_client(client_id)
                 ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
 
-            packet = DataPacket.from_json(packet_json)
+            packet = envelope.to_packet()
             movie = packet.data
             router = int(movie.get(self.join_by))
 
@@ -150,54 +240,25 @@ class JoinNode:
             storage = self._get_storage_for_client(client_id)
             
             with self.lock:
-                router_in_buffer = router in self.router_buffer_by_client.get(client_id, {})
+                movie1 = self.router_buffer_by_client.get(client_id, {}).get(router)
                 is_eof_main = self.eof_main_by_client.get(client_id, False)
-                
-            if router_in_buffer:
-                print(f" [🔍] Router '{router}' found in router_buffer")
-                with self.lock:
-                    movie1 = self.router_buffer_by_client[client_id][router]
-                joined_packet = self.create_joined_packet(client_id, movie1, movie)
-                self.output_rabbitmq.publish(joined_packet.to_json())
-                print(f" [✓] Joined and published router '{router}' para cliente '{client_id}' to output_rabbitmq")
-                
-            else:
-                # Si eof_main es False, guardar en el disco
-                if not is_eof_main:
+                if client_id in self.build_storages_by_client:
+                    # Modo grace: el lado main esta en disco, todo se joinea con los dos EOF.
+                    # Con eof_main ya se sabe que claves tiene: el resto no joinea con nada
+                    if not is_eof_main or router in self.build_keys_by_client[client_id]:
+                        self.probe_runs_by_client[client_id].append(self._partition(router), movie)
+                elif movie1 is None and not is_eof_main:
+                    # Se guarda con el lock tomado: una vez marcado eof_main ya no
+                    # entra nada al disco, y el drain lee todo lo que se guardo
                     print(f" [💾] Router '{router}' not in buffer, adding to disk")
                     storage.add(str(router), movie)
                     print(f" [✅] Added router '{router}' to disk")
-                    
-            if is_eof_main:
-                # Verificar si el disco está vacío
-                stored_keys = storage.list_keys()
-                if not stored_keys:
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                    return
-                print(" [🔄] Iniciando merge completo (eof_main=True)")    
-                # Realizar merge completo: combinar router_buffer con todos los datos del disco
-                for key in stored_keys:
-                    router_key = int(key)  # Convertir la clave a entero
-                    with self.lock:  # Proteger acceso a router_buffer_by_client
-                        if router_key in self.router_buffer_by_client.get(client_id, {}):
-                            movie1 = self.router_buffer_by_client[client_id][router_key]
-                        else:
-                            continue
-                    stored_movies = storage.retrieve(key)
-                    if stored_movies:
-                        # Asegurarse de que stored_movies sea una lista
-                        if not isinstance(stored_movies, list):
-                            stored_movies = [stored_movies]
-                        print(f" [🔍] Procesando router '{router_key}' con {len(stored_movies)} entradas en disco")
-                        for movie2 in stored_movies:
-                            joined_packet = self.create_joined_packet(client_id, movie1, movie2)
-                            self.output_rabbitmq.publish(joined_packet.to_json())
-                            print(f" [✓] Joined and published router '{router_key}' from disk to output_rabbitmq")
-                    
-                # Limpiar el disco después del merge
-                storage.clean()
-                print(f" [✅] Disco limpio")
-               
+                
+            if movie1 is not None:
+                print(f" [🔍] Router '{router}' found in router_buffer")
+                self.emit_joined(client_id, movie1, movie)
+                print(f" [✓] Joined and published router '{router}' para cliente '{client_id}' to output_rabbitmq")
+            # Con eof_main el buffer ya esta completo: si no estaba, no joinea con nada
 
             ch.basic_ack(delivery_tag=method.delivery_tag)
 
@@ -208,6 +269,213 @@ class JoinNode:
             print(f" [!] Error processing message: {e}")
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
 
+    def _sync_build_side(self):
+        """Hace el fsync de lo que el lado main guardo en disco, antes de ackearlo."""
+        with self.lock:
+            storages = list(self.build_storages_by_client.values())
+        for storage in storages:
+            storage.sync()
+
+    def _sync_probe_side(self):
+        """Hace el fsync de lo que el lado join guardo en disco, antes de ackearlo."""
+        with self.lock:
+            storages = list(self.storages_by_client.values()) + list(self.probe_runs_by_client.values())
+        for storage in storages:
+            storage.sync()
+
+    def _ack_shared_final(self, envelope):
+        """
+        En broadcast el FIN del lado join llega a un solo nodo de la cola
+        compartida: como en los routers, cada nodo se agrega a la lista de acks
+        y lo reencola hasta que lo vieron todos. Devuelve True la primera vez
+        que este nodo lo ve; lo que le tocaba de la cola ya lo proceso.
+        """
+        packet = envelope.fields()
+        acks = packet.get("acks") or []
+        node_id = int(self.node_id)
+        first_time = node_id not in acks
+        if first_time:
+            acks = acks + [node_id]
+            packet["acks"] = acks
+        if len(acks) < self.cluster_size:
+            self.input_rabbitmq_2.publish(packet)
+        return first_time
+
+    def drain(self):
+        """
+        Hilo que, por cada cliente cuyo lado main termino, joinea una sola vez
+        lo que el lado join guardo en disco, recorriendolo por clave. Si el FIN
+        del lado join ya llego, termina el cliente.
+        """
+        while True:
+            try:
+                client_id = self.drain_queue.get(timeout=self.drain_idle_interval)
+            except queue.Empty:
+                # La conexion de este hilo solo se usa para publicar: sin esto,
+                # sin clientes se cortaria por falta de heartbeats
+                try:
+                    self.output_rabbitmq.process_events()
+                except Exception as e:
+                    print(f" [!] Error processing drain connection events: {e}")
+                continue
+            if client_id is None:
+                return
+            try:
+                self.drain_client(client_id)
+            except Exception as e:
+                print(f" [!] Error draining client '{client_id}': {e}")
+            with self.lock:
+                self.drained_by_client[client_id] = True
+                final_pending = client_id in self.final_pending
+                self.final_pending.discard(client_id)
+            if final_pending:
+                self.finish_client(client_id)
+
+    def drain_client(self, client_id):
+        with self.lock:
+            storage = self.storages_by_client.get(client_id)
+            router_buffer = self.router_buffer_by_client.get(client_id, {})
+            build_storage = self.build_storages_by_client.get(client_id)
+            probe_runs = self.probe_runs_by_client.get(client_id)
+        if build_storage is not None:
+            self.grace_join(client_id, build_storage, storage, probe_runs)
+            return
+        if storage is None:
+            return
+        stored_keys = sorted(storage.list_keys(), key=int)
+        print(f" [🔄] Iniciando merge de {len(stored_keys)} claves en disco para cliente '{client_id}'")
+        for key in stored_keys:
+            movie1 = router_buffer.get(int(key))
+            if movie1 is None:
+                continue
+            stored_movies = storage.retrieve(key)
+            if not isinstance(stored_movies, list):
+                stored_movies = [stored_movies]
+            for movie2 in stored_movies:
+                self.emit_joined(client_id, movie1, movie2)
+            print(f" [✓] Joined and published router '{key}' from disk ({len(stored_movies)} entradas)")
+        storage.clean()
+        print(f" [✅] Disco limpio")
+
+    def _partition(self, router):
+        return stable_hash(router) % self.grace_partitions
+
+    def _start_grace(self, client_id):
+        """Pasa el cliente a modo grace: baja su router_buffer a disco. Se llama con el lock tomado."""
+        storage_dir = os.path.join(self.storage_dir, f'build_{self.node_id}_{client_id}')
+        self.build_storages_by_client[client_id] = StorageHandler(data_dir=storage_dir)
+        self.build_keys_by_client[client_id] = set()
+        probe_dir = os.path.join(self.storage_dir, f'probe_{self.node_id}_{client_id}')
+        self.probe_runs_by_client[client_id] = PartitionRuns(data_dir=probe_dir)
+        router_buffer = self.router_buffer_by_client.pop(client_id, {})
+        print(f" [💾] Lado main del cliente '{client_id}' supera {self.memory_budget} bytes: grace hash join con {len(router_buffer)} entradas en '{storage_dir}'")
+        for router, movie in router_buffer.items():
+            self._spill_build_row(client_id, router, movie)
+        self.buffer_bytes_by_client.pop(client_id, None)
+
+    def _spill_build_row(self, client_id, router, movie):
+        """Guarda una fila del lado main en su particion (la primera por clave, como el router_buffer)."""
+        build_keys = self.build_keys_by_client[client_id]
+        if router in build_keys:
+            return
+        build_keys.add(router)
+        self.build_storages_by_client[client_id].store(f"{self._partition(router):04d}:{router}", movie)
+
+    def grace_join(self, client_id, build_storage, storage, probe_runs):
+        """
+        Joinea los dos lados en disco particion por particion: solo una
+        particion del lado main esta en memoria a la vez, y la del lado join se
+        lee de corrido de su archivo. En storage quedan las filas del lado join
+        guardadas antes de pasar a modo grace.
+        """
+        probe_keys_by_partition = {}
+        if storage is not None:
+            for key in storage.list_keys():
+                probe_keys_by_partition.setdefault(self._partition(int(key)), []).append(key)
+        run_partitions = set(probe_runs.partitions())
+        print(f" [🔄] Grace hash join para cliente '{client_id}' en {self.grace_partitions} particiones")
+        for partition in range(self.grace_partitions):
+            probe_keys = probe_keys_by_partition.get(partition, [])
+            if not probe_keys and partition not in run_partitions:
+                continue
+            prefix = f"{partition:04d}:"
+            movies = {int(key[len(prefix):]): build_storage.retrieve(key) for key in build_storage.list_keys(prefix)}
+            for key in sorted(probe_keys, key=int):
+                movie1 = movies.get(int(key))
+                if movie1 is None:
+                    continue
+                for movie2 in storage.retrieve(key):
+                    self.emit_joined(client_id, movie1, movie2)
+            for movie2 in probe_runs.read(partition):
+                movie1 = movies.get(int(movie2.get(self.join_by)))
+                if movie1 is not None:
+                    self.emit_joined(client_id, movie1, movie2)
+            print(f" [✓] Particion {partition} joineada ({len(movies)} entradas del lado main)")
+        if storage is not None:
+            storage.clean()
+        probe_runs.clean()
+        build_storage.clean()
+        print(f" [✅] Disco limpio")
+
+    def finish_client(self, client_id):
+        """Ambos lados del cliente terminaron y el disco ya se joineo: limpia y manda el FINAL."""
+        if self.aggregate_field:
+            self.publish_aggregates(client_id)
+        self.clean(client_id)
+        self.final_rabbitmq.send_final(client_id=client_id)
+
+    def emit_joined(self, client_id, movie1, movie2):
+        """Publica el par joineado, o lo acumula si el join agrega (JOIN_AGGREGATE)."""
+        if not self.aggregate_field:
+            joined_packet = self.create_joined_packet(client_id, movie1, movie2)
+            self.output_rabbitmq.publish(joined_packet.encode())
+            return
+        value = movie2.get(self.aggregate_field)
+        if value is None:
+            return
+        try:
+            value = float(value)
+        except (ValueError, TypeError):
+            print(f" [!] Skipped row with invalid {self.aggregate_field}: {value}")
+            return
+        key = int(movie1.get(self.join_by))
+        with self.lock:
+            aggregates = self.aggregates_by_client.setdefault(client_id, {})
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregates[key] = [value, 1, movie1.get("title", "Unknown")]
+            else:
+                aggregate[0] += value
+                aggregate[1] += 1
+
+    def publish_aggregates(self, client_id):
+        """Una fila por clave con el formato de los parciales de average_by (ver Calculation.get_result)."""
+        with self.lock:
+            aggregates = self.aggregates_by_client.pop(client_id, {})
+        rows = [
+            {
+                "operation": "average",
+                "key": self.join_by,
+                "id": key,
+                "value_field": self.aggregate_field,
+                "average": round(total / count, 2),
+                "total": total,
+                "count": count,
+                "title": title
+            }
+            for key, (total, count, title) in sorted(aggregates.items())
+        ]
+        if not rows:
+            rows = [{"error": f"No movies processed for {self.aggregate_field} average by {self.join_by}."}]
+        for row in rows:
+            packet = DataPacket(
+                client_id=client_id,
+                timestamp=datetime.utcnow().isoformat(),
+                data=row,
+            )
+            self.output_rabbitmq.publish(packet.encode())
+        print(f" [✓] Publicados {len(aggregates)} promedios de {self.aggregate_field} para cliente '{client_id}'")
+
     def create_joined_packet(self, client_id: int, movie1, movie2):
         combined_movie = {**movie1, **movie2}
         joined_packet = DataPacket(
@@ -226,8 +494,12 @@ class JoinNode:
             t2 = threading.Thread(target=self.input_rabbitmq_2.consume, args=(self.join_callback,))
             t2.start()
             self.threads.append(t2)
+            self.drain_thread = threading.Thread(target=self.drain, daemon=True)
+            self.drain_thread.start()
             t1.join()
             t2.join()
+            self.drain_queue.put(None)
+            self.drain_thread.join()
                   
         except Exception as e:
             print(f" [!] Error in join node: {e}")
@@ -249,6 +521,7 @@ class JoinNode:
         with self.lock:
             if client_id in self.storages_by_client:
                 self.storages_by_client[client_id].clean()
+                self.storages_by_client[client_id].close()
                 del self.storages_by_client[client_id]
                 
             # Limpiar router_buffer del cliente
@@ -258,6 +531,17 @@ class JoinNode:
             # Limpiar eof_main del cliente
             if client_id in self.eof_main_by_client:
                 del self.eof_main_by_client[client_id]
+            self.drained_by_client.pop(client_id, None)
+            self.aggregates_by_client.pop(client_id, None)
+            self.buffer_bytes_by_client.pop(client_id, None)
+            self.build_keys_by_client.pop(client_id, None)
+            build_storage = self.build_storages_by_client.pop(client_id, None)
+            if build_storage is not None:
+                build_storage.clean_all()
+                build_storage.close()
+            probe_runs = self.probe_runs_by_client.pop(client_id, None)
+            if probe_runs is not None:
+                probe_runs.clean()
         print(f" [✅] Disco limpio y memoria limpia para '{client_id}'") 
     
     def close(self):
@@ -270,8 +554,18 @@ class JoinNode:
             self.input_rabbitmq_2.close()
         if self.final_rabbitmq:
             self.final_rabbitmq.close()
+        if self.key_set_rabbitmq:
+            self.key_set_rabbitmq.close()
         for client_id, storage in self.storages_by_client.items():
             print(f" [🧹] Limpiando almacenamiento para cliente '{client_id}'")
             storage.clean_all()
+            storage.close()
         self.storages_by_client.clear()
+        for storage in self.build_storages_by_client.values():
+            storage.clean_all()
+            storage.close()
+        self.build_storages_by_client.clear()
+        for probe_runs in self.probe_runs_by_client.values():
+            probe_runs.clean()
+        self.probe_runs_by_client.clear()
         self.router_buffer_by_client.clear()
@@ -6,6 +6,7 @@ from datetime import datetime
 from common.middleware import Middleware
 
 from common.packet import DataPacket, is_final_packet
+from src.typed_columns import convert_column, parse_typed_columns
 
 import os
 
@@ -58,6 +59,10 @@ class ParserNode:
                     self.rename_columns.append((old_name.strip(), new_name.strip()))
             except ValueError as e:
                 print(f" [~] Invalid REPLACE format: {replace_str}, error: {e}. No columns will be renamed.")
+
+        # Columnas que salen ya convertidas (listas de nombres, anio, enteros),
+        # para no volver a parsear los literales en cada etapa
+        self.typed_columns = parse_typed_columns(os.getenv("TYPED_COLUMNS", ""))
    
     def callback(self, ch, method, properties, body):
 
@@ -104,28 +109,29 @@ class ParserNode:
                 rows = packet['rows']
                 client_id = packet['client_id']
 
-                # Creo el string CSV
+                # Creo el string CSV y parseo solo las columnas que se conservan
                 csv_text = header + "\n" + "\n".join(rows)
-                df = pd.read_csv(StringIO(csv_text))
-                
                 print(f" [~] Conservando solo columnas: {self.keep_columns}")
-                columns_to_keep = list(set(df.columns).intersection(self.keep_columns))
-                df = df[columns_to_keep]
-                df = df.dropna().copy()
+                df = pd.read_csv(StringIO(csv_text), usecols=self._keep_column)
+                df = df.dropna()
                 print(" [x] Received and processed CSV:")
                 
                 # Apply column renaming for each pair if the old column exists
                 rename_dict = {old: new for old, new in self.rename_columns if old in df.columns}
                 if rename_dict:
-                    df.rename(columns=rename_dict, inplace=True)
+                    df = df.rename(columns=rename_dict)
 
-                for _, row in df.iterrows():
-                    packet = DataPacket(
-                            client_id=client_id,
-                            timestamp=datetime.utcnow().isoformat(),
-                            data=row.to_dict()
-                    )
-                    self.output_rabbitmq.publish(packet.to_json(), self.filename)
+                for column, converter in self.typed_columns.items():
+                    if column in df.columns:
+                        df[column] = convert_column(df[column], converter)
+
+                # Todas las filas del batch salen juntas, en un unico mensaje BATCH
+                timestamp = datetime.utcnow().isoformat()
+                bodies = [
+                    DataPacket(client_id=client_id, timestamp=timestamp, data=record).encode()
+                    for record in df.to_dict('records')
+                ]
+                self.output_rabbitmq.publish_batch(bodies, self.filename)
                     
                 ch.basic_ack(delivery_tag=method.delivery_tag)
                 print(f" [x] Message {method.delivery_tag} acknowledged")
@@ -137,6 +143,9 @@ class ParserNode:
                 ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
        
 
+    def _keep_column(self, column):
+        return self.keep_columns is None or column in self.keep_columns
+
     def start_node(self):
         print(f" [~] Starting ParserNode: input_queue={self.input_queue}, output_queue={self.output_queue}")
         if self.keep_movies_columns:
@@ -145,6 +154,8 @@ class ParserNode:
             print(f" [~] Keeping ratings columns: {self.keep_ratings_columns}")
         if self.rename_columns:
             print(f" [~] Renaming columns: {self.rename_columns}")
+        if self.typed_columns:
+            print(f" [~] Typed columns: {list(self.typed_columns)}")
       
         try:
             self.input_rabbitmq.consume(self.callback)
@@ -0,0 +1,45 @@
+# typed_columns.py
+from common.literal_scanner import literal_names
+
+def to_year(value):
+    """Convierte una fecha 'YYYY-MM-DD' en el anio como entero."""
+    year = value.split('-')[0] if isinstance(value, str) else value
+    return int(year)
+
+def to_int(value):
+    return int(float(value))
+
+CONVERTERS = {
+    'names': literal_names,
+    'year': to_year,
+    'int': to_int,
+}
+
+def parse_typed_columns(value):
+    """
+    Parsea TYPED_COLUMNS (por ejemplo "genres:names,release_date:year,budget:int")
+    en un dict columna -> conversor.
+    """
+    typed_columns = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        column, _, type_name = entry.partition(':')
+        type_name = type_name.strip()
+        if type_name not in CONVERTERS:
+            raise ValueError(f"Unknown column type '{type_name}' for column '{column.strip()}'")
+        typed_columns[column.strip()] = CONVERTERS[type_name]
+    return typed_columns
+
+def convert_column(values, converter):
+    """
+    Aplica el conversor a cada valor de la columna. Los valores que no se pueden
+    convertir quedan como estaban, para que los siguientes nodos los traten
+    igual que antes.
+    """
+    def convert(value):
+        try:
+            return converter(value)
+        except (ValueError, SyntaxError, TypeError, AttributeError):
+            return value
+    return values.map(convert)
@@ -0,0 +1,381 @@
+"""
+Corre el pipeline entero en una sola maquina, sin RabbitMQ ni Docker, sobre el
+backend de Middleware en memoria (MIDDLEWARE_BACKEND=memory).
+
+Los nodos se arman a partir de la misma topologia que genera
+generador_compose.py (config.ini + generator/config_generator.py), cada uno con
+el entorno de su servicio. El gateway y los clientes se reemplazan por un driver
+que publica los archivos en el exchange del gateway y junta las respuestas del
+exchange de deliver.
+
+    python3 pipeline_local.py                      # nodos como hilos de un proceso
+    python3 pipeline_local.py --mode processes     # un proceso por nodo
+    python3 pipeline_local.py --profile output/prof  # un .prof de cProfile por nodo
+"""
+import argparse
+import cProfile
+import importlib.util
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from generador_compose import initialize_config
+from generator.config_generator import (
+    ConfigGenerator,
+    GATEWAY,
+    DELIVER,
+    MOVIES_FILE,
+    RATINGS_FILE,
+    CREDITS_FILE,
+)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Servicios del compose que no son nodos del pipeline (los reemplaza el driver)
+SKIPPED_SERVICES = ('rabbitmq', 'gateway', 'client')
+
+NODE_CLASSES = {
+    'parser': 'ParserNode',
+    'filter': 'FilterNode',
+    'router': 'RouterNode',
+    'calculator': 'CalculatorNode',
+    'aggregator': 'AggregatorNode',
+    'join': 'JoinNode',
+    'sentiment': 'SentimentNode',
+    'deliver': 'DeliverNode',
+}
+
+_components = {}
+
+
+def load_services(config_file):
+    """Devuelve [(servicio, componente, entorno)] con los nodos de la topologia."""
+    config_params = initialize_config(config_file)
+    compose = ConfigGenerator(config_params).generate()
+    services = []
+    for name, service in compose['services'].items():
+        if name.startswith(SKIPPED_SERVICES) or 'build' not in service:
+            continue
+        component = os.path.dirname(service['build']['dockerfile'])
+        environment = dict(variable.split('=', 1) for variable in service.get('environment', []))
+        services.append((name, component, environment))
+    return config_params, services
+
+
+def load_component(component):
+    """
+    Importa <component>/main.py. Cada componente tiene su propio paquete `src`,
+    asi que se importa con el src del componente y despues se saca de
+    sys.modules para que no lo pise el del siguiente.
+    """
+    if component in _components:
+        return _components[component]
+    component_dir = os.path.join(ROOT, component)
+    previous = {name: module for name, module in sys.modules.items() if name == 'src' or name.startswith('src.')}
+    for name in previous:
+        del sys.modules[name]
+    sys.path.insert(0, component_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{component}_main", os.path.join(component_dir, 'main.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(component_dir)
+        for name in [name for name in sys.modules if name == 'src' or name.startswith('src.')]:
+            del sys.modules[name]
+        sys.modules.update(previous)
+    _components[component] = module
+    return module
+
+
+def build_node(component, main):
+    """Construye el nodo como lo hace su main.py. Devuelve (nodo, funcion que lo arranca)."""
+    node = getattr(main, NODE_CLASSES[component])()
+    if component == 'filter':
+        filters = main.parse_filter_argument(os.getenv("FILTERS"))
+        return node, lambda: node.start_node(filters)
+    return node, node.start_node
+
+
+class NodeEnvironment:
+    """Aplica el entorno de un servicio mientras se construye su nodo."""
+    def __init__(self, environment):
+        self.environment = environment
+        self.previous = {}
+
+    def __enter__(self):
+        for key, value in self.environment.items():
+            self.previous[key] = os.environ.get(key)
+            os.environ[key] = value
+
+    def __exit__(self, *_):
+        for key, value in self.previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def run_profiled(target, profile_path):
+    if not profile_path:
+        target()
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(target)
+    finally:
+        profiler.dump_stats(profile_path)
+
+
+def node_environment(name, environment, args):
+    environment = dict(environment)
+    environment['MIDDLEWARE_BACKEND'] = 'memory'
+    if args.shm_links is not None:
+        environment['SHM_LINKS'] = args.shm_links
+    environment['STORAGE_DIR'] = os.path.join(args.workdir, name)
+    return environment
+
+
+def profile_path(args, name):
+    return os.path.join(args.profile, f"{name}.prof") if args.profile else None
+
+
+# ---------------------------------------------------------------- driver
+
+def read_batches(filepath, batch_size):
+    """Lee el archivo como lo manda el cliente: header y batches de lineas."""
+    with open(filepath, 'rb') as file:
+        header = file.readline().decode('utf-8')
+        batch = []
+        for line in file:
+            batch.append(line.decode('utf-8'))
+            if len(batch) >= batch_size:
+                yield header, batch
+                batch = []
+        if batch:
+            yield header, batch
+
+
+def run_client(client_id, files, batch_size, output_dir, results):
+    """Hace lo mismo que un cliente y su conexion en el gateway."""
+    from common.middleware import Middleware
+    from common.packet import is_final_packet
+    from common.protocol_constants import BATCH_MSG_TYPE
+    import orjson
+
+    receiver = Middleware(
+        queue=str(client_id),
+        consumer_tag=f"client_{client_id}",
+        exchange=DELIVER,
+        publish_to_exchange=False,
+        routing_key=str(client_id)
+    )
+    sender = Middleware(queue=None, exchange=GATEWAY)
+    start = time.monotonic()
+    for filename, filepath in files:
+        for header, rows in read_batches(filepath, batch_size):
+            sender.publish({
+                "msg_type": BATCH_MSG_TYPE,
+                "filename": filename,
+                "rows": rows,
+                "header": header,
+                "client_id": client_id
+            }, filename)
+        sender.send_final(client_id, filename)
+    sent_at = time.monotonic()
+
+    responses = []
+
+    def callback(ch, method, properties, body):
+        packet = orjson.loads(body)
+        if is_final_packet(packet.get("header")):
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            ch.stop_consuming()
+            return
+        if packet.get("response"):
+            responses.append((time.monotonic() - start, packet["response"]))
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    receiver.consume(callback)
+    receiver.delete_queue()
+    sender.close()
+    receiver.close()
+
+    with open(os.path.join(output_dir, f"results_{client_id}.txt"), "w") as f:
+        for _, response in responses:
+            f.write(f"{response}\n")
+    results[client_id] = (sent_at - start, time.monotonic() - start, responses)
+
+
+def run_clients(config_params, args):
+    files = [
+        (MOVIES_FILE, os.path.join(ROOT, config_params["movies_file"])),
+        (RATINGS_FILE, os.path.join(ROOT, config_params["ratings_file"])),
+        (CREDITS_FILE, os.path.join(ROOT, config_params["credits_file"])),
+    ]
+    clients = args.clients if args.clients is not None else config_params["clients"]
+    results = {}
+    threads = [
+        threading.Thread(target=run_client, args=(client_id, files, args.batch_size, args.output, results))
+        for client_id in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def print_summary(results, elapsed, out):
+    for client_id, (sent, finished, responses) in sorted(results.items()):
+        print(f"[Client {client_id}] archivos enviados en {sent:.2f}s, {len(responses)} respuestas en {finished:.2f}s", file=out)
+        for arrived_at, response in responses:
+            print(f"    {arrived_at:8.2f}s  {response.splitlines()[0] if response else ''}", file=out)
+    print(f"Tiempo total: {elapsed:.2f}s", file=out)
+
+
+# ---------------------------------------------------------------- modos
+
+def run_threads(config_params, services, args, out):
+    """Todos los nodos como hilos de este proceso, sobre un unico broker local."""
+    nodes = []
+    # Los nodos registran su handler de SIGTERM al construirse, lo que solo se
+    # puede hacer desde el hilo principal: se construyen aca y se corren en hilos
+    for name, component, environment in services:
+        main = load_component(component)
+        with NodeEnvironment(node_environment(name, environment, args)):
+            node, start_node = build_node(component, main)
+        thread = threading.Thread(target=run_profiled, args=(start_node, profile_path(args, name)), name=name, daemon=True)
+        nodes.append((name, node, thread))
+    print(f"{len(nodes)} nodos listos", file=out)
+
+    def stop_nodes(*_):
+        for _, node, _ in nodes:
+            node._sigterm_handler(signal.SIGTERM, None)
+
+    signal.signal(signal.SIGTERM, stop_nodes)
+    signal.signal(signal.SIGINT, stop_nodes)
+
+    for _, _, thread in nodes:
+        thread.start()
+    start = time.monotonic()
+    results = {}
+    run_profiled(lambda: results.update(run_clients(config_params, args)), profile_path(args, 'driver'))
+    elapsed = time.monotonic() - start
+
+    stop_nodes()
+    for name, _, thread in nodes:
+        thread.join(args.shutdown_timeout)
+        if thread.is_alive():
+            print(f"El nodo {name} no termino", file=out)
+    return results, elapsed
+
+
+def run_service(name, component, environment, log_path, profile, ready):
+    """Proceso de un nodo en modo processes."""
+    os.environ.update(environment)
+    sys.stdout = sys.stderr = open(log_path, 'a', buffering=1)
+    main = load_component(component)
+    node, start_node = build_node(component, main)
+    ready.set()
+    run_profiled(start_node, profile)
+
+
+def run_processes(config_params, services, args, out):
+    """Un proceso por nodo, sobre un broker compartido en otro proceso."""
+    # common.middleware elige el backend al importarse, asi que va primero
+    import common.middleware
+    from common.memory_middleware import serve_broker, MEMORY_BROKER_AUTHKEY
+
+    manager, address = serve_broker()
+    # Cada proceso arranca de cero, con las variables de su servicio
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for name, component, environment in services:
+        environment = node_environment(name, environment, args)
+        environment['MEMORY_BROKER_ADDRESS'] = address
+        environment['MEMORY_BROKER_AUTHKEY'] = MEMORY_BROKER_AUTHKEY
+        ready = context.Event()
+        process = context.Process(
+            target=run_service,
+            args=(name, component, environment, os.path.join(args.output, f"{name}.log"), profile_path(args, name), ready),
+            name=name
+        )
+        process.start()
+        processes.append((name, process, ready))
+    # Las colas se declaran al construir los nodos: hay que esperarlos a todos
+    # antes de publicar, o se descartarian los mensajes sin cola enlazada
+    for name, process, ready in processes:
+        while not ready.wait(1):
+            if not process.is_alive():
+                raise RuntimeError(f"El nodo {name} termino antes de arrancar (ver {name}.log)")
+    print(f"{len(processes)} nodos listos", file=out)
+
+    start = time.monotonic()
+    results = {}
+    try:
+        run_profiled(lambda: results.update(run_clients(config_params, args)), profile_path(args, 'driver'))
+    finally:
+        elapsed = time.monotonic() - start
+        for _, process, _ in processes:
+            if process.is_alive():
+                process.terminate()
+        for name, process, _ in processes:
+            process.join(args.shutdown_timeout)
+            if process.is_alive():
+                print(f"El nodo {name} no termino", file=out)
+                process.kill()
+        manager.shutdown()
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Corre el pipeline en una sola maquina con el broker en memoria")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--mode', choices=('threads', 'processes'), default='threads')
+    parser.add_argument('--clients', type=int, default=None, help="Por defecto, CLIENTS de config.ini")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Lineas por batch, como BATCH_SIZE del cliente")
+    parser.add_argument('--output', default='output/local', help="Resultados por cliente y logs de los nodos")
+    parser.add_argument('--workdir', default='output/local/storage', help="Directorio de los StorageHandler de los joins")
+    parser.add_argument('--profile', default=None, help="Directorio donde dejar un .prof de cProfile por nodo")
+    parser.add_argument('--shm-links', default=None, help="SHM_LINKS de los nodos (por defecto, la seccion [SHM] de config.ini)")
+    parser.add_argument('--shutdown-timeout', type=float, default=10)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    args.output = os.path.abspath(args.output)
+    args.workdir = os.path.abspath(args.workdir)
+    for directory in (args.output, args.workdir, args.profile):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    if args.profile:
+        args.profile = os.path.abspath(args.profile)
+
+    config_params, services = load_services(args.config)
+    # Las variables del middleware se leen al importar common, una vez por proceso
+    os.environ.update(config_params.get('middleware', {}))
+    os.environ['MIDDLEWARE_BACKEND'] = 'memory'
+    if args.shm_links is not None:
+        os.environ['SHM_LINKS'] = args.shm_links
+
+    # Los prints de los nodos y del driver van a un log, no a la consola
+    out = sys.stdout
+    log_name = 'nodes.log' if args.mode == 'threads' else 'driver.log'
+    sys.stdout = open(os.path.join(args.output, log_name), 'w', buffering=1)
+    try:
+        if args.mode == 'threads':
+            results, elapsed = run_threads(config_params, services, args, out)
+        else:
+            results, elapsed = run_processes(config_params, services, args, out)
+    finally:
+        sys.stdout.close()
+        sys.stdout = out
+    print_summary(results, elapsed, out)
+
+
+if __name__ == '__main__':
+    main()
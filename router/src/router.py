@@ -1,6 +1,9 @@
 import json
 from common.middleware import Middleware
-from common.packet import is_final_packet
+from common.key_set import KeySetListener
+from common.partitioner import make_partitioner
+from common.heavy_hitters import HeavyHitters
+from common.packet import PacketEnvelope, is_final_packet
 import os
 import signal
 
@@ -8,9 +11,18 @@ class RouterNode:
     """
     El RouterNode se suscribe a una 'input_queue', y envia los mensajes
     a un 'output_exchange', routeandolos segun un 'routing_key' que
-    se determina segun: id % number_of_nodes, siendo:
+    determina el particionador PARTITIONER (ver common.partitioner) a partir de:
      - id: el id de los mensajes,
      - number_of_nodes: la cantidad de nodos suscriptos al exchange 'output_exchange'.
+    Por defecto es id % number_of_nodes ('modulo').
+    Con ROUTER_BATCH_SIZE > 1 los mensajes de cada routing key salen juntos en
+    un BATCH al llenarse o a los ROUTER_BATCH_TIMEOUT_MS del primero, y
+    siempre antes de ackear los mensajes de entrada que los generaron.
+    Con HOT_KEY_SPLIT > 1, los ids que superan HOT_KEY_SHARE del stream se
+    reparten entre HOT_KEY_SPLIT nodos consecutivos; solo sirve si los nodos
+    destino calculan parciales que despues junta un aggregator.
+    Con KEY_SET_EXCHANGE, descarta los mensajes cuyo id no esta en las claves
+    que publico el JoinNode destino (ver KeySetListener).
     """
     def __init__(self):
         signal.signal(signal.SIGTERM, self._sigterm_handler)
@@ -22,8 +34,30 @@ class RouterNode:
         self.number_of_nodes = int(os.getenv("NUMBER_OF_NODES"))
         self.routing_key = os.getenv("RABBITMQ_ROUTING_KEY", "")
         self.router_by = os.getenv("ROUTER_BY", "id")
+        # Todos los routers hacia un mismo nodo stateful tienen que usar el mismo particionador
+        virtual_nodes = os.getenv("VIRTUAL_NODES")
+        self.partitioner = make_partitioner(
+            os.getenv("PARTITIONER", "modulo"),
+            self.number_of_nodes,
+            int(virtual_nodes) if virtual_nodes else None
+        )
         self.cluster_size = int(os.getenv("CLUSTER_SIZE"))
         self.node_id = int(os.getenv("NODE_ID"))
+        # Exchange por el que los JoinNode destino publican sus claves (semi-join)
+        self.key_set_exchange = os.getenv("KEY_SET_EXCHANGE", "")
+        self.dropped_by_client = {}
+        # Mensajes que se juntan por routing key antes de publicarlos como un BATCH,
+        # y cuanto puede esperar el primero de un batch incompleto
+        self.batch_size = int(os.getenv("ROUTER_BATCH_SIZE", "1"))
+        self.batch_timeout = int(os.getenv("ROUTER_BATCH_TIMEOUT_MS", "100")) / 1000
+        # Reparto de claves calientes (ver _routing_key)
+        self.hot_key_split = min(int(os.getenv("HOT_KEY_SPLIT", "1")), self.number_of_nodes)
+        self.hot_key_share = float(os.getenv("HOT_KEY_SHARE", "0.01"))
+        self.hot_key_min_rows = int(os.getenv("HOT_KEY_MIN_ROWS", "1000"))
+        self.heavy_hitters = None
+        if self.hot_key_split > 1:
+            self.heavy_hitters = HeavyHitters(int(os.getenv("HOT_KEY_CAPACITY", "200")))
+        self.hot_key_sent = {}  # id caliente -> mensajes enviados, para rotar entre nodos
 
         if self.input_queue is None:
             raise Exception("Missing RABBITMQ_QUEUE env var")
@@ -43,12 +77,28 @@ class RouterNode:
             # Sino conectamos directo a la cola
             self.input_rabbitmq = Middleware(queue=self.input_queue, consumer_tag=self.consumer_tag)
 
-        self.output_rabbitmq = Middleware(queue=None, exchange=self.output_exchange)
+        self.output_rabbitmq = Middleware(
+            queue=None,
+            exchange=self.output_exchange,
+            batch_size=self.batch_size,
+            batch_timeout=self.batch_timeout
+        )
+        if self.batch_size > 1:
+            # Un mensaje se ackea recien cuando sus filas salieron del batch
+            self.input_rabbitmq.set_before_ack(self.output_rabbitmq.flush)
+
+        self.key_sets = None
+        if self.key_set_exchange:
+            self.key_sets = KeySetListener(
+                self.key_set_exchange,
+                f"{self.key_set_exchange}_{self.consumer_tag}_{self.node_id}",
+                f"{self.consumer_tag}_key_set_{self.node_id}"
+            )
     
     def callback(self, ch, method, properties, body):
         """
         Recibe un mensaje y lo envia al output_exchange, routeandolo
-        segun routing_key = msg.id % number_of_nodes.
+        segun routing_key = partitioner.partition(msg.id).
         """
         try:
             if self.running == False:
@@ -58,10 +108,16 @@ class RouterNode:
                 self.input_rabbitmq.close_graceful(method)
                 return
             
-            packet_json = body.decode()
-            packet = json.loads(packet_json)
-            header = packet.get("header")
+            envelope = PacketEnvelope(body)
+            header = envelope.header
             if is_final_packet(header):
+                packet = envelope.fields()
+                # Lo que quedo en los batches tiene que llegar antes que el FIN,
+                # aunque el FIN lo termine mandando otro router
+                self.output_rabbitmq.flush()
+                if self.key_sets:
+                    # Ya no llegan mas datos del cliente a este nodo
+                    self._forget_client(packet["client_id"])
                 # Si la lista de acks es None, entonces soy el primero en recibir el mensaje FIN
                 # Agrego la lista con mi id y la reencolo
                 if packet.get("acks") is None:
@@ -90,14 +146,20 @@ class RouterNode:
                 return
             
             # Deserializo la peli para obtener el id
-            movie = packet.get("data")
+            movie = envelope.data
             movie_id = int(movie.get(self.router_by))
 
-            # Calculo la routing key como el modulo entre el id y la cantidad de nodos
-            routing_key = str(movie_id % self.number_of_nodes)
+            # Calculo la routing key como el nodo que le toca al id
+            routing_key = self._routing_key(movie_id)
+
+            # Si el nodo destino ya publico sus claves y esta no esta, el join la descartaria
+            if self.key_sets and not self.key_sets.may_join(envelope.client_id, routing_key, movie_id):
+                self._count_dropped(envelope.client_id)
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
             
             # Routeo el mensaje segun el routing key
-            self.output_rabbitmq.publish(packet_json, routing_key=routing_key)
+            self.output_rabbitmq.publish(body, routing_key=routing_key)
             print(f" [✓] Sent movie with id: {movie_id} through the exchange using routing key: {routing_key}")
             
             ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -111,6 +173,36 @@ class RouterNode:
             ch.basic_nack(delivery_tag=method.delivery_tag, multiple=False, requeue=False)
 
 
+    def _routing_key(self, movie_id):
+        """
+        Nodo al que va el id. Un id caliente (mas de hot_key_share de lo visto)
+        rota entre su nodo y los hot_key_split - 1 siguientes, para que no
+        concentre la carga en un solo nodo.
+        """
+        node = self.partitioner.partition(movie_id)
+        if self.heavy_hitters is None:
+            return str(node)
+        count = self.heavy_hitters.add(movie_id)
+        if self.heavy_hitters.total < self.hot_key_min_rows or count < self.hot_key_share * self.heavy_hitters.total:
+            return str(node)
+        sent = self.hot_key_sent.get(movie_id, 0)
+        if sent == 0:
+            print(f" [~] Id caliente {movie_id} ({count}/{self.heavy_hitters.total} mensajes), se reparte entre {self.hot_key_split} nodos")
+        self.hot_key_sent[movie_id] = sent + 1
+        return str((node + sent % self.hot_key_split) % self.number_of_nodes)
+
+    def _count_dropped(self, client_id):
+        dropped = self.dropped_by_client.get(client_id, 0) + 1
+        self.dropped_by_client[client_id] = dropped
+        if dropped % 10000 == 0:
+            print(f" [~] Descartados {dropped} mensajes sin join para cliente '{client_id}'")
+
+    def _forget_client(self, client_id):
+        self.key_sets.forget(client_id)
+        dropped = self.dropped_by_client.pop(client_id, 0)
+        if dropped:
+            print(f" [~] Descartados {dropped} mensajes sin join para cliente '{client_id}'")
+
     def start_node(self):
         try:
             self.input_rabbitmq.consume(self.callback)
@@ -130,3 +222,5 @@ class RouterNode:
             self.input_rabbitmq.close()
         if self.output_rabbitmq:
             self.output_rabbitmq.close()
+        if self.key_sets:
+            self.key_sets.close()
@@ -1,6 +1,6 @@
 import json
 from common.middleware import Middleware
-from common.packet import DataPacket, is_final_packet
+from common.packet import DataPacket, PacketEnvelope, is_final_packet
 from datetime import datetime
 import os
 import signal
@@ -45,12 +45,12 @@ class SentimentNode:
                 self.input_rabbitmq.close_graceful(method)
                 return
             # Recibir paquete y mandar final packet si se recibe uno
-            packet_json = body.decode()
-            packet = json.loads(packet_json)
-            header = packet.get("header")
-            client_id = packet.get("client_id")
+            envelope = PacketEnvelope(body)
+            header = envelope.header
+            client_id = envelope.client_id
             
             if is_final_packet(header):
+                packet = envelope.fields()
                 # Si la lista de acks es None, entonces soy el primero en recibir el mensaje FIN
                 # Agrego la lista con mi id y la reencolo
                 if packet.get("acks") is None:
@@ -78,7 +78,7 @@ class SentimentNode:
                 ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
             
-            packet = DataPacket.from_json(packet_json)
+            packet = envelope.to_packet()
             movie = packet.data
 
             # Procesar paquete (comunicarse con la lib de sentimientos)
@@ -96,9 +96,9 @@ class SentimentNode:
 
             # Publicar el paquete filtrado a la cola del gateway que corresponda
             if sentiment == "POSITIVE":
-                self.output_positive_rabbitmq.publish(filtered_packet.to_json())
+                self.output_positive_rabbitmq.publish(filtered_packet.encode())
             elif sentiment == "NEGATIVE":
-                self.output_negative_rabbitmq.publish(filtered_packet.to_json())
+                self.output_negative_rabbitmq.publish(filtered_packet.encode())
             else:
                 print("[--------------] No es positivo ni negativo")
             
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark de common.literal_scanner contra ast.literal_eval para sacar
+los nombres de las columnas de literales (cast, genres, production_countries).
+
+Uso (desde la raiz del repo):
+    python testing/benchmark_literal_scanner.py
+    python testing/benchmark_literal_scanner.py --file data/credits.csv --column cast
+"""
+import argparse
+import ast
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.literal_scanner import literal_names
+
+
+def names_with_literal_eval(value):
+    # Lo que hacian antes Calculation, check_condition y DeliverNode
+    return [item.get('name', '') for item in ast.literal_eval(value)]
+
+
+def synthetic_cast(rows, cast_size, seed=0):
+    """Strings de cast con la forma de credits.csv (incluye comillas y escapes)."""
+    rng = random.Random(seed)
+    names = ["Tom Hanks", "Ricardo Darín", "Penélope Cruz", "Sinéad O'Connor", 'Dwayne "The Rock" Johnson']
+    values = []
+    for _ in range(rows):
+        cast = []
+        for order in range(rng.randint(1, cast_size)):
+            cast.append({
+                'cast_id': rng.randint(1, 500),
+                'character': rng.choice(["Woody (voice)", "Himself", "Mrs. O'Brien", ""]),
+                'credit_id': '%024x' % rng.getrandbits(96),
+                'gender': rng.randint(0, 2),
+                'id': rng.randint(1, 2000000),
+                'name': rng.choice(names),
+                'order': order,
+                'profile_path': rng.choice(['/pQFoyx7rp09CJTAb932F2g8Nlu.jpg', None]),
+            })
+        values.append(repr(cast))
+    return values
+
+
+def column_values(filepath, column):
+    import pandas as pd
+    return [value for value in pd.read_csv(filepath, usecols=[column])[column].dropna() if value.startswith('[')]
+
+
+def measure(function, values, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in values:
+            function(value)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="CSV del que tomar la columna (por defecto, datos sinteticos)")
+    parser.add_argument("--column", default="cast")
+    parser.add_argument("--rows", type=int, default=2000, help="Filas sinteticas")
+    parser.add_argument("--cast-size", type=int, default=40, help="Maximo de actores por fila sintetica")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        values = column_values(args.file, args.column)
+        source = f"{args.file}:{args.column}"
+    else:
+        values = synthetic_cast(args.rows, args.cast_size)
+        source = f"sintetico ({args.rows} filas, hasta {args.cast_size} actores)"
+
+    for value in values:
+        if literal_names(value) != names_with_literal_eval(value):
+            print(f"❌ Resultados distintos para: {value[:200]}")
+            sys.exit(1)
+
+    size = sum(len(value) for value in values) / (1024 * 1024)
+    baseline = measure(names_with_literal_eval, values, args.repeat)
+    scanner = measure(literal_names, values, args.repeat)
+    print(f"Datos: {source}, {len(values)} valores, {size:.1f} MiB")
+    print(f"ast.literal_eval: {baseline:.3f}s ({len(values) / baseline:,.0f} valores/s)")
+    print(f"literal_scanner:  {scanner:.3f}s ({len(values) / scanner:,.0f} valores/s)")
+    print(f"Speedup: {baseline / scanner:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
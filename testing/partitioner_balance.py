@@ -0,0 +1,55 @@
+"""
+Compara los particionadores de common.partitioner: que tan pareja queda la
+carga entre nodos y cuantas claves cambian de nodo al pasar de N a N+1 nodos.
+
+Uso (desde la raiz del repo):
+    python testing/partitioner_balance.py
+    python testing/partitioner_balance.py --file data/ratings_small.csv --column movieId --nodes 4
+"""
+import argparse
+import random
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.partitioner import PARTITIONERS, make_partitioner
+
+
+def synthetic_ids(rows, seed=0):
+    """Ids con la forma de TMDB: muchos chicos, algunos muy grandes y varios multiplos de 10."""
+    rng = random.Random(seed)
+    return [rng.choice((rng.randint(1, 5000), rng.randint(1, 500) * 10, rng.randint(100000, 470000))) for _ in range(rows)]
+
+
+def column_ids(filepath, column):
+    import pandas as pd
+    return [int(value) for value in pd.read_csv(filepath, usecols=[column])[column].dropna()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="CSV del que tomar los ids (por defecto, ids sinteticos)")
+    parser.add_argument("--column", default="id")
+    parser.add_argument("--rows", type=int, default=100000, help="Filas sinteticas")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--virtual-nodes", type=int, default=None)
+    args = parser.parse_args()
+
+    ids = column_ids(args.file, args.column) if args.file else synthetic_ids(args.rows)
+    keys = set(ids)
+    print(f"{len(ids)} filas, {len(keys)} claves distintas, {args.nodes} -> {args.nodes + 1} nodos")
+
+    for name in PARTITIONERS:
+        before = make_partitioner(name, args.nodes, args.virtual_nodes)
+        after = make_partitioner(name, args.nodes + 1, args.virtual_nodes)
+        load = Counter(before.partition(key) for key in ids)
+        mean = len(ids) / args.nodes
+        moved = sum(1 for key in keys if before.partition(key) != after.partition(key))
+        print(f"{name:>10}: nodo mas cargado {max(load.values()) / mean:.2f}x la media, "
+              f"claves movidas {moved / len(keys):.1%} (ideal {1 / (args.nodes + 1):.1%})")
+
+
+if __name__ == "__main__":
+    main()
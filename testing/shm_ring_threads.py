@@ -0,0 +1,77 @@
+"""
+Prueba de common.shm_ring con varios threads de un mismo proceso publicando y
+consumiendo del mismo anillo (como el join y su drain, o pipeline_local
+--mode threads): verifica que lleguen todos los mensajes, sin perdidas ni
+duplicados.
+
+Uso (desde la raiz del repo):
+    python testing/shm_ring_threads.py
+    python testing/shm_ring_threads.py --producers 4 --consumers 2 --messages 50000 --ring-size 4096
+"""
+import argparse
+import sys
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.shm_ring import ShmRing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--producers", type=int, default=2)
+    parser.add_argument("--consumers", type=int, default=1)
+    parser.add_argument("--messages", type=int, default=20000, help="Mensajes por productor")
+    parser.add_argument("--ring-size", type=int, default=4096, help="Bytes del anillo (chico para forzar esperas y vueltas)")
+    args = parser.parse_args()
+    # Cambios de thread muy seguidos, para que se intercalen dentro de put/get
+    sys.setswitchinterval(1e-6)
+
+    ring = ShmRing(f"test_threads_{uuid.uuid4().hex}", size=args.ring_size)
+    received = Counter()
+    received_lock = threading.Lock()
+    done = threading.Event()
+
+    def produce(producer):
+        for i in range(args.messages):
+            ring.put(f"{producer}:{i}".encode())
+
+    def consume():
+        while True:
+            body = ring.get(timeout=0.05)
+            if body is None:
+                if done.is_set():
+                    return
+                continue
+            with received_lock:
+                received[body.decode()] += 1
+
+    try:
+        consumers = [threading.Thread(target=consume) for _ in range(args.consumers)]
+        producers = [threading.Thread(target=produce, args=(p,)) for p in range(args.producers)]
+        for thread in consumers + producers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+        done.set()
+        for thread in consumers:
+            thread.join()
+    finally:
+        ring.unlink()
+
+    expected = {f"{p}:{i}" for p in range(args.producers) for i in range(args.messages)}
+    missing = len(expected - set(received))
+    duplicated = sum(1 for count in received.values() if count > 1)
+    unexpected = len(set(received) - expected)
+    total = args.producers * args.messages
+    print(f"{sum(received.values())}/{total} mensajes recibidos, {missing} perdidos, "
+          f"{duplicated} duplicados, {unexpected} inesperados")
+    if missing or duplicated or unexpected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()